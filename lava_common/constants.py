@@ -44,6 +44,15 @@ SCP_DOWNLOAD_CHUNK_SIZE = 32768
 # Files here are for download using the Apache /tmp alias.
 DISPATCHER_DOWNLOAD_DIR = "/var/lib/lava/dispatcher/tmp"
 
+# dispatcher download cache directory, shared by every jobs
+DISPATCHER_CACHE_DIR = "/var/lib/lava/dispatcher/cache"
+
+# dispatcher mirrors of the git test definition repositories
+DISPATCHER_GIT_MIRROR_DIR = "/var/lib/lava/dispatcher/git"
+
+# dispatcher port reservations, shared by every jobs
+DISPATCHER_PORTS_DIR = "/var/lib/lava/dispatcher/ports"
+
 # Distinctive prompt characters which can
 # help distinguish status messages from shell prompts.
 DISTINCTIVE_PROMPT_CHARACTERS = "\\:"
@@ -54,6 +63,13 @@ LAVA_MULTINODE_SYSTEM_TIMEOUT = 90
 # Default Action timeout
 ACTION_TIMEOUT = 30
 
+# Grace period before timing out a stuck action running in a thread
+CONCURRENT_GRACE = 10
+
+# Timeout of each network operation (connection, read or remote command) of
+# the download actions, which can run in a thread
+DOWNLOAD_REQUEST_TIMEOUT = 30
+
 # Android tmp directory
 ANDROID_TMP_DIR = "/data/local/tmp"
 
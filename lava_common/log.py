@@ -27,6 +27,7 @@ import logging
 import multiprocessing
 import requests
 import signal
+import threading
 import time
 
 from lava_common.compat import yaml_dump
@@ -92,7 +93,8 @@ def sender(conn, url: str, token: str) -> None:
                 if data == b"":
                     leaving = True
                 else:
-                    records.append(data.decode("utf-8"))
+                    # A batch of records is separated by new lines
+                    records.extend(data.decode("utf-8").split("\n"))
 
             records_limit = len(records) >= MAX_RECORDS
             time_limit = (time.time() - last_call) >= MAX_TIME
@@ -142,6 +144,7 @@ class YAMLLogger(logging.Logger):
         self.handler = None
         self.markers = {}
         self.line = 0
+        self.local = threading.local()
 
     def addHTTPHandler(self, url, token):
         self.handler = HTTPHandler(url, token)
@@ -154,9 +157,36 @@ class YAMLLogger(logging.Logger):
             self.removeHandler(self.handler)
             self.handler = None
 
+    @contextlib.contextmanager
+    def buffer(self, records):
+        """
+        Append the messages logged by the current thread to records instead of
+        emitting them. The messages are emitted later on by emit_records().
+        """
+        self.local.records = records
+        try:
+            yield
+        finally:
+            self.local.records = None
+
+    @property
+    def size(self):
+        """
+        Size of the messages logged or emitted by the current thread, used to
+        profile the actions.
+        """
+        return getattr(self.local, "size", 0)
+
+    def _add_size(self, data_strs):
+        self.local.size = self.size + sum(len(data_str) + 1 for data_str in data_strs)
+
+    def emit_records(self, records):
+        self._add_size(data_str for (_, data_str) in records)
+        for (level, data_str) in records:
+            self.line += 1
+            self._log(level, data_str, ())
+
     def log_message(self, level, level_name, message, *args, **kwargs):
-        # Increment the line count
-        self.line += 1
         # Build the dictionary
         data = {"dt": datetime.datetime.utcnow().isoformat(), "lvl": level_name}
 
@@ -169,8 +199,37 @@ class YAMLLogger(logging.Logger):
             data["ns"] = kwargs["namespace"]
 
         data_str = dump(data)
+        self._add_size([data_str])
+        records = getattr(self.local, "records", None)
+        if records is not None:
+            records.append((level, data_str))
+            return
+        # Increment the line count
+        self.line += 1
         self._log(level, data_str, ())
 
+    def log_messages(self, level, level_name, messages, **kwargs):
+        """
+        Log a batch of messages in a single logging record, the dumped messages
+        being separated by new lines.
+        """
+        dt = datetime.datetime.utcnow().isoformat()
+        data_strs = []
+        for message in messages:
+            data = {"dt": dt, "lvl": level_name, "msg": message}
+            if level_name == "feedback" and "namespace" in kwargs:
+                data["ns"] = kwargs["namespace"]
+            data_strs.append(dump(data))
+        if not data_strs:
+            return
+        self._add_size(data_strs)
+        records = getattr(self.local, "records", None)
+        if records is not None:
+            records.extend((level, data_str) for data_str in data_strs)
+            return
+        self.line += len(data_strs)
+        self._log(level, "\n".join(data_strs), ())
+
     def exception(self, exc, *args, **kwargs):
         self.log_message(logging.ERROR, "exception", exc, *args, **kwargs)
 
@@ -199,21 +258,21 @@ class YAMLLogger(logging.Logger):
         self.log_message(logging.INFO, "event", message, *args, **kwargs)
 
     def marker(self, message, *args, **kwargs):
-        case = message["case"]
+        # Test shells can run in parallel, one for each namespace
+        key = (kwargs.get("namespace"), message["case"])
         m_type = message["type"]
-        self.markers.setdefault(case, {})[m_type] = self.line - 1
+        self.markers.setdefault(key, {})[m_type] = self.line - 1
 
     def results(self, results, *args, **kwargs):
         if "extra" in results and "level" not in results:
             raise Exception("'level' is mandatory when 'extra' is used")
 
         # Extract and append test case markers
-        case = results["case"]
-        markers = self.markers.get(case)
+        key = (kwargs.get("namespace"), results["case"])
+        markers = self.markers.pop(key, None)
         if markers is not None:
             test_case = markers.get("test_case")
             results["starttc"] = markers.get("start_test_case", test_case)
             results["endtc"] = markers.get("end_test_case", test_case)
-            del self.markers[case]
 
         self.log_message(logging.INFO, "results", results, *args, **kwargs)
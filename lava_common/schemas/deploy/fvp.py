@@ -30,6 +30,7 @@ def schema():
         Required("to"): "fvp",
         Optional("ramdisk"): {
             Optional("install_overlay"): bool,
+            Optional("append_overlay"): bool,
             Optional("compression"): str,
             Optional("header"): "u-boot",
         },
@@ -34,9 +34,11 @@ def schema():
         ],
         # Optional("parameters"):
         Optional("lava-signal"): Any("kmsg", "stdout"),
+        Optional("parallel"): bool,
     }
 
     base = {
+        Optional("parallel-namespaces"): [str],
         Required("definitions"): [
             Any(
                 {
@@ -88,6 +90,6 @@ def schema():
                     **common,
                 },
             )
-        ]
+        ],
     }
     return {**test.schema(), **base}
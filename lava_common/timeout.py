@@ -21,9 +21,13 @@
 import datetime
 import time
 import signal
+import threading
 from contextlib import contextmanager
 from lava_common.constants import ACTION_TIMEOUT
-from lava_common.exceptions import JobError, ConfigurationError
+from lava_common.exceptions import JobCanceled, JobError, ConfigurationError
+
+# Event set to stop the actions running in the current thread
+_thread_local = threading.local()
 
 
 class Timeout:
@@ -36,12 +40,16 @@ class Timeout:
     the timeout.
     If a connection is set, this timeout is used per pexpect operation on that connection.
     If a connection is not set, this timeout applies for the entire run function of the action.
+    Signals are only delivered to the main thread: actions running in another
+    thread should call check() regularly to enforce the timeout, and bound
+    every blocking call with remaining().
     """
 
     def __init__(self, name, duration=ACTION_TIMEOUT, exception=JobError):
         self.name = name
         self.start = 0
         self.elapsed_time = -1
+        self.max_end_time = None
         self.duration = duration  # Actions can set timeouts higher than the clamp.
         self.exception = exception
 
@@ -74,6 +82,33 @@ class Timeout:
         duration = int(time.time() - self.start)
         raise self.exception("%s timed out after %s seconds" % (self.name, duration))
 
+    @classmethod
+    def set_thread_stop(cls, event):
+        """
+        Set the event that stops the actions running in the current thread.
+        """
+        _thread_local.stop = event
+
+    def check(self):
+        """
+        Raise the timeout exception if the action is running in a thread and
+        the timeout is exceeded, or JobCanceled if the thread was stopped.
+        """
+        stop = getattr(_thread_local, "stop", None)
+        if stop is not None and stop.is_set():
+            raise JobCanceled("%s canceled" % self.name)
+        if self.max_end_time is not None and time.time() >= self.max_end_time:
+            self._timed_out(None, None)
+
+    def remaining(self):
+        """
+        Return the number of seconds before the timeout of an action running
+        in a thread, None otherwise: the alarm will interrupt the action.
+        """
+        if self.max_end_time is None:
+            return None
+        return max(0, self.max_end_time - time.time())
+
     @contextmanager
     def __call__(self, parent, action_max_end_time):
         self.start = time.time()
@@ -83,6 +118,18 @@ class Timeout:
             # action_max_end_time is None when called by the job class directly
             max_end_time = min(action_max_end_time, max_end_time)
 
+        if threading.current_thread() is not threading.main_thread():
+            # Neither alarm nor signal handlers can be used outside of the main
+            # thread: check() will enforce the timeout.
+            self.max_end_time = max_end_time
+            try:
+                self.check()
+                yield max_end_time
+            finally:
+                self.elapsed_time = time.time() - self.start
+            return
+
+        self.max_end_time = None
         duration = round(max_end_time - self.start)
         if duration <= 0:
             # If duration is lower than 0, then the timeout should be raised now.
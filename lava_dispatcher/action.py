@@ -19,18 +19,23 @@
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
 from collections import OrderedDict
+import concurrent.futures
+import contextlib
 import logging
 import copy
 from functools import reduce
 import pexpect
+import resource
 import time
 import types
 import traceback
 import shlex
 import subprocess  # nosec - internal
+import threading
 import warnings
 
 from lava_common.decorators import nottest
+from lava_common.constants import CONCURRENT_GRACE
 from lava_common.timeout import Timeout
 from lava_common.exceptions import (
     LAVABug,
@@ -42,6 +47,12 @@ from lava_common.exceptions import (
 from lava_common.log import YAMLLogger
 from lava_dispatcher.utils.strings import seconds_to_str
 
+# Types of the namespace data values that are not copied
+IMMUTABLE_TYPES = (str, bytes, int, float, bool)
+
+# Concurrent actions are sharing the namespace data
+NAMESPACE_LOCK = threading.RLock()
+
 
 class InternalObject:
     """
@@ -172,16 +183,59 @@ class Pipeline:
         return reduce(lambda a, b: a + b, sub_action_errors)
 
     def validate_actions(self):
-        for action in self.actions:
-            try:
-                action.validate()
-            except JobError as exc:
-                action.errors = "%s %s: %s" % (action.level, action.name, str(exc))
+        index = 0
+        while index < len(self.actions):
+            actions = self._concurrent_actions(index)
+            index += len(actions)
+            if len(actions) > 1:
+                self._validate_concurrently(actions)
+            else:
+                self._validate_action(actions[0])
 
         # If this is the root pipeline, raise the errors
         if self.parent is None and self.errors:
             raise JobError("Invalid job data: %s\n" % self.errors)
 
+    def _validate_action(self, action):
+        try:
+            action.validate()
+        except JobError as exc:
+            action.errors = "%s %s: %s" % (action.level, action.name, str(exc))
+
+    def _validate_concurrently(self, actions):
+        """
+        Validate the actions in threads, at most "parallel_downloads" at a
+        time: checking that the resources exist is network bound.
+        The logs of each action are buffered and emitted in the order of the
+        pipeline, like the errors. The first exception, in the order of the
+        pipeline, is raised once every action has been validated.
+        """
+
+        def validate(action):
+            records = []
+            with contextlib.ExitStack() as stack:
+                if isinstance(action.logger, YAMLLogger):
+                    stack.enter_context(action.logger.buffer(records))
+                try:
+                    self._validate_action(action)
+                except Exception as exc:
+                    return (records, exc)
+            return (records, None)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            self._parallel_downloads(), thread_name_prefix="validate"
+        ) as executor:
+            results = list(executor.map(validate, actions))
+
+        exc = None
+        for (action, (records, action_exc)) in zip(actions, results):
+            if isinstance(action.logger, YAMLLogger):
+                action.logger.emit_records(records)
+            if exc is None:
+                exc = action_exc
+        if exc is not None:
+            raise exc
+
     def cleanup(self, connection):
         """
         Recurse through internal pipelines running action.cleanup(),
@@ -221,77 +275,289 @@ class Pipeline:
         return None
 
     def run_actions(self, connection, max_end_time):
-        for action in self.actions:
-            failed = False
-            namespace = action.parameters.get("namespace", "common")
-            # Begin the action
-            try:
-                parent = self.parent if self.parent else self.job
-                with action.timeout(parent, max_end_time) as action_max_end_time:
-                    # Add action start timestamp to the log message
-                    # Log in INFO for root actions and in DEBUG for the other actions
-                    timeout = seconds_to_str(action_max_end_time - action.timeout.start)
-                    msg = "start: %s %s (timeout %s) [%s]" % (
-                        action.level,
-                        action.name,
-                        timeout,
-                        namespace,
+        index = 0
+        while index < len(self.actions):
+            actions = self._concurrent_actions(index)
+            index += len(actions)
+            if len(actions) > 1:
+                new_connection = self._run_concurrently(
+                    actions, connection, max_end_time
+                )
+            else:
+                new_connection = self._run_action(actions[0], connection, max_end_time)
+            if new_connection:
+                connection = new_connection
+        return connection
+
+    def _parallel_downloads(self):
+        if self.job is None:
+            return 1
+        return self.job.parameters.get("dispatcher", {}).get("parallel_downloads", 1)
+
+    def _concurrent_actions(self, index):
+        """
+        Return the consecutive concurrent actions starting at index.
+        Concurrent actions are only grouped in the main thread, nested
+        pipelines are run sequentially.
+        """
+        actions = [self.actions[index]]
+        if not actions[0].concurrent or self._parallel_downloads() < 2:
+            return actions
+        if threading.current_thread() is not threading.main_thread():
+            return actions
+        for action in self.actions[index + 1 :]:
+            if not action.concurrent:
+                break
+            actions.append(action)
+        return actions
+
+    def _run_concurrently(self, actions, connection, max_end_time):
+        """
+        Run the actions in threads, at most "parallel_downloads" at a time.
+        The logs of each action are buffered and emitted in the order of the
+        pipeline when the action ends. The first failure, in the order of the
+        pipeline, is raised once every started action has ended.
+        If the parent action fails in the main thread (timeout or
+        cancelation), the actions are stopped and joined before raising.
+        """
+        semaphore = threading.BoundedSemaphore(self._parallel_downloads())
+        canceled = threading.Event()
+        threads = [
+            ActionThread(self, action, connection, max_end_time, semaphore, canceled)
+            for action in actions
+        ]
+        for thread in threads:
+            thread.shared = len(threads) > 1
+            thread.start()
+
+        try:
+            for thread in threads:
+                self._join_thread(thread)
+        except BaseException:
+            canceled.set()
+            for thread in threads:
+                thread.stop.set()
+            for thread in threads:
+                with contextlib.suppress(Exception):
+                    self._join_thread(thread)
+            raise
+
+        exc = None
+        new_connection = None
+        for thread in threads:
+            if thread.exc is not None:
+                if exc is None:
+                    exc = thread.exc
+            elif exc is None and thread.connection:
+                new_connection = thread.connection
+
+        if exc is not None:
+            raise exc
+        return new_connection
+
+    def _join_thread(self, thread):
+        """
+        Wait for the action running in the thread and emit its logs.
+        Actions running in a thread are enforcing their own timeout while the
+        parent timeout is still active in the main thread. Every blocking
+        call of these actions is bounded by their timeout: an action still
+        running after the grace period is stopped and timed out.
+        """
+        action = thread.action
+        try:
+            while thread.is_alive():
+                thread.join(1)
+                end = action.timeout.max_end_time
+                if end is None or time.time() <= end + CONCURRENT_GRACE:
+                    continue
+                if not thread.stop.is_set():
+                    thread.stop.set()
+                    thread.timed_out = True
+                elif time.time() > end + 2 * CONCURRENT_GRACE:
+                    action.logger.error(
+                        "%s is still running after its timeout", action.name
                     )
-                    if self.parent is None:
-                        action.logger.info(msg)
-                    else:
-                        action.logger.debug(msg)
-
-                    new_connection = action.run(connection, action_max_end_time)
-            except LAVATimeoutError as exc:
-                action.logger.exception(str(exc))
-                # allows retries without setting errors, which make the job incomplete.
-                failed = True
-                action.results = {"fail": str(exc)}
-                if action.timeout.can_skip(action.parameters):
-                    if self.parent is None:
-                        action.logger.warning(
-                            "skip_timeout is set for %s - continuing to next action block."
-                            % (action.name)
-                        )
-                    else:
-                        raise
-                    new_connection = None
-                else:
-                    raise TestError(str(exc))
-            except LAVAError as exc:
-                action.logger.exception(str(exc))
-                # allows retries without setting errors, which make the job incomplete.
-                failed = True
-                action.results = {"fail": str(exc)}
-                self._diagnose(connection)
-                raise
-            except Exception as exc:
-                action.logger.exception(traceback.format_exc())
-                # allows retries without setting errors, which make the job incomplete.
-                failed = True
-                action.results = {"fail": str(exc)}
-                # Raise a LAVABug that will be correctly classified later
-                raise LAVABug(str(exc))
-            finally:
-                # Add action end timestamp to the log message
-                duration = round(action.timeout.elapsed_time)
-                msg = "end: %s %s (duration %s) [%s]" % (
+                    break
+            if thread.timed_out:
+                duration = int(time.time() - action.timeout.start)
+                thread.exc = action.timeout.exception(
+                    "%s timed out after %s seconds" % (action.timeout.name, duration)
+                )
+                thread.canceled.set()
+        finally:
+            thread.emit_records()
+        if thread.timed_out:
+            action.logger.error(str(thread.exc))
+
+    def _run_action(self, action, connection, max_end_time):
+        failed = False
+        namespace = action.parameters.get("namespace", "common")
+        (cpu_time, log_size) = self._usage(action)
+        # Begin the action
+        try:
+            parent = self.parent if self.parent else self.job
+            with action.timeout(parent, max_end_time) as action_max_end_time:
+                # Add action start timestamp to the log message
+                # Log in INFO for root actions and in DEBUG for the other actions
+                timeout = seconds_to_str(action_max_end_time - action.timeout.start)
+                msg = "start: %s %s (timeout %s) [%s]" % (
                     action.level,
                     action.name,
-                    seconds_to_str(duration),
+                    timeout,
                     namespace,
                 )
                 if self.parent is None:
                     action.logger.info(msg)
                 else:
                     action.logger.debug(msg)
-                # set results including retries and failed actions
-                action.log_action_results(fail=failed)
 
-            if new_connection:
-                connection = new_connection
-        return connection
+                new_connection = action.run(connection, action_max_end_time)
+        except LAVATimeoutError as exc:
+            action.logger.exception(str(exc))
+            # allows retries without setting errors, which make the job incomplete.
+            failed = True
+            action.results = {"fail": str(exc)}
+            if action.timeout.can_skip(action.parameters):
+                if self.parent is None:
+                    action.logger.warning(
+                        "skip_timeout is set for %s - continuing to next action block."
+                        % (action.name)
+                    )
+                else:
+                    raise
+                new_connection = None
+            else:
+                raise TestError(str(exc))
+        except LAVAError as exc:
+            action.logger.exception(str(exc))
+            # allows retries without setting errors, which make the job incomplete.
+            failed = True
+            action.results = {"fail": str(exc)}
+            self._diagnose(connection)
+            raise
+        except Exception as exc:
+            action.logger.exception(traceback.format_exc())
+            # allows retries without setting errors, which make the job incomplete.
+            failed = True
+            action.results = {"fail": str(exc)}
+            # Raise a LAVABug that will be correctly classified later
+            raise LAVABug(str(exc))
+        finally:
+            # Add action end timestamp to the log message
+            duration = round(action.timeout.elapsed_time)
+            msg = "end: %s %s (duration %s) [%s]" % (
+                action.level,
+                action.name,
+                seconds_to_str(duration),
+                namespace,
+            )
+            if self.parent is None:
+                action.logger.info(msg)
+            else:
+                action.logger.debug(msg)
+            # set results including retries and failed actions
+            action.log_action_results(fail=failed)
+            # Accumulate the resources used by each try
+            usage = self._usage(action)
+            profile = action.profile
+            profile["duration"] = profile.get("duration", 0) + max(
+                0, action.timeout.elapsed_time
+            )
+            profile["cpu"] = profile.get("cpu", 0) + usage[0] - cpu_time
+            profile["logged"] = profile.get("logged", 0) + usage[1] - log_size
+            profile.setdefault("downloaded", 0)
+            if getattr(threading.current_thread(), "shared", False):
+                profile["cpu_approximate"] = True
+
+        return new_connection
+
+    def _usage(self, action):
+        """
+        Return the cpu time of the terminated subprocesses and the size of the
+        logs of the current thread.
+        The cpu time is global to the dispatcher process: for actions running
+        alongside other concurrent actions, it includes theirs and the profile
+        is flagged with "cpu_approximate".
+        """
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        size = action.logger.size if isinstance(action.logger, YAMLLogger) else 0
+        return (usage.ru_utime + usage.ru_stime, size)
+
+    def profile(self):
+        """
+        Return the profile of the actions that did run, indexed by level,
+        recursing through the internal pipelines.
+        The bytes downloaded by the internal actions are added to their
+        parent.
+        """
+        profiles = {}
+        for action in self.actions:
+            if not action.profile:
+                continue
+            current = dict(action.profile)
+            current["duration"] = round(current["duration"], 3)
+            current["cpu"] = round(current["cpu"], 3)
+            if action.pipeline is not None:
+                sub_profiles = action.pipeline.profile()
+                profiles.update(sub_profiles)
+                current["downloaded"] += sum(
+                    sub_profiles[sub.level]["downloaded"]
+                    for sub in action.pipeline.actions
+                    if sub.level in sub_profiles
+                )
+            profiles[action.level] = current
+        return profiles
+
+
+class ActionThread(threading.Thread):
+    """
+    Run an action of a pipeline in a thread, buffering the logs.
+    """
+
+    def __init__(self, pipeline, action, connection, max_end_time, semaphore, canceled):
+        super().__init__(name=action.name, daemon=True)
+        self.pipeline = pipeline
+        self.action = action
+        self.connection = connection
+        self.max_end_time = max_end_time
+        self.semaphore = semaphore
+        self.canceled = canceled
+        self.records = []
+        self.emitted = 0
+        self.exc = None
+        # Stop this action only: see Timeout.check()
+        self.stop = threading.Event()
+        self.timed_out = False
+        # Running alongside other actions
+        self.shared = False
+        # Only set when the action is running
+        self.action.timeout.max_end_time = None
+
+    def run(self):
+        Timeout.set_thread_stop(self.stop)
+        with self.semaphore:
+            # Do not start new actions after a failure
+            if self.canceled.is_set():
+                self.connection = None
+                return
+            logger = self.action.logger
+            with contextlib.ExitStack() as stack:
+                if isinstance(logger, YAMLLogger):
+                    stack.enter_context(logger.buffer(self.records))
+                try:
+                    self.connection = self.pipeline._run_action(
+                        self.action, self.connection, self.max_end_time
+                    )
+                except Exception as exc:
+                    self.exc = exc
+                    self.canceled.set()
+
+    def emit_records(self):
+        logger = self.action.logger
+        if isinstance(logger, YAMLLogger):
+            records = self.records[self.emitted :]
+            self.emitted += len(records)
+            logger.emit_records(records)
 
 
 class CommandLogger:
@@ -354,6 +620,8 @@ class Action:
         self.connection_timeout = Timeout(self.name, exception=self.timeout_exception)
         self.character_delay = 0
         self.force_prompt = False
+        # Resources used by the action, updated after each run
+        self.profile = {}
 
     # Section
     section = None
@@ -370,6 +638,8 @@ class Action:
     timeout_exception = JobError
     # Exception to raise when a command run by the action fails
     command_exception = JobError
+    # Consecutive concurrent actions of a pipeline can run in parallel
+    concurrent = False
 
     @property
     def data(self):
@@ -842,6 +1112,7 @@ class Action:
                 "parameters",
                 "SignalDirector",
                 "signal_director",
+                "profile",
             ]
         )
         for attr in attrs - skip_set:
@@ -905,7 +1176,8 @@ class Action:
             data[namespace][action][label]
         :param deepcopy: If deepcopy is False, the reference is used - meaning that certain operations on the
             namespaced data values other than simple strings will be able to modify the data without calls to
-            set_namespace_data.
+            set_namespace_data. Use it to read large values without copying them, and modify them with
+            set_namespace_data, update_namespace_data or append_namespace_data.
         :param parameters: Pass parameters when calling get_namespace_data from populate() as the parameters
             will not have been set in the action at that point.
         """
@@ -914,7 +1186,11 @@ class Action:
         value = self.data.get(namespace, {}).get(action, {}).get(label, {}).get(key)
         if value is None:
             return None
-        return copy.deepcopy(value) if deepcopy else value
+        # Immutable values are returned as-is: copying them is a no-op
+        if not deepcopy or isinstance(value, IMMUTABLE_TYPES):
+            return value
+        with NAMESPACE_LOCK:
+            return copy.deepcopy(value)
 
     def set_namespace_data(self, action, label, key, value, parameters=None):
         """
@@ -934,10 +1210,45 @@ class Action:
         namespace = params["namespace"]
         if not label or not key:
             raise LAVABug("Invalid call to set_namespace_data: %s" % action)
-        self.data.setdefault(namespace, {})
-        self.data[namespace].setdefault(action, {})
-        self.data[namespace][action].setdefault(label, {})
-        self.data[namespace][action][label][key] = value
+        with NAMESPACE_LOCK:
+            self.data.setdefault(namespace, {})
+            self.data[namespace].setdefault(action, {})
+            self.data[namespace][action].setdefault(label, {})
+            self.data[namespace][action][label][key] = value
+
+    def update_namespace_data(self, action, label, key, value, parameters=None):
+        """
+        Merge the value (a dict) into the dict stored in the namespace data, in
+        place, instead of copying and setting the whole dict again.
+        The parameters are the same as set_namespace_data.
+        """
+        with NAMESPACE_LOCK:
+            current = self.get_namespace_data(
+                action, label, key, deepcopy=False, parameters=parameters
+            )
+            if current is None:
+                self.set_namespace_data(
+                    action, label, key, dict(value), parameters=parameters
+                )
+            else:
+                current.update(value)
+
+    def append_namespace_data(self, action, label, key, value, parameters=None):
+        """
+        Append the value to the list stored in the namespace data, in place,
+        instead of copying and setting the whole list again.
+        The parameters are the same as set_namespace_data.
+        """
+        with NAMESPACE_LOCK:
+            current = self.get_namespace_data(
+                action, label, key, deepcopy=False, parameters=parameters
+            )
+            if current is None:
+                self.set_namespace_data(
+                    action, label, key, [value], parameters=parameters
+                )
+            else:
+                current.append(value)
 
     def wait(self, connection, max_end_time=None):
         if not connection:
@@ -37,8 +37,11 @@ from lava_dispatcher.utils.filesystem import (
 )
 from lava_dispatcher.utils.shell import which
 from lava_dispatcher.utils.compression import (
+    append_cpio,
     compress_file,
+    compression_threads,
     cpio,
+    cpio_entries,
     decompress_file,
     untar_file,
     uncpio,
@@ -410,8 +413,13 @@ class ExtractRootfs(Action):
         root = self.get_namespace_data(
             action="download-action", label=self.param_key, key="file"
         )
-        root_dir = self.mkdtemp()
-        untar_file(root, root_dir)
+        # The download action might have extracted the tarball already
+        root_dir = self.get_namespace_data(
+            action="download-action", label=self.param_key, key="extracted"
+        )
+        if root_dir is None:
+            root_dir = self.mkdtemp()
+            untar_file(root, root_dir)
         self.set_namespace_data(
             action="extract-rootfs", label="file", key=self.file_key, value=root_dir
         )
@@ -536,6 +544,9 @@ class ExtractRamdisk(Action):
     applies the overlay and then leaves the ramdisk open
     for other actions to modify. Needs CompressRamdisk to
     recreate the ramdisk with modifications.
+    With "append_overlay", the ramdisk is not unpacked: the
+    directory starts empty and CompressRamdisk appends it
+    to the ramdisk as a new cpio archive.
     """
 
     name = "extract-overlay-ramdisk"
@@ -594,8 +605,21 @@ class ExtractRamdisk(Action):
         else:
             # give the file a predictable name
             shutil.move(ramdisk, ramdisk_compressed_data)
-        ramdisk_data = decompress_file(ramdisk_compressed_data, compression)
-        uncpio(ramdisk_data, extracted_ramdisk)
+        entries = None
+        if self.parameters["ramdisk"].get("append_overlay"):
+            entries = cpio_entries(
+                ramdisk_compressed_data, compression, compression_threads(self.job)
+            )
+            if entries is None:
+                self.logger.warning("Unable to list the ramdisk, extracting it")
+        if entries is None:
+            ramdisk_data = decompress_file(
+                ramdisk_compressed_data, compression, compression_threads(self.job)
+            )
+            uncpio(ramdisk_data, extracted_ramdisk)
+        else:
+            # CompressRamdisk appends extracted_ramdisk to the ramdisk
+            ramdisk_data = ramdisk_compressed_data
 
         # tell other actions where the unpacked ramdisk can be found
         self.set_namespace_data(
@@ -607,6 +631,9 @@ class ExtractRamdisk(Action):
         self.set_namespace_data(
             action=self.name, label="ramdisk_file", key="file", value=ramdisk_data
         )
+        self.set_namespace_data(
+            action=self.name, label="ramdisk_file", key="entries", value=entries
+        )
         return connection
 
 
@@ -688,12 +715,35 @@ class CompressRamdisk(Action):
                     action=self.name, label="file", key="preseed_local", value=filename
                 )
 
-        self.logger.info("Building ramdisk %s containing %s", ramdisk_data, ramdisk_dir)
-        self.logger.debug(">> %s", cpio(ramdisk_dir, ramdisk_data))
-
         # we need to compress the ramdisk with the same method is was submitted with
         compression = self.parameters["ramdisk"].get("compression")
-        final_file = compress_file(ramdisk_data, compression)
+        entries = self.get_namespace_data(
+            action="extract-overlay-ramdisk",
+            label="ramdisk_file",
+            key="entries",
+            deepcopy=False,
+        )
+        if entries is None:
+            self.logger.info(
+                "Building ramdisk %s containing %s", ramdisk_data, ramdisk_dir
+            )
+            self.logger.debug(">> %s", cpio(ramdisk_dir, ramdisk_data))
+            final_file = compress_file(
+                ramdisk_data, compression, compression_threads(self.job)
+            )
+        else:
+            self.logger.info("Appending %s to ramdisk %s", ramdisk_dir, ramdisk_data)
+            self.logger.debug(
+                ">> %s",
+                append_cpio(
+                    ramdisk_dir,
+                    ramdisk_data,
+                    compression,
+                    compression_threads(self.job),
+                    entries,
+                ),
+            )
+            final_file = ramdisk_data
 
         tftp_dir = os.path.dirname(
             self.get_namespace_data(
@@ -904,14 +954,26 @@ class AppendOverlays(Action):
         )
         self.logger.info("Modifying %r", image)
         tempdir = self.mkdtemp()
-        # Some images are kept compressed. We should decompress first
-        if compression and not decompressed:
-            self.logger.debug("* decompressing (%s)", compression)
-            image = decompress_file(image, compression)
-        # extract the archive
-        self.logger.debug("* extracting %r", image)
-        uncpio(image, tempdir)
-        os.unlink(image)
+        if decompressed:
+            compression = None
+        # With "append_overlay", the overlays are appended to the image as a
+        # new cpio archive, without unpacking the image.
+        entries = None
+        if self.params.get("append_overlay"):
+            entries = cpio_entries(image, compression, compression_threads(self.job))
+            if entries is None:
+                self.logger.warning("Unable to list %r, extracting it", image)
+        if entries is None:
+            # Some images are kept compressed. We should decompress first
+            if compression:
+                self.logger.debug("* decompressing (%s)", compression)
+                image = decompress_file(
+                    image, compression, compression_threads(self.job)
+                )
+            # extract the archive
+            self.logger.debug("* extracting %r", image)
+            uncpio(image, tempdir)
+            os.unlink(image)
 
         # Add overlays
         self.logger.debug("Overlays:")
@@ -936,12 +998,19 @@ class AppendOverlays(Action):
             # and does not contains '..'
             untar_file(overlay_image, extract_path)
 
+        if entries is not None:
+            self.logger.debug("* appending to %r (%s)", image, compression or "raw")
+            append_cpio(
+                tempdir, image, compression, compression_threads(self.job), entries
+            )
+            return
+
         # Recreating the archive
         self.logger.debug("* archiving %r", image)
         cpio(tempdir, image)
-        if compression and not decompressed:
+        if compression:
             self.logger.debug("* compressing (%s)", compression)
-            image = compress_file(image, compression)
+            image = compress_file(image, compression, compression_threads(self.job))
 
     def update_guestfs(self):
         image = self.get_namespace_data(
@@ -25,10 +25,13 @@
 
 import contextlib
 import errno
+import functools
 import math
 import os
 import pathlib
+import queue
 import shutil
+import threading
 import time
 import hashlib
 import requests
@@ -42,14 +45,22 @@ from lava_dispatcher.connections.serial import ConnectDevice
 from lava_common.exceptions import InfrastructureError, JobError, LAVABug
 from lava_dispatcher.action import Action, Pipeline
 from lava_dispatcher.logical import Deployment, RetryAction
-from lava_dispatcher.utils.compression import untar_file
+from lava_dispatcher.utils.cache import DownloadCache
+from lava_dispatcher.utils.compression import (
+    compression_threads,
+    decompress_command,
+    untar_file,
+)
 from lava_dispatcher.utils.filesystem import (
     copy_to_lxc,
     lava_lxc_home,
     copy_overlay_to_lxc,
 )
 from lava_dispatcher.utils.network import requests_retry
+from lava_dispatcher.utils.prefetch import prefetch_path, wait_for_prefetch
 from lava_common.constants import (
+    DISPATCHER_CACHE_DIR,
+    DOWNLOAD_REQUEST_TIMEOUT,
     FILE_DOWNLOAD_CHUNK_SIZE,
     HTTP_DOWNLOAD_CHUNK_SIZE,
     SCP_DOWNLOAD_CHUNK_SIZE,
@@ -60,6 +71,57 @@ from lava_dispatcher.actions.boot.u_boot import UBootEnterFastbootAction
 from urllib.parse import quote_plus, urlparse
 
 
+class ChunkWriter(threading.Thread):
+    """
+    Hash the downloaded chunks and write them (to the file or to the
+    decompression command) in a thread, so that the network and the CPU
+    overlap.
+    The thread does not log anything: the logs of actions running in a
+    thread are buffered per thread.
+    """
+
+    def __init__(self, fileobj, algorithms):
+        super().__init__(daemon=True)
+        self.fileobj = fileobj
+        self.hashes = {
+            # md5 is not being used for cryptography.
+            algorithm: hashlib.new(algorithm)  # nosec
+            for algorithm in algorithms
+        }
+        self.queue = queue.Queue(maxsize=64)
+        self.exc = None
+
+    def run(self):
+        while True:
+            buff = self.queue.get()
+            if buff is None:
+                return
+            # Drain the queue after an error
+            if self.exc is not None:
+                continue
+            try:
+                for hashobj in self.hashes.values():
+                    hashobj.update(buff)
+                self.fileobj.write(buff)
+            except Exception as exc:
+                self.exc = exc
+
+    def write(self, buff):
+        if self.exc is not None:
+            raise self.exc
+        self.queue.put(buff)
+
+    def close(self):
+        """
+        Wait for the pending chunks and return the checksums.
+        """
+        self.queue.put(None)
+        self.join()
+        if self.exc is not None:
+            raise self.exc
+        return {name: hashobj.hexdigest() for (name, hashobj) in self.hashes.items()}
+
+
 class DownloaderAction(RetryAction):
     """
     The retry pipeline for downloads.
@@ -69,6 +131,7 @@ class DownloaderAction(RetryAction):
     name = "download-retry"
     description = "download with retry"
     summary = "download-retry"
+    concurrent = True
 
     def __init__(self, key, path, params, uniquify=True):
         super().__init__()
@@ -146,6 +209,10 @@ class DownloadHandler(Action):
         "zstd": "unzstd",
     }
 
+    # Tarballs unpacked by the deploy actions: they are extracted while being
+    # downloaded, when tar is available.
+    extract_keys = ["nfsrootfs"]
+
     def __init__(self, key, path, url, uniquify=True, params=None):
         super().__init__()
         self.url = url
@@ -158,10 +225,30 @@ class DownloadHandler(Action):
             self.path = os.path.join(path, key)
         self.fname = None
         self.params = params
+        # http validators (ETag or Last-Modified) used by the download cache
+        self.validators = None
 
     def reader(self):
         raise LAVABug("'reader' function unimplemented")
 
+    def prefetched(self):
+        """
+        Return the path to the resource if lava-worker already downloaded it.
+        """
+        if not self.job.parameters.get("dispatcher", {}).get("prefetch", False):
+            return None
+        path = prefetch_path(self.job.tmp_dir, self.params["url"])
+        self.logger.debug("Looking for a resource prefetched by lava-worker")
+        path = wait_for_prefetch(path, self.timeout.check)
+        return None if path is None else str(path)
+
+    def prefetched_reader(self, fname):
+        with open(fname, "rb") as reader:
+            buff = reader.read(FILE_DOWNLOAD_CHUNK_SIZE)
+            while buff:
+                yield buff
+                buff = reader.read(FILE_DOWNLOAD_CHUNK_SIZE)
+
     def cleanup(self, connection):
         if os.path.exists(self.path):
             self.logger.debug("Cleaning up download directory: %s", self.path)
@@ -171,11 +258,60 @@ class DownloadHandler(Action):
         )
         super().cleanup(connection)
 
+    def _request_timeout(self):
+        """
+        Timeout of each network operation, bounded by the action timeout when
+        running in a thread.
+        """
+        remaining = self.timeout.remaining()
+        if remaining is None:
+            return DOWNLOAD_REQUEST_TIMEOUT
+        return max(1, min(DOWNLOAD_REQUEST_TIMEOUT, remaining))
+
+    def _wait_process(self, proc):
+        """
+        Wait for the process, killing it when the action times out.
+        """
+        try:
+            proc.wait(timeout=self.timeout.remaining())
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            self.timeout.check()
+            raise
+
     def _compression(self):
         if self.key == "ramdisk":
             return False
         return self.params.get("compression", False)
 
+    def _algorithms(self):
+        """
+        Only compute the checksums given in the job definition. Fallback to
+        sha256 to be able to identify the resource in the results.
+        """
+        algorithms = [
+            algorithm
+            for algorithm in ["md5", "sha256", "sha512"]
+            if self.params.get("%ssum" % algorithm)
+        ]
+        return algorithms or ["sha256"]
+
+    def _file_checksums(self, fname, algorithms):
+        """
+        Return the checksums of the given file.
+        """
+        hashes = {
+            # md5 is not being used for cryptography.
+            algorithm: hashlib.new(algorithm)  # nosec
+            for algorithm in algorithms
+        }
+        with open(fname, "rb") as f_in:
+            for buff in iter(lambda: f_in.read(HTTP_DOWNLOAD_CHUNK_SIZE), b""):
+                for hash_obj in hashes.values():
+                    hash_obj.update(buff)
+        return {algorithm: hashes[algorithm].hexdigest() for algorithm in hashes}
+
     def _url_to_fname(self):
         compression = self._compression()
         filename = os.path.basename(self.url.path)
@@ -256,35 +392,80 @@ class DownloadHandler(Action):
         self.results = {"fail": {algorithm: expected, "download": actual}}
         raise JobError("%s for '%s' does not match." % (algorithm, self.url.geturl()))
 
-    def run(self, connection, max_end_time):
-        def progress_unknown_total(downloaded_sz, last_val):
-            """ Compute progress when the size is unknown """
-            condition = downloaded_sz >= last_val + 25 * 1024 * 1024
-            return (
-                condition,
-                downloaded_sz,
-                "progress %dMB" % (int(downloaded_sz / (1024 * 1024)))
-                if condition
-                else "",
+    def download_cache(self):
+        """
+        Return the download cache and the key of the resource when the cache
+        is enabled and the resource can be cached.
+        """
+        config = self.job.parameters.get("dispatcher", {}).get("download_cache")
+        if not config:
+            return (None, None)
+        key = self.cache_key()
+        if key is None:
+            return (None, None)
+        cache = DownloadCache(
+            config.get("path", DISPATCHER_CACHE_DIR),
+            int(config.get("size", 20)) * 1024 * 1024 * 1024,
+        )
+        return (cache, key)
+
+    def cache_key(self):
+        """
+        Key of the resource in the download cache: the checksum given in the
+        job definition or the url with the http validators. The compression
+        is part of the key as the resource is cached decompressed.
+        """
+        compression = self._compression()
+        if compression not in self.decompress_command_map:
+            compression = None
+        for algorithm in ["sha512", "sha256", "md5"]:
+            checksum = self.params.get(f"{algorithm}sum")
+            if checksum:
+                return f"{algorithm}:{checksum}|{compression}"
+        if self.validators:
+            return f"url:{self.params['url']}|{self.validators}|{compression}"
+        return None
+
+    def _get_from_cache(self, entry):
+        """
+        Copy the resource from the download cache and return its metadata.
+        When "qcow2_backing" is enabled, qcow2 images are not copied: the
+        cached image is hard linked and used as the backing file of a new
+        qcow2 image, receiving every write made by the job.
+        """
+        config = self.job.parameters["dispatcher"]["download_cache"]
+        if (
+            not config.get("qcow2_backing", False)
+            or not entry.is_qcow2()
+            or shutil.which("qemu-img") is None
+        ):
+            return entry.get(self.fname)
+
+        backing = self.fname + ".base"
+        metadata = entry.get(backing, link=True)
+        if metadata is None:
+            return None
+        self.logger.debug("Using %s as the qcow2 backing file", backing)
+        try:
+            subprocess.check_output(  # nosec - internal.
+                ["qemu-img", "create", "-f", "qcow2", "-F", "qcow2"]
+                + ["-b", backing, self.fname],
+                stderr=subprocess.STDOUT,
+                timeout=self.timeout.remaining(),
             )
-
-        def progress_known_total(downloaded_sz, last_val):
-            """ Compute progress when the size is known """
-            percent = math.floor(downloaded_sz / float(self.size) * 100)
-            condition = percent >= last_val + 5
-            return (
-                condition,
-                percent,
-                "progress %3d%% (%dMB)" % (percent, int(downloaded_sz / (1024 * 1024)))
-                if condition
-                else "",
+        except subprocess.TimeoutExpired:
+            self.timeout.check()
+            raise
+        except subprocess.CalledProcessError as exc:
+            raise InfrastructureError(
+                "Unable to create the qcow2 image: %s"
+                % exc.output.decode("utf-8", errors="replace")
             )
+        return metadata
 
+    def run(self, connection, max_end_time):
         connection = super().run(connection, max_end_time)
         # self.cookies = self.job.context.config.lava_cookies  # FIXME: work out how to restore
-        md5 = hashlib.md5()  # nosec - not being used for cryptography.
-        sha256 = hashlib.sha256()
-        sha512 = hashlib.sha512()
 
         # Create a fresh directory if the old one has been removed by a previous cleanup
         # (when retrying inside a RetryAction)
@@ -313,100 +494,71 @@ class DownloadHandler(Action):
 
         if os.path.isdir(self.fname):
             raise JobError("Download '%s' is a directory, not a file" % self.fname)
-        if os.path.exists(self.fname):
-            os.remove(self.fname)
-
-        self.logger.info("downloading %s", self.params["url"])
-        self.logger.debug("saving as %s", self.fname)
-
-        downloaded_size = 0
-        beginning = time.time()
-        # Choose the progress bar (is the size known?)
-        if self.size == -1:
-            self.logger.debug("total size: unknown")
-            last_value = -25 * 1024 * 1024
-            progress = progress_unknown_total
-        else:
-            self.logger.debug(
-                "total size: %d (%dMB)", self.size, int(self.size / (1024 * 1024))
-            )
-            last_value = -5
-            progress = progress_known_total
-
-        decompress_command = None
-        if compression:
-            if compression in self.decompress_command_map:
-                decompress_command = self.decompress_command_map[compression]
-                self.logger.info(
-                    "Using %s to decompress %s", decompress_command, compression
+        for fname in [self.fname, self.fname + ".base"]:
+            if os.path.exists(fname):
+                os.remove(fname)
+
+        extract_dir = None
+        (cache, key) = self.download_cache()
+        with contextlib.ExitStack() as stack:
+            entry = None
+            if cache is not None:
+                self.logger.debug("Looking for %s in the download cache", key)
+                entry = stack.enter_context(cache.entry(key, self.timeout.check))
+            metadata = None if entry is None else self._get_from_cache(entry)
+            # The entry might have been populated by a job asking for other
+            # checksums. When the resource is cached as downloaded, the
+            # missing checksums are computed from the cached copy. Otherwise
+            # the resource is downloaded again and replaces the entry.
+            missing = []
+            if metadata is not None:
+                missing = [
+                    algorithm
+                    for algorithm in self._algorithms()
+                    if metadata.get(algorithm) is None
+                ]
+            if missing and compression not in self.decompress_command_map:
+                self.logger.debug("Adding %s to the download cache", ", ".join(missing))
+                base = self.fname + ".base"
+                metadata.update(
+                    self._file_checksums(
+                        base if os.path.exists(base) else self.fname, missing
+                    )
                 )
+                entry.update(metadata)
+            elif missing:
+                self.logger.debug("Missing checksums in the download cache")
+                metadata = None
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self.fname + ".base")
+            cached = metadata is not None
+            if cached:
+                self.logger.info("using %s from the download cache", self.params["url"])
+                self.logger.debug("saving as %s", self.fname)
             else:
-                self.logger.info(
-                    "Compression %s specified but not decompressing during download",
+                extract_dir = self._extract_dir(compression)
+                # Compute every checksums of the cached resources, so jobs
+                # asking for other checksums can use them
+                metadata = self._download(
                     compression,
+                    extract_dir,
+                    None if entry is None else ["md5", "sha256", "sha512"],
                 )
-        elif not self.params.get("compression", False):
-            self.logger.debug("No compression specified")
-
-        def update_progress():
-            nonlocal downloaded_size, last_value, md5, sha256, sha512
-            downloaded_size += len(buff)
-            (printing, new_value, msg) = progress(downloaded_size, last_value)
-            if printing:
-                last_value = new_value
-                self.logger.debug(msg)
-            md5.update(buff)
-            sha256.update(buff)
-            sha512.update(buff)
 
-        if compression and decompress_command:
-            try:
-                with open(self.fname, "wb") as dwnld_file:
-                    proc = subprocess.Popen(  # nosec - internal.
-                        [decompress_command], stdin=subprocess.PIPE, stdout=dwnld_file
-                    )
-            except OSError as exc:
-                msg = "Unable to open %s: %s" % (self.fname, exc.strerror)
-                self.logger.error(msg)
-                raise InfrastructureError(msg)
-
-            with proc.stdin as pipe:
-                for buff in self.reader():
-                    update_progress()
-                    try:
-                        pipe.write(buff)
-                    except BrokenPipeError as exc:
-                        error_message = str(exc)
-                        self.logger.exception(error_message)
-                        msg = (
-                            "Make sure the 'compression' is corresponding "
-                            "to the image file type."
-                        )
-                        self.logger.error(msg)
-                        raise JobError(error_message)
-            proc.wait()
-        else:
-            with open(self.fname, "wb") as dwnld_file:
-                for buff in self.reader():
-                    update_progress()
-                    dwnld_file.write(buff)
-
-        # Log the download speed
-        ending = time.time()
-        self.logger.info(
-            "%dMB downloaded in %0.2fs (%0.2fMB/s)",
-            downloaded_size / (1024 * 1024),
-            round(ending - beginning, 2),
-            round(downloaded_size / (1024 * 1024 * (ending - beginning)), 2),
-        )
-
-        # If the remote server uses "Content-Encoding: gzip", this calculation will be wrong
-        # because requests will decompress the file on the fly, creating a larger file than
-        # LAVA expects.
-        if self.size > 0 and self.size != downloaded_size:
-            raise InfrastructureError(
-                "Download finished (%i bytes) but was not expected size (%i bytes), check your networking."
-                % (downloaded_size, self.size)
+            self._check_checksum("md5", metadata.get("md5"), md5sum)
+            self._check_checksum("sha256", metadata.get("sha256"), sha256sum)
+            self._check_checksum("sha512", metadata.get("sha512"), sha512sum)
+
+            # The validators can change between validate and run
+            if entry is not None and not cached and self.cache_key() == key:
+                self.logger.debug("Adding %s to the download cache", key)
+                entry.store(self.fname, metadata)
+        if cache is not None:
+            cache.evict()
+        downloaded_size = metadata["size"]
+        if not cached:
+            self.profile["downloaded"] = (
+                self.profile.get("downloaded", 0) + downloaded_size
             )
 
         # set the dynamic data into the context
@@ -416,21 +568,22 @@ class DownloadHandler(Action):
         self.set_namespace_data(
             action="download-action", label="file", key=self.key, value=self.fname
         )
-        self.set_namespace_data(
-            action="download-action", label=self.key, key="md5", value=md5.hexdigest()
-        )
-        self.set_namespace_data(
-            action="download-action",
-            label=self.key,
-            key="sha256",
-            value=sha256.hexdigest(),
-        )
-        self.set_namespace_data(
-            action="download-action",
-            label=self.key,
-            key="sha512",
-            value=sha512.hexdigest(),
-        )
+        for algorithm in ["md5", "sha256", "sha512"]:
+            if metadata.get(algorithm) is not None:
+                self.set_namespace_data(
+                    action="download-action",
+                    label=self.key,
+                    key=algorithm,
+                    value=metadata[algorithm],
+                )
+
+        if extract_dir is not None:
+            self.set_namespace_data(
+                action="download-action",
+                label=self.key,
+                key="extracted",
+                value=extract_dir,
+            )
 
         # handle archive files
         archive = self.params.get("archive")
@@ -454,10 +607,6 @@ class DownloadHandler(Action):
                 value=target_fname_path,
             )
 
-        self._check_checksum("md5", md5.hexdigest(), md5sum)
-        self._check_checksum("sha256", sha256.hexdigest(), sha256sum)
-        self._check_checksum("sha512", sha512.hexdigest(), sha512sum)
-
         # certain deployments need prefixes set
         if self.parameters["to"] == "tftp" or self.parameters["to"] == "nbd":
             suffix = self.get_namespace_data(
@@ -487,26 +636,185 @@ class DownloadHandler(Action):
         if "lava-xnbd" in self.parameters and nbdroot:
             self.parameters["lava-xnbd"]["nbdroot"] = nbdroot
 
-        self.results = {
-            "label": self.key,
-            "size": downloaded_size,
-            "md5sum": str(
-                self.get_namespace_data(
-                    action="download-action", label=self.key, key="md5"
+        results = {"label": self.key, "size": downloaded_size}
+        for algorithm in ["md5", "sha256", "sha512"]:
+            if metadata.get(algorithm) is not None:
+                results["%ssum" % algorithm] = metadata[algorithm]
+        self.results = results
+        return connection
+
+    def _extract_dir(self, compression):
+        """
+        Return the directory where to extract the resource while downloading
+        it or None if the resource should not be extracted.
+        """
+        if self.key not in self.extract_keys or self.params.get("archive"):
+            return None
+        # tar cannot guess the compression of a stream: without a known
+        # decompressor, the tarball is extracted after the download.
+        if not compression or compression not in self.decompress_command_map:
+            return None
+        if shutil.which("tar") is None or shutil.which("tee") is None:
+            return None
+        return self.mkdtemp()
+
+    def _download(self, compression, extract_dir=None, algorithms=None):
+        """
+        Download the resource into self.fname, decompressing it if needed.
+        When extract_dir is set, the (decompressed) stream is also extracted
+        with tar in this directory.
+        Return the size and the checksums of the downloaded stream, computed
+        with the given algorithms (the ones of the job definition by default).
+        """
+
+        def progress_unknown_total(downloaded_sz, last_val):
+            """ Compute progress when the size is unknown """
+            condition = downloaded_sz >= last_val + 25 * 1024 * 1024
+            return (
+                condition,
+                downloaded_sz,
+                "progress %dMB" % (int(downloaded_sz / (1024 * 1024)))
+                if condition
+                else "",
+            )
+
+        def progress_known_total(downloaded_sz, last_val):
+            """ Compute progress when the size is known """
+            percent = math.floor(downloaded_sz / float(self.size) * 100)
+            condition = percent >= last_val + 5
+            return (
+                condition,
+                percent,
+                "progress %3d%% (%dMB)" % (percent, int(downloaded_sz / (1024 * 1024)))
+                if condition
+                else "",
+            )
+
+        reader = self.reader
+        prefetched = self.prefetched()
+        if prefetched is None:
+            self.logger.info("downloading %s", self.params["url"])
+        else:
+            self.logger.info("using %s prefetched by lava-worker", self.params["url"])
+            reader = functools.partial(self.prefetched_reader, prefetched)
+        self.logger.debug("saving as %s", self.fname)
+
+        downloaded_size = 0
+        beginning = time.time()
+        # Choose the progress bar (is the size known?)
+        if self.size == -1:
+            self.logger.debug("total size: unknown")
+            last_value = -25 * 1024 * 1024
+            progress = progress_unknown_total
+        else:
+            self.logger.debug(
+                "total size: %d (%dMB)", self.size, int(self.size / (1024 * 1024))
+            )
+            last_value = -5
+            progress = progress_known_total
+
+        decompress_cmd = None
+        if compression:
+            if compression in self.decompress_command_map:
+                decompress_cmd = decompress_command(
+                    compression, compression_threads(self.job)
                 )
-            ),
-            "sha256sum": str(
-                self.get_namespace_data(
-                    action="download-action", label=self.key, key="sha256"
+                self.logger.info(
+                    "Using %s to decompress %s", " ".join(decompress_cmd), compression
                 )
-            ),
-            "sha512sum": str(
-                self.get_namespace_data(
-                    action="download-action", label=self.key, key="sha512"
+            else:
+                self.logger.info(
+                    "Compression %s specified but not decompressing during download",
+                    compression,
                 )
-            ),
-        }
-        return connection
+        elif not self.params.get("compression", False):
+            self.logger.debug("No compression specified")
+
+        def update_progress():
+            nonlocal downloaded_size, last_value
+            self.timeout.check()
+            downloaded_size += len(buff)
+            (printing, new_value, msg) = progress(downloaded_size, last_value)
+            if printing:
+                last_value = new_value
+                self.logger.debug(msg)
+
+        tar = None
+        with contextlib.ExitStack() as stack:
+            try:
+                if extract_dir is None:
+                    dwnld_file = stack.enter_context(open(self.fname, "wb"))
+                else:
+                    self.logger.info("Extracting to %s", extract_dir)
+                    # decompress | tee self.fname | tar -x
+                    tar = subprocess.Popen(  # nosec - internal.
+                        ["tar", "-x", "-C", extract_dir], stdin=subprocess.PIPE
+                    )
+                    stack.callback(tar.wait)
+                    tee = subprocess.Popen(  # nosec - internal.
+                        ["tee", self.fname], stdin=subprocess.PIPE, stdout=tar.stdin,
+                    )
+                    tar.stdin.close()
+                    stack.callback(self._wait_process, tee)
+                    dwnld_file = stack.enter_context(tee.stdin)
+                if compression and decompress_cmd:
+                    proc = subprocess.Popen(  # nosec - internal.
+                        decompress_cmd, stdin=subprocess.PIPE, stdout=dwnld_file
+                    )
+                    stack.callback(self._wait_process, proc)
+                    dwnld_file = stack.enter_context(proc.stdin)
+            except OSError as exc:
+                msg = "Unable to open %s: %s" % (self.fname, exc.strerror)
+                self.logger.error(msg)
+                raise InfrastructureError(msg)
+
+            writer = ChunkWriter(dwnld_file, algorithms or self._algorithms())
+            writer.start()
+            try:
+                for buff in reader():
+                    update_progress()
+                    writer.write(buff)
+                checksums = writer.close()
+            except BrokenPipeError as exc:
+                error_message = str(exc)
+                self.logger.exception(error_message)
+                msg = (
+                    "Make sure the 'compression' is corresponding "
+                    "to the image file type."
+                )
+                self.logger.error(msg)
+                raise JobError(error_message)
+            finally:
+                # Stop the thread on errors
+                if writer.is_alive():
+                    writer.queue.put(None)
+                    writer.join()
+
+        if tar is not None and tar.returncode != 0:
+            raise JobError(
+                "Unable to extract %s: tar exited with %d"
+                % (self.params["url"], tar.returncode)
+            )
+
+        # Log the download speed
+        ending = time.time()
+        self.logger.info(
+            "%dMB downloaded in %0.2fs (%0.2fMB/s)",
+            downloaded_size / (1024 * 1024),
+            round(ending - beginning, 2),
+            round(downloaded_size / (1024 * 1024 * (ending - beginning)), 2),
+        )
+
+        # If the remote server uses "Content-Encoding: gzip", this calculation will be wrong
+        # because requests will decompress the file on the fly, creating a larger file than
+        # LAVA expects.
+        if self.size > 0 and self.size != downloaded_size:
+            raise InfrastructureError(
+                "Download finished (%i bytes) but was not expected size (%i bytes), check your networking."
+                % (downloaded_size, self.size)
+            )
+
+        return {"size": downloaded_size, **checksums}
 
 
 class FileDownloadAction(DownloadHandler):
@@ -572,7 +880,10 @@ class HttpDownloadAction(DownloadHandler):
             self.logger.debug("Validating that %s exists", self.url.geturl())
             # Force the non-use of Accept-Encoding: gzip, this will permit to know the final size
             res = requests_retry().head(
-                self.url.geturl(), allow_redirects=True, headers=headers
+                self.url.geturl(),
+                allow_redirects=True,
+                headers=headers,
+                timeout=self._request_timeout(),
             )
             if res.status_code != requests.codes.OK:
                 # try using (the slower) get for services with broken redirect support
@@ -584,6 +895,7 @@ class HttpDownloadAction(DownloadHandler):
                     allow_redirects=True,
                     stream=True,
                     headers=headers,
+                    timeout=self._request_timeout(),
                 )
                 if res.status_code != requests.codes.OK:
                     self.errors = "Resource unavailable at '%s' (%d)" % (
@@ -593,6 +905,7 @@ class HttpDownloadAction(DownloadHandler):
                     return
 
             self.size = int(res.headers.get("content-length", -1))
+            self.validators = self.http_validators(res.headers)
         except requests.Timeout:
             self.logger.error("Request timed out")
             self.errors = "'%s' timed out" % (self.url.geturl())
@@ -603,6 +916,13 @@ class HttpDownloadAction(DownloadHandler):
             if res is not None:
                 res.close()
 
+    def http_validators(self, headers):
+        if headers.get("etag"):
+            return "etag:%s" % headers["etag"]
+        if headers.get("last-modified"):
+            return "last-modified:%s" % headers["last-modified"]
+        return None
+
     def reader(self):
         res = None
         try:
@@ -612,7 +932,11 @@ class HttpDownloadAction(DownloadHandler):
             if self.params and "headers" in self.params:
                 headers = self.params["headers"]
             res = requests_retry().get(
-                self.url.geturl(), allow_redirects=True, stream=True, headers=headers
+                self.url.geturl(),
+                allow_redirects=True,
+                stream=True,
+                headers=headers,
+                timeout=self._request_timeout(),
             )
             if res.status_code != requests.codes.OK:
                 # This is an Infrastructure error because the validate function
@@ -620,6 +944,7 @@ class HttpDownloadAction(DownloadHandler):
                 raise InfrastructureError(
                     "Unable to download '%s'" % (self.url.geturl())
                 )
+            self.validators = self.http_validators(res.headers)
             for buff in res.iter_content(HTTP_DOWNLOAD_CHUNK_SIZE):
                 yield buff
         except requests.RequestException as exc:
@@ -644,18 +969,34 @@ class ScpDownloadAction(DownloadHandler):
         super().validate()
         try:
             size = subprocess.check_output(  # nosec - internal.
-                ["ssh", self.url.netloc, "stat", "-c", "%s", self.url.path],
+                ["ssh"]
+                + self._ssh_options()
+                + [self.url.netloc, "stat", "-c", "%s", self.url.path],
                 stderr=subprocess.STDOUT,
+                timeout=self._request_timeout(),
             )
             self.size = int(size)
-        except subprocess.CalledProcessError as exc:
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as exc:
             self.errors = str(exc)
 
+    def _ssh_options(self):
+        # Bound the connection and detect a stalled transfer
+        timeout = int(self._request_timeout())
+        return [
+            "-o",
+            "ConnectTimeout=%d" % timeout,
+            "-o",
+            "ServerAliveInterval=%d" % max(1, timeout // 3),
+            "-o",
+            "ServerAliveCountMax=3",
+        ]
+
     def reader(self):
         process = None
         try:
             process = subprocess.Popen(  # nosec - internal.
-                ["ssh", self.url.netloc, "cat", self.url.path], stdout=subprocess.PIPE
+                ["ssh"] + self._ssh_options() + [self.url.netloc, "cat", self.url.path],
+                stdout=subprocess.PIPE,
             )
             buff = process.stdout.read(SCP_DOWNLOAD_CHUNK_SIZE)
             while buff:
@@ -179,8 +179,13 @@ class ExtractNfsAction(Action):
         root = self.get_namespace_data(
             action="download-action", label=self.param_key, key="file"
         )
-        root_dir = self.mkdtemp()
-        untar_file(root, root_dir)
+        # The download action might have extracted the tarball already
+        root_dir = self.get_namespace_data(
+            action="download-action", label=self.param_key, key="extracted"
+        )
+        if root_dir is None:
+            root_dir = self.mkdtemp()
+            untar_file(root, root_dir)
         self.set_namespace_data(
             action="extract-rootfs", label="file", key=self.file_key, value=root_dir
         )
@@ -198,13 +198,11 @@ class XnbdAction(Action):
             self.nbd_server_port,
             self.nbd_root,
         )
-        if re.search(filesystem.tftpd_dir(), self.nbd_root):
+        tftpd_dir = filesystem.tftpd_dir()
+        if re.search(tftpd_dir, self.nbd_root):
             fullpath_nbdroot = self.nbd_root
         else:
-            fullpath_nbdroot = "%s/%s" % (
-                os.path.realpath(filesystem.tftpd_dir()),
-                self.nbd_root,
-            )
+            fullpath_nbdroot = "%s/%s" % (os.path.realpath(tftpd_dir), self.nbd_root)
         nbd_cmd = [
             "xnbd-server",
             "--logpath",
@@ -216,6 +214,11 @@ class XnbdAction(Action):
             fullpath_nbdroot,
         ]
         command_output = self.run_command(nbd_cmd, allow_fail=False)
+        # xnbd-server is listening: the port is not free anymore for the
+        # other jobs
+        for protocol in self.job.protocols:
+            if protocol.name == XnbdProtocol.name:
+                protocol.release_port(self.nbd_server_port)
 
         if command_output and "error" in command_output:
             raise JobError("xnbd-server: %s" % command_output)
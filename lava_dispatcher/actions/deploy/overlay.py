@@ -23,11 +23,13 @@ import shlex
 import stat
 import glob
 import shutil
+import subprocess  # nosec - internal use.
 import tarfile
 from lava_dispatcher.action import Action, Pipeline
 from lava_common.exceptions import InfrastructureError, LAVABug
 from lava_dispatcher.actions.deploy.testdef import TestDefinitionAction
 from lava_dispatcher.logical import Deployment
+from lava_dispatcher.utils.compression import compress_command, compression_threads
 from lava_dispatcher.utils.contextmanager import chdir
 from lava_dispatcher.utils.filesystem import check_ssh_identity_file
 from lava_dispatcher.utils.shell import which
@@ -584,14 +586,26 @@ class CompressOverlay(Action):
             self.logger.error(self.errors)
             return connection
         connection = super().run(connection, max_end_time)
+        # The overlay is extracted by "tar -xzf" on some devices: keep gzip
+        # but use pigz when available.
+        cmd = compress_command("gz", compression_threads(self.job))
         with chdir(location):
             try:
-                with tarfile.open(output, "w:gz") as tar:
-                    tar.add(".%s" % lava_test_results_dir)
-                    # ssh authorization support
-                    if os.path.exists("./root/"):
-                        tar.add(".%s" % "/root/")
-            except tarfile.TarError as exc:
+                with open(output, "wb") as f_out:
+                    proc = subprocess.Popen(  # nosec - internal use.
+                        cmd, stdin=subprocess.PIPE, stdout=f_out
+                    )
+                with proc.stdin as pipe:
+                    with tarfile.open(fileobj=pipe, mode="w|") as tar:
+                        tar.add(".%s" % lava_test_results_dir)
+                        # ssh authorization support
+                        if os.path.exists("./root/"):
+                            tar.add(".%s" % "/root/")
+                if proc.wait():
+                    raise InfrastructureError(
+                        "Unable to create lava overlay tarball: %s failed" % cmd[0]
+                    )
+            except (OSError, tarfile.TarError) as exc:
                 raise InfrastructureError(
                     "Unable to create lava overlay tarball: %s" % exc
                 )
@@ -18,6 +18,7 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import contextlib
 import os
 import io
 import re
@@ -30,8 +31,14 @@ from lava_common.compat import yaml_safe_dump, yaml_safe_load
 from lava_common.decorators import nottest
 from lava_common.exceptions import InfrastructureError, JobError, LAVABug, TestError
 from lava_dispatcher.action import Action, Pipeline
+from lava_dispatcher.utils.cache import DownloadCache
 from lava_dispatcher.utils.vcs import GitHelper
-from lava_common.constants import DEFAULT_TESTDEF_NAME_CLASS, DISPATCHER_DOWNLOAD_DIR
+from lava_common.constants import (
+    DEFAULT_TESTDEF_NAME_CLASS,
+    DISPATCHER_CACHE_DIR,
+    DISPATCHER_DOWNLOAD_DIR,
+    DISPATCHER_GIT_MIRROR_DIR,
+)
 from lava_dispatcher.utils.compression import untar_file
 
 
@@ -49,6 +56,45 @@ def identify_test_definitions(test_info, namespace):
     return test_list
 
 
+def parallel_namespaces(parameters):
+    """
+    Return, for each test definition of the test action, the connection
+    namespace running it or None for the main connection.
+    The definitions marked as "parallel" are assigned in turn to the
+    "parallel-namespaces" of the test action, when set.
+    """
+    namespaces = parameters.get("parallel-namespaces", [])
+    assigned = []
+    count = 0
+    for testdef in parameters.get("definitions", []):
+        if testdef.get("parallel") and namespaces:
+            assigned.append(namespaces[count % len(namespaces)])
+            count += 1
+        else:
+            assigned.append(None)
+    return assigned
+
+
+def runner_conf(namespace=None):
+    """
+    Name of the lava-test-runner configuration listing the test definitions
+    run by the given connection namespace.
+    """
+    if namespace is None:
+        return "lava-test-runner.conf"
+    return "lava-test-runner-%s.conf" % namespace
+
+
+def git_mirror(job):
+    """
+    Return the directory of the local git mirrors, if enabled.
+    """
+    config = job.parameters.get("dispatcher", {}).get("git_mirror")
+    if not config:
+        return None
+    return config.get("path", DISPATCHER_GIT_MIRROR_DIR)
+
+
 @nottest
 def get_test_action_namespaces(parameters=None):
     """Iterates through the job parameters to identify all the test action
@@ -85,6 +131,7 @@ class RepoAction(Action):
         super().__init__()
         self.vcs = None
         self.runner = None
+        self.runner_conf = runner_conf()
         self.uuid = None
 
     @classmethod
@@ -120,16 +167,15 @@ class RepoAction(Action):
         # FIXME: unused
         # list of levels involved in the repo actions for this overlay
         uuid_list = self.get_namespace_data(
-            action="repo-action", label="repo-action", key="uuid-list"
-        )
-        if uuid_list:
-            if self.uuid not in uuid_list:
-                uuid_list.append(self.uuid)
-        else:
-            uuid_list = [self.uuid]
-        self.set_namespace_data(
-            action="repo-action", label="repo-action", key="uuid-list", value=uuid_list
+            action="repo-action", label="repo-action", key="uuid-list", deepcopy=False
         )
+        if not uuid_list or self.uuid not in uuid_list:
+            self.append_namespace_data(
+                action="repo-action",
+                label="repo-action",
+                key="uuid-list",
+                value=self.uuid,
+            )
 
     def run(self, connection, max_end_time):
         """
@@ -255,13 +301,34 @@ class GitRepoAction(RepoAction):
             self.errors = "Path to YAML file not specified in the job definition"
         if not self.valid:
             return
-        self.vcs = GitHelper(self.parameters["repository"])
+        self.vcs = GitHelper(self.parameters["repository"], git_mirror(self.job))
         super().validate()
 
     @classmethod
     def accepts(cls, repo_type):
         return repo_type == "git"
 
+    def testdef_cache(self):
+        """
+        Return the download cache and the key of the checkout when the cache
+        is enabled and the revision is pinned to a commit: the content of a
+        branch can change at any time.
+        """
+        config = self.job.parameters.get("dispatcher", {}).get("download_cache")
+        if not config:
+            return (None, None)
+        revision = str(self.parameters.get("revision", ""))
+        if not re.fullmatch("[0-9a-f]{40}", revision):
+            return (None, None)
+        cache = DownloadCache(
+            config.get("path", DISPATCHER_CACHE_DIR),
+            int(config.get("size", 20)) * 1024 * 1024 * 1024,
+        )
+        branch = self.parameters.get("branch")
+        history = self.parameters.get("history", True)
+        key = f"git:{self.parameters['repository']}|{revision}|{branch}|{history}"
+        return (cache, key)
+
     def run(self, connection, max_end_time):
         """
         Clones the git repo into a directory name constructed from the mount_path,
@@ -298,13 +365,35 @@ class GitRepoAction(RepoAction):
         if not revision:
             shallow = self.parameters.get("shallow", True)
 
-        commit_id = self.vcs.clone(
-            runner_path,
-            shallow=shallow,
-            revision=revision,
-            branch=branch,
-            history=self.parameters.get("history", True),
-        )
+        (cache, key) = self.testdef_cache()
+        with contextlib.ExitStack() as stack:
+            entry = None
+            if cache is not None:
+                self.logger.debug("Looking for %s in the download cache", key)
+                entry = stack.enter_context(cache.entry(key))
+            metadata = None if entry is None else entry.metadata()
+            if metadata is not None:
+                self.logger.info("Using %s from the download cache", revision)
+                untar_file(str(entry.path), runner_path)
+                commit_id = metadata["commit"]
+            else:
+                commit_id = self.vcs.clone(
+                    runner_path,
+                    shallow=shallow,
+                    revision=revision,
+                    branch=branch,
+                    history=self.parameters.get("history", True),
+                )
+                if entry is not None and commit_id == revision:
+                    self.logger.debug("Adding %s to the download cache", key)
+                    tarball = os.path.join(self.mkdtemp(), "testdef.tar")
+                    with tarfile.open(tarball, "w", encoding="utf-8") as tar:
+                        tar.add(runner_path, arcname=".")
+                    entry.store(tarball, {"commit": commit_id})
+                    os.unlink(tarball)
+        if cache is not None:
+            cache.evict()
+
         if commit_id is None:
             raise InfrastructureError(
                 "Unable to get test definition from %s (%s)"
@@ -557,11 +646,18 @@ class TestDefinitionAction(Action):
                 value=self.test_list,
                 parameters=parameters,
             )
-        for testdefs in self.test_list:
-            for testdef in testdefs:
+        tests = [
+            test["parameters"]
+            for test in self.job.test_info.get(parameters["namespace"], [])
+            if "definitions" in test["parameters"]
+        ]
+        for (test, testdefs) in zip(tests, self.test_list):
+            namespaces = parallel_namespaces(test)
+            for (testdef, namespace) in zip(testdefs, namespaces):
                 # namespace support allows only running the install steps for the relevant
                 # deployment as the next deployment could be a different OS.
                 handler = RepoAction.select(testdef["from"])()
+                handler.runner_conf = runner_conf(namespace)
 
                 # set the full set of job YAML parameters for this handler as handler parameters.
                 handler.job = self.job
@@ -692,13 +788,17 @@ class TestDefinitionAction(Action):
             self.logger.debug(
                 "Using lava-test-runner path: %s for stage %d", path, stage
             )
-            with open(
-                "%s/%s/lava-test-runner.conf" % (overlay_base, stage), "a"
-            ) as runner_conf:
-                for handler in self.pipeline.actions:
-                    if isinstance(handler, RepoAction) and handler.stage == stage:
+            # The main configuration is created even if every test definition
+            # is run by the parallel connections
+            confs = {runner_conf(): []}
+            for handler in self.pipeline.actions:
+                if isinstance(handler, RepoAction) and handler.stage == stage:
+                    confs.setdefault(handler.runner_conf, []).append(handler)
+            for (name, handlers) in confs.items():
+                with open("%s/%s/%s" % (overlay_base, stage, name), "a") as conf:
+                    for handler in handlers:
                         self.logger.debug("- %s", handler.parameters["test_name"])
-                        runner_conf.write(handler.runner)
+                        conf.write(handler.runner)
 
         return connection
 
@@ -900,7 +1000,7 @@ class TestInstallAction(TestOverlayAction):
                     ".git", "", len(repo) - 1
                 )  # drop .git from the end, if present
                 dest_path = os.path.join(runner_path, os.path.basename(subdir))
-                commit_id = GitHelper(repo).clone(dest_path)
+                commit_id = GitHelper(repo, git_mirror(self.job)).clone(dest_path)
             elif isinstance(repo, dict):
                 # TODO: We use 'skip_by_default' to check if this
                 # specific repository should be skipped. The value
@@ -928,7 +1028,9 @@ class TestInstallAction(TestOverlayAction):
                         raise TestError(
                             "Cannot mix string and url forms for the same repository."
                         )
-                    commit_id = GitHelper(url).clone(dest_path, branch=branch)
+                    commit_id = GitHelper(url, git_mirror(self.job)).clone(
+                        dest_path, branch=branch
+                    )
             else:
                 raise TestError("Unrecognised git-repos block.")
             if commit_id is None:
@@ -1033,7 +1135,10 @@ class TestRunnerAction(TestOverlayAction):
     def validate(self):
         super().validate()
         testdef_index = self.get_namespace_data(
-            action="test-definition", label="test-definition", key="testdef_index"
+            action="test-definition",
+            label="test-definition",
+            key="testdef_index",
+            deepcopy=False,
         )
         if not testdef_index:
             self.errors = "Unable to identify test definition index"
@@ -1047,15 +1152,11 @@ class TestRunnerAction(TestOverlayAction):
                 self.testdef_levels[self.level] = "%s_%s" % (count, name)
         if not self.testdef_levels:
             self.errors = "Unable to identify test definition names"
-        current = self.get_namespace_data(
-            action=self.name, label=self.name, key="testdef_levels"
-        )
-        if current:
-            current.update(self.testdef_levels)
-        else:
-            current = self.testdef_levels
-        self.set_namespace_data(
-            action=self.name, label=self.name, key="testdef_levels", value=current
+        self.update_namespace_data(
+            action=self.name,
+            label=self.name,
+            key="testdef_levels",
+            value=self.testdef_levels,
         )
 
     def run(self, connection, max_end_time):
@@ -1086,7 +1187,7 @@ class TestRunnerAction(TestOverlayAction):
         lava_signal = self.parameters.get("lava-signal", "stdout")
 
         testdef_levels = self.get_namespace_data(
-            action=self.name, label=self.name, key="testdef_levels"
+            action=self.name, label=self.name, key="testdef_levels", deepcopy=False
         )
         with open(filename, "a") as runsh:
             for line in content:
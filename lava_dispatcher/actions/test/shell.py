@@ -19,20 +19,24 @@
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
 import re
+import threading
 import time
 import decimal
 import logging
 import pexpect
 
 from lava_common.compat import yaml_safe_dump
+from lava_common.constants import CONCURRENT_GRACE
 from lava_common.decorators import nottest
 from lava_common.exceptions import (
     ConnectionClosedError,
+    JobCanceled,
     JobError,
     TestError,
     LAVATimeoutError,
 )
 from lava_dispatcher.action import Action, Pipeline
+from lava_dispatcher.actions.deploy.testdef import parallel_namespaces, runner_conf
 from lava_dispatcher.logical import LavaTest, RetryAction
 from lava_dispatcher.connection import SignalMatch
 
@@ -91,6 +95,60 @@ class TestShellRetry(RetryAction):
         self.pipeline.add_action(TestShellAction())
 
 
+class ParallelTestShell(threading.Thread):
+    """
+    Run the parallel test definitions assigned to a connection namespace.
+    """
+
+    def __init__(self, action, namespace):
+        super().__init__(name="test-shell-%s" % namespace, daemon=True)
+        self.action = action
+        self.namespace = namespace
+        self.exc = None
+        self.connection = None
+        # Checked by the action while waiting for the output
+        self.stop = threading.Event()
+        action.stop = self.stop
+
+    def run(self):
+        action = self.action
+        try:
+            connection = action.get_namespace_data(
+                action="shared",
+                label="shared",
+                key="connection",
+                deepcopy=False,
+                parameters={"namespace": self.namespace},
+            )
+            if not connection:
+                raise JobError("No connection in namespace %r" % self.namespace)
+            self.connection = connection
+            action.signal_director.connection = connection
+            lava_test_results_dir = action._prepare_shell(connection)
+            action._run_tests(
+                connection, lava_test_results_dir, conf=runner_conf(self.namespace)
+            )
+        except Exception as exc:
+            action.logger.error(
+                "Parallel test shell on %r failed: %s", self.namespace, exc
+            )
+            self.exc = exc
+
+    def interrupt(self):
+        """
+        Stop the test shell and interrupt the test runner: the prompt then
+        ends any wait on the connection.
+        """
+        self.stop.set()
+        if self.connection is not None:
+            try:
+                self.connection.sendcontrol("c")
+            except Exception as exc:
+                self.action.logger.warning(
+                    "Unable to interrupt %r: %s", self.namespace, exc
+                )
+
+
 # FIXME: move to utils and call inside the overlay
 class PatternFixup:
     def __init__(self, testdef, count):
@@ -175,6 +233,18 @@ class TestShellAction(Action):
         # noinspection PyTypeChecker
         self.pattern = PatternFixup(testdef=None, count=0)
         self.current_run = None
+        # Set for the parallel test shells, see ParallelTestShell
+        self.stop = None
+
+    @property
+    def log_namespace(self):
+        """
+        Namespace of the connection, used to match the test case markers and
+        results of the parallel test shells.
+        """
+        return self.parameters.get(
+            "connection-namespace", self.parameters.get("namespace")
+        )
 
     def _reset_patterns(self):
         # Extend the list of patterns when creating subclasses.
@@ -195,6 +265,11 @@ class TestShellAction(Action):
         for testdef in self.parameters["definitions"]:
             if "repository" not in testdef:
                 self.errors = "Repository missing from test definition"
+        namespace = self.parameters.get(
+            "connection-namespace", self.parameters.get("namespace")
+        )
+        if namespace in self.parameters.get("parallel-namespaces", []):
+            self.errors = "The main connection cannot run the parallel definitions"
         self._reset_patterns()
         super().validate()
 
@@ -252,6 +327,48 @@ class TestShellAction(Action):
                 "Using a character delay of %i (ms)", self.character_delay
             )
 
+        lava_test_results_dir = self._prepare_shell(connection)
+
+        feedbacks = []
+        for feedback_ns in self.data.keys():
+            # The parallel test shells are reading these connections
+            if feedback_ns in self.parameters.get("parallel-namespaces", []):
+                continue
+            feedback_connection = self.get_namespace_data(
+                action="shared",
+                label="shared",
+                key="connection",
+                deepcopy=False,
+                parameters={"namespace": feedback_ns},
+            )
+            if feedback_connection == connection:
+                continue
+            if feedback_connection:
+                self.logger.debug(
+                    "Will listen to feedbacks from '%s' for 1 second", feedback_ns
+                )
+                feedbacks.append((feedback_ns, feedback_connection))
+
+        threads = self._start_parallel_tests()
+        try:
+            self._run_tests(connection, lava_test_results_dir, feedbacks=feedbacks)
+            self._wait_parallel_tests(threads, max_end_time)
+        finally:
+            # Do not leave the parallel test shells running on failures
+            self._stop_parallel_tests(threads)
+
+        # Only print if the report is not empty
+        if self.report:
+            self.logger.debug(yaml_safe_dump(self.report, default_flow_style=False))
+        if self.errors:
+            raise TestError(self.errors)
+        return connection
+
+    def _prepare_shell(self, connection):
+        """
+        Wait for the prompt, run the pre-command-list and source the
+        environment file. Return the test shell directory.
+        """
         if not connection.prompt_str:
             connection.prompt_str = [
                 self.job.device.get_constant("default-shell-prompt")
@@ -265,9 +382,6 @@ class TestShellAction(Action):
         connection.sendline(connection.check_char)
         self.wait(connection)
 
-        # use the string instead of self.name so that inheriting classes (like multinode)
-        # still pick up the correct command.
-        running = self.parameters["stage"]
         pre_command_list = self.get_namespace_data(
             action="test", label="lava-test-shell", key="pre-command-list"
         )
@@ -304,32 +418,29 @@ class TestShellAction(Action):
             ". %s/environment" % lava_test_results_dir, delay=self.character_delay
         )
         connection.wait()
+        return lava_test_results_dir
 
-        try:
-            feedbacks = []
-            for feedback_ns in self.data.keys():
-                feedback_connection = self.get_namespace_data(
-                    action="shared",
-                    label="shared",
-                    key="connection",
-                    deepcopy=False,
-                    parameters={"namespace": feedback_ns},
-                )
-                if feedback_connection == connection:
-                    continue
-                if feedback_connection:
-                    self.logger.debug(
-                        "Will listen to feedbacks from '%s' for 1 second", feedback_ns
-                    )
-                    feedbacks.append((feedback_ns, feedback_connection))
+    def _run_tests(self, connection, lava_test_results_dir, conf=None, feedbacks=()):
+        """
+        Run lava-test-runner on the given configuration (the main one by
+        default) and parse the output until the runner exits.
+        """
+        # use the string instead of self.name so that inheriting classes (like multinode)
+        # still pick up the correct command.
+        running = self.parameters["stage"]
+        command = "%s/bin/lava-test-runner %s/%s" % (
+            lava_test_results_dir,
+            lava_test_results_dir,
+            running,
+        )
+        if conf is not None:
+            command += " %s" % conf
+        self._check_stop()
 
+        try:
             with connection.test_connection() as test_connection:
                 # the structure of lava-test-runner means that there is just one TestAction and it must run all definitions
-                test_connection.sendline(
-                    "%s/bin/lava-test-runner %s/%s"
-                    % (lava_test_results_dir, lava_test_results_dir, running),
-                    delay=self.character_delay,
-                )
+                test_connection.sendline(command, delay=self.character_delay)
 
                 test_connection.timeout = min(
                     self.timeout.duration, self.connection_timeout.duration
@@ -369,12 +480,76 @@ class TestShellAction(Action):
                 self.logger.results(self.current_run)
                 self.current_run = None
 
-        # Only print if the report is not empty
-        if self.report:
-            self.logger.debug(yaml_safe_dump(self.report, default_flow_style=False))
-        if self.errors:
-            raise TestError(self.errors)
-        return connection
+    def _start_parallel_tests(self):
+        """
+        Start a thread for each connection running the test definitions
+        marked as "parallel". Each thread uses its own TestShellAction to
+        parse the output of its connection.
+        """
+        namespaces = []
+        for namespace in parallel_namespaces(self.parameters):
+            if namespace is not None and namespace not in namespaces:
+                namespaces.append(namespace)
+
+        threads = []
+        for namespace in namespaces:
+            action = TestShellAction()
+            action.job = self.job
+            action.level = self.level
+            action.logger = self.logger
+            action.character_delay = self.character_delay
+            action.parameters = dict(self.parameters)
+            action.parameters["connection-namespace"] = namespace
+            action.timeout = self.timeout
+            action.connection_timeout = self.connection_timeout
+            action._reset_patterns()
+            thread = ParallelTestShell(action, namespace)
+            self.logger.info("Running the parallel test definitions on %r", namespace)
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _wait_parallel_tests(self, threads, max_end_time):
+        """
+        Wait for the parallel test shells, at most until the end of the
+        action, and raise the first exception in the order of the
+        namespaces. The test shells still running are stopped.
+        """
+        exc = None
+        for thread in threads:
+            thread.join(max(0, max_end_time - time.time()))
+            if thread.is_alive():
+                self.errors = "Parallel test shell on %r timed out" % thread.namespace
+                self._stop_parallel_tests([thread])
+            elif thread.exc is not None and exc is None:
+                exc = thread.exc
+            for error in thread.action.errors:
+                self.errors = error
+            self.report.update(thread.action.report)
+        if exc is not None:
+            raise exc
+
+    def _stop_parallel_tests(self, threads):
+        """
+        Interrupt the parallel test shells still running and join them,
+        waiting at most CONCURRENT_GRACE seconds for each of them.
+        """
+        threads = [thread for thread in threads if thread.is_alive()]
+        for thread in threads:
+            self.logger.warning(
+                "Stopping the parallel test shell on %r", thread.namespace
+            )
+            thread.interrupt()
+        for thread in threads:
+            thread.join(CONCURRENT_GRACE)
+            if thread.is_alive():
+                self.logger.error(
+                    "The parallel test shell on %r is still running", thread.namespace
+                )
+
+    def _check_stop(self):
+        if self.stop is not None and self.stop.is_set():
+            raise JobCanceled("Parallel test shell stopped")
 
     def pattern_error(self):
         stage = self.parameters["stage"]
@@ -462,7 +637,7 @@ class TestShellAction(Action):
         revision = self.get_namespace_data(action="test", label=uuid, key="revision")
         res["revision"] = revision if revision else "unspecified"
         res["namespace"] = self.parameters["namespace"]
-        connection_namespace = self.parameters.get("connection_namespace")
+        connection_namespace = self.parameters.get("connection-namespace")
         if connection_namespace:
             res["connection-namespace"] = connection_namespace
         commit_id = self.get_namespace_data(action="test", label=uuid, key="commit-id")
@@ -516,7 +691,7 @@ class TestShellAction(Action):
         else:
             self.report[res["test_case_id"]] = res["result"]
         # Send the results back
-        self.logger.results(res_data)
+        self.logger.results(res_data, namespace=self.log_namespace)
 
     @nottest
     def signal_test_reference(self, params):
@@ -530,7 +705,7 @@ class TestShellAction(Action):
         }
         if self.testset_name:
             res_dict.update({"set": self.testset_name})
-        self.logger.results(res_dict)
+        self.logger.results(res_dict, namespace=self.log_namespace)
 
     @nottest
     def signal_test_feedback(self, params):
@@ -586,7 +761,10 @@ class TestShellAction(Action):
         if res:
             # disallow whitespace in test_case_id
             test_case_id = "%s" % res["test_case_id"].replace("/", "_")
-            self.logger.marker({"case": res["test_case_id"], "type": "test_case"})
+            self.logger.marker(
+                {"case": res["test_case_id"], "type": "test_case"},
+                namespace=self.log_namespace,
+            )
             if " " in test_case_id.strip():
                 self.logger.debug(
                     "Skipping invalid test_case_id '%s'", test_case_id.strip()
@@ -607,7 +785,7 @@ class TestShellAction(Action):
                 if "units" in res:
                     res_data["units"] = res["units"]
 
-            self.logger.results(res_data)
+            self.logger.results(res_data, namespace=self.log_namespace)
             self.report[res["test_case_id"]] = res["result"]
         return True
 
@@ -643,15 +821,22 @@ class TestShellAction(Action):
             elif name == "ENDRUN":
                 self.signal_end_run(params)
             elif name == "STARTTC":
-                self.logger.marker({"case": params[0], "type": "start_test_case"})
+                self.logger.marker(
+                    {"case": params[0], "type": "start_test_case"},
+                    namespace=self.log_namespace,
+                )
             elif name == "ENDTC":
-                self.logger.marker({"case": params[0], "type": "end_test_case"})
+                self.logger.marker(
+                    {"case": params[0], "type": "end_test_case"},
+                    namespace=self.log_namespace,
+                )
             elif name == "TESTCASE":
                 self.logger.marker(
                     {
                         "case": params[0].replace("TEST_CASE_ID=", ""),
                         "type": "test_case",
-                    }
+                    },
+                    namespace=self.log_namespace,
                 )
                 self.signal_test_case(params)
             elif name == "TESTFEEDBACK":
@@ -681,7 +866,20 @@ class TestShellAction(Action):
             self.logger.info(
                 "Test case result pattern: %r" % self.patterns["test_case_results"]
             )
-        retval = test_connection.expect(list(self.patterns.values()), timeout=timeout)
+        patterns = list(self.patterns.values())
+        if self.stop is None:
+            retval = test_connection.expect(patterns, timeout=timeout)
+        else:
+            # Parallel test shells check regularly if they should stop
+            end = time.monotonic() + timeout
+            while True:
+                self._check_stop()
+                remaining = end - time.monotonic()
+                retval = test_connection.expect(
+                    patterns, timeout=max(0, min(remaining, 1))
+                )
+                if patterns[retval] is not pexpect.TIMEOUT or remaining <= 1:
+                    break
         return self.check_patterns(
             list(self.patterns.keys())[retval], test_connection, check_char
         )
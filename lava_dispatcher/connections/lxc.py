@@ -81,6 +81,9 @@ class ConnectLxc(Action):
             self.timeout,
             logger=self.logger,
             window=self.job.device.get_constant("spawn_maxread"),
+            search_overlap=self.job.device.get_constant(
+                "spawn_search_overlap", missing_ok=True
+            ),
         )
         if shell.exitstatus:
             raise JobError(
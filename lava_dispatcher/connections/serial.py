@@ -23,6 +23,7 @@ from lava_dispatcher.utils.shell import which
 from lava_dispatcher.action import Action
 from lava_common.exceptions import JobError, InfrastructureError
 from lava_dispatcher.shell import ShellCommand, ShellSession
+from lava_dispatcher.connections.telnet import TelnetSession
 
 
 class ConnectDevice(Action):
@@ -41,6 +42,9 @@ class ConnectDevice(Action):
     session_class = ShellSession
     # runs the command to initiate the connection
     shell_class = ShellCommand
+    # used instead when the dispatcher is configured to connect natively and
+    # the connection command is supported
+    native_session_class = TelnetSession
 
     def __init__(self):
         super().__init__()
@@ -157,12 +161,24 @@ class ConnectDevice(Action):
             self.message,
             self.command,
         )
+        session_class = self.session_class
+        shell_class = self.shell_class
+        if (
+            self.native_session_class is not None
+            and self.job.parameters.get("dispatcher", {}).get("native_connections")
+            and self.native_session_class.accepts(self.command)
+        ):
+            session_class = self.native_session_class
+            shell_class = session_class.shell_class
         # ShellCommand executes the connection command
-        shell = self.shell_class(
+        shell = shell_class(
             "%s\n" % self.command,
             self.timeout,
             logger=self.logger,
             window=self.job.device.get_constant("spawn_maxread"),
+            search_overlap=self.job.device.get_constant(
+                "spawn_search_overlap", missing_ok=True
+            ),
         )
         if shell.exitstatus:
             raise InfrastructureError(
@@ -170,7 +186,7 @@ class ConnectDevice(Action):
                 % (self.command, shell.exitstatus, shell.readlines())
             )
         # ShellSession monitors the pexpect
-        connection = self.session_class(self.job, shell)
+        connection = session_class(self.job, shell)
         connection.connected = True
         if self.hardware:
             connection.tags = self.tag_dict[self.hardware]
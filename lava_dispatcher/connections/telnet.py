@@ -0,0 +1,345 @@
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+# Connect to the serial console from the dispatcher process, without running
+# an external client (telnet, nc or picocom) in a pty.
+
+import contextlib
+import os
+import re
+import shlex
+import socket
+import termios
+import time
+import tty
+
+import pexpect
+
+from lava_common.exceptions import InfrastructureError
+from lava_dispatcher.shell import ShellCommand, ShellSession
+
+# Telnet commands and options (RFC 854, 857 and 858)
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+ECHO = 1
+SGA = 3
+
+# Control characters, as sent by pexpect.sendcontrol()
+CONTROL_CHARS = {"@": 0, "`": 0, "[": 27, "{": 27, "\\": 28, "|": 28, "]": 29}
+CONTROL_CHARS.update({"}": 29, "^": 30, "~": 30, "_": 31, "?": 127})
+# Carriage return not followed by a line feed
+BARE_CR = re.compile(b"\r(?!\n)")
+
+
+def parse_command(command):
+    """
+    Return the address of the console if the connection command is supported:
+    * "telnet <host> [<port>]": ("telnet", host, port)
+    * "nc <host> <port>": ("tcp", host, port)
+    * "picocom -b <baudrate> <device>": ("tty", device, baudrate)
+    Return None otherwise.
+    """
+    try:
+        args = shlex.split(command)
+    except ValueError:
+        return None
+    if not args:
+        return None
+    name = os.path.basename(args[0])
+    with contextlib.suppress(ValueError):
+        if name == "telnet" and len(args) in [2, 3]:
+            return ("telnet", args[1], int(args[2]) if len(args) == 3 else 23)
+        if name in ["nc", "netcat"] and len(args) == 3:
+            return ("tcp", args[1], int(args[2]))
+        if name == "picocom" and len(args) == 4 and args[1] in ["-b", "--baud"]:
+            if hasattr(termios, "B%d" % int(args[2])):
+                return ("tty", args[3], int(args[2]))
+    return None
+
+
+class TelnetCommand(ShellCommand):
+    """
+    Drop-in replacement of the ShellCommand running the connection command:
+    reads and writes directly to the TCP socket (telnet or raw) or to the
+    local tty.
+    The telnet negotiations are answered like the telnet client in character
+    mode would do and removed from the output.
+    """
+
+    # Replaces the property of pexpect.spawn that uses the child process
+    flag_eof = False
+
+    def __init__(
+        self,
+        command,
+        lava_timeout,
+        logger=None,
+        cwd=None,
+        window=2000,
+        search_overlap=None,
+    ):
+        address = parse_command(command)
+        if address is None:
+            raise InfrastructureError(
+                "Unable to connect natively with '%s'" % command.strip()
+            )
+        super().__init__(
+            None,
+            lava_timeout,
+            logger=logger,
+            window=window,
+            search_overlap=search_overlap,
+        )
+        self.name = "TelnetCommand"
+        self.command = command.strip()
+        # The pacing is done in send()
+        self.delaybeforesend = None
+        self.delayafterread = None
+        self.sock = None
+        self.telnet = address[0] == "telnet"
+        self.telnet_pending = b""
+        self.telnet_options = {}
+
+        if address[0] == "tty":
+            self.child_fd = self._open_tty(address[1], address[2])
+        else:
+            try:
+                self.sock = socket.create_connection(
+                    address[1:], timeout=lava_timeout.duration
+                )
+            except OSError as exc:
+                raise InfrastructureError(
+                    "Unable to connect to %s:%d: %s" % (address[1], address[2], exc)
+                )
+            self.sock.settimeout(None)
+            self.child_fd = self.sock.fileno()
+        self.closed = False
+
+    def _open_tty(self, device, baudrate):
+        try:
+            fd = os.open(device, os.O_RDWR | os.O_NOCTTY)
+        except OSError as exc:
+            raise InfrastructureError("Unable to open %s: %s" % (device, exc))
+        # 8N1 without flow control, like picocom
+        tty.setraw(fd)
+        attrs = termios.tcgetattr(fd)
+        attrs[2] &= ~(termios.CSTOPB | termios.PARENB | termios.CRTSCTS)
+        attrs[2] |= termios.CLOCAL | termios.CREAD
+        attrs[0] &= ~(termios.IXON | termios.IXOFF)
+        attrs[4] = attrs[5] = getattr(termios, "B%d" % baudrate)
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        return fd
+
+    def _write(self, data):
+        while data:
+            data = data[os.write(self.child_fd, data) :]
+
+    def _negotiate(self, command, option):
+        # Let the server echo and suppress go-ahead, refuse the other options.
+        # Only answer when the state of the option changes (RFC 1143).
+        if command in [WILL, WONT]:
+            (key, accept, refuse) = (("remote", option), DO, DONT)
+            wanted = command == WILL and option in [ECHO, SGA]
+        else:
+            (key, accept, refuse) = (("local", option), WILL, WONT)
+            wanted = command == DO and option == SGA
+        if command in [WILL, DO] and not wanted:
+            self._write(bytes([IAC, refuse, option]))
+        elif self.telnet_options.get(key, False) != wanted:
+            self.telnet_options[key] = wanted
+            self._write(bytes([IAC, accept if wanted else refuse, option]))
+
+    def _telnet_filter(self, data):
+        """
+        Remove the telnet commands from data, keeping incomplete commands for
+        the next read.
+        """
+        data = self.telnet_pending + data
+        self.telnet_pending = b""
+        output = bytearray()
+        start = 0
+        while True:
+            index = data.find(IAC, start)
+            if index < 0:
+                output += data[start:]
+                break
+            output += data[start:index]
+            if index + 1 >= len(data):
+                self.telnet_pending = data[index:]
+                break
+            command = data[index + 1]
+            if command == IAC:
+                output.append(IAC)
+                start = index + 2
+            elif command in [WILL, WONT, DO, DONT]:
+                if index + 2 >= len(data):
+                    self.telnet_pending = data[index:]
+                    break
+                self._negotiate(command, data[index + 2])
+                start = index + 3
+            elif command == SB:
+                end = data.find(bytes([IAC, SE]), index + 2)
+                if end < 0:
+                    self.telnet_pending = data[index:]
+                    break
+                start = end + 2
+            else:
+                # NOP, GA, ...
+                start = index + 2
+        return bytes(output)
+
+    def read_nonblocking(self, size=1, timeout=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if timeout == -1:
+            timeout = self.timeout
+        end_time = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.wait_output(
+                None if end_time is None else max(0, end_time - time.monotonic())
+            )
+            try:
+                data = os.read(self.child_fd, size)
+            except OSError as exc:
+                raise pexpect.EOF("Connection closed: %s" % exc)
+            if not data:
+                raise pexpect.EOF("Connection closed by %s" % self.command)
+            if self.telnet:
+                data = self._telnet_filter(data)
+            # Only telnet commands were received
+            if data:
+                break
+        data = self._decoder.decode(data, final=False)
+        self._log(data, "read")
+        return data
+
+    def _encode(self, string):
+        data = self._encoder.encode(string, final=False)
+        if self.telnet:
+            # IAC is escaped and a bare carriage return is followed by NUL
+            # (RFC 854)
+            data = BARE_CR.sub(b"\r\x00", data.replace(b"\xff", b"\xff\xff"))
+        return data
+
+    def _pace(self, deadline):
+        """
+        Wait until deadline, reading the output meanwhile like the telnet
+        client would do. The output is kept for the next expect().
+        """
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                self.wait_output(remaining)
+            except pexpect.TIMEOUT:
+                return
+            try:
+                data = self.read_nonblocking(self.maxread, 0)
+            except pexpect.TIMEOUT:
+                # Only telnet commands were received
+                continue
+            except pexpect.EOF:
+                # Left for the next expect() or write to report
+                return
+            self._before.write(data)
+            self._buffer.write(data)
+
+    def send(self, string, delay=0, send_char=True):
+        """
+        Write string to the console. When sending characters one by one, the
+        next write is scheduled delay milliseconds after the previous one,
+        without the pexpect delaybeforesend.
+        """
+        if not string:
+            return 0
+        self._log(string, "send")
+        if not send_char:
+            self._write(self._encode(string))
+            return len(string)
+        delay = float(delay) / 1000
+        next_write = time.monotonic()
+        # "\r\n" is sent at once, the carriage return not being bare
+        for char in re.findall(r"\r\n|.", string, re.DOTALL):
+            self._pace(next_write)
+            self._write(self._encode(char))
+            next_write = time.monotonic() + delay
+        return len(string)
+
+    def sendcontrol(self, char):
+        self.logger.input(char)
+        char = char.lower()
+        if "a" <= char <= "z":
+            code = ord(char) - ord("a") + 1
+        else:
+            code = CONTROL_CHARS.get(char)
+            if code is None:
+                return 0
+        self._log(chr(code), "send")
+        self._write(bytes([code]))
+        return 1
+
+    def isalive(self):
+        return not self.closed
+
+    def kill(self, sig):
+        self.close()
+
+    def close(self, force=True):
+        if self.closed:
+            return
+        self.flush()
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        else:
+            os.close(self.child_fd)
+        self.child_fd = -1
+        self.closed = True
+
+
+class TelnetSession(ShellSession):
+    """
+    ShellSession over a TelnetCommand: disconnecting only closes the socket
+    or the tty, as no external client is running.
+    """
+
+    name = "TelnetSession"
+    shell_class = TelnetCommand
+
+    @classmethod
+    def accepts(cls, command):
+        return parse_command(command) is not None
+
+    def disconnect(self, reason=""):
+        self.logger.debug("Disconnecting %s: %s", self.name, reason)
+        self.connected = False
+        if self.raw_connection:
+            self.raw_connection.close()
+        self.raw_connection = None
+
+    def finalise(self):
+        if self.raw_connection:
+            self.disconnect(reason="Finalise")
@@ -30,6 +30,7 @@ from lava_common.exceptions import LAVABug, LAVAError, JobError
 from lava_common.version import __version__
 from lava_dispatcher.logical import PipelineContext
 from lava_dispatcher.diagnostics import DiagnoseNetwork
+from lava_dispatcher.utils.strings import seconds_to_str
 from lava_dispatcher.protocols.multinode import (  # pylint: disable=unused-import
     MultinodeProtocol,
 )
@@ -99,6 +100,43 @@ class Job:
             "pipeline": self.pipeline.describe(),
         }
 
+    def profile(self, description):
+        """
+        Add the profile of the actions that did run to the description: wall
+        time, cpu time of the subprocesses, bytes downloaded and logged.
+        The cpu time of concurrent actions is approximate ("~").
+        Also log the share of the job duration used by each top level action,
+        the slowest first.
+        """
+        profiles = self.pipeline.profile()
+
+        def add_profile(actions):
+            for action in actions:
+                if action.get("level") in profiles:
+                    action["profile"] = profiles[action["level"]]
+                add_profile(action.get("pipeline", []))
+
+        add_profile(description["pipeline"])
+
+        actions = [a for a in self.pipeline.actions if a.level in profiles]
+        total = sum(profiles[a.level]["duration"] for a in actions)
+        for action in sorted(
+            actions, key=lambda a: profiles[a.level]["duration"], reverse=True
+        ):
+            profile = profiles[action.level]
+            self.logger.info(
+                "profile: %s %s: %s (%d%%), cpu %s%0.2fs, downloaded %dMB, logged %dkB",
+                action.level,
+                action.name,
+                seconds_to_str(round(profile["duration"])),
+                100 * profile["duration"] / total if total else 0,
+                "~" if profile.get("cpu_approximate") else "",
+                profile["cpu"],
+                int(profile["downloaded"] / (1024 * 1024)),
+                int(profile["logged"] / 1024),
+            )
+        return profiles
+
     @property
     def tmp_dir(self):
         return self.get_basedir(DISPATCHER_DOWNLOAD_DIR)
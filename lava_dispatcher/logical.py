@@ -18,6 +18,8 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import importlib
+import sys
 import time
 from lava_dispatcher.action import Action
 from lava_common.exceptions import (
@@ -127,6 +129,23 @@ class DiagnosticAction(Action):
         return connection
 
 
+def load_strategies(base, method=None):
+    """
+    Import the modules defining the strategies of the base class that might
+    accept the given method, or every strategies when the method is not in
+    the registry of the base class.
+    Return False if every strategies were already imported.
+    """
+    if base.strategies in sys.modules:
+        return False
+    modules = [base.strategies]
+    if isinstance(method, str):
+        modules = base.registry.get(method, modules)
+    for module in modules:
+        importlib.import_module(module)
+    return True
+
+
 class Deployment:
     """
     Deployment is a strategy class which aggregates Actions
@@ -142,6 +161,38 @@ class Deployment:
     section = "deploy"
     compatibility = 0
 
+    # Importing every strategies is slow: only import the modules that might
+    # accept the "to" parameter.
+    strategies = "lava_dispatcher.actions.deploy.strategies"
+    registry = {
+        "docker": ["lava_dispatcher.actions.deploy.docker"],
+        "download": ["lava_dispatcher.actions.deploy.download"],
+        "downloads": ["lava_dispatcher.actions.deploy.downloads"],
+        "fastboot": ["lava_dispatcher.actions.deploy.fastboot"],
+        "flasher": ["lava_dispatcher.actions.deploy.flasher"],
+        "fvp": ["lava_dispatcher.actions.deploy.fvp"],
+        "iso-installer": ["lava_dispatcher.actions.deploy.iso"],
+        "lxc": ["lava_dispatcher.actions.deploy.lxc"],
+        "mps": ["lava_dispatcher.actions.deploy.mps"],
+        "musca": ["lava_dispatcher.actions.deploy.musca"],
+        "nbd": ["lava_dispatcher.actions.deploy.nbd"],
+        "nfs": [
+            "lava_dispatcher.actions.deploy.image",
+            "lava_dispatcher.actions.deploy.nfs",
+        ],
+        "overlay": ["lava_dispatcher.actions.deploy.overlay"],
+        "recovery": ["lava_dispatcher.actions.deploy.recovery"],
+        "sata": ["lava_dispatcher.actions.deploy.removable"],
+        "sd": ["lava_dispatcher.actions.deploy.removable"],
+        "ssh": ["lava_dispatcher.actions.deploy.ssh"],
+        "tftp": ["lava_dispatcher.actions.deploy.tftp"],
+        "tmpfs": ["lava_dispatcher.actions.deploy.image"],
+        "u-boot-ums": ["lava_dispatcher.actions.deploy.uboot_ums"],
+        "usb": ["lava_dispatcher.actions.deploy.removable"],
+        "uuu": ["lava_dispatcher.actions.deploy.uuu"],
+        "vemsd": ["lava_dispatcher.actions.deploy.vemsd"],
+    }
+
     @property
     def parameters(self):
         """
@@ -199,6 +250,7 @@ class Deployment:
     @classmethod
     def select(cls, device, parameters):
         cls.deploy_check(device, parameters)
+        load_strategies(cls, parameters.get("to"))
         candidates = cls.__subclasses__()
         replies = {}
         willing = []
@@ -214,6 +266,9 @@ class Deployment:
                 replies[c.name] = res[1]
 
         if not willing:
+            # Give the reasons of every strategies
+            if load_strategies(cls):
+                return cls.select(device, parameters)
             replies_string = ""
             for name, reply in replies.items():
                 replies_string += "%s: %s\n" % (name, reply)
@@ -235,6 +290,43 @@ class Boot:
     section = "boot"
     compatibility = 0
 
+    # Importing every strategies is slow: only import the modules that might
+    # accept the "method" parameter.
+    strategies = "lava_dispatcher.actions.boot.strategies"
+    registry = {
+        "barebox": ["lava_dispatcher.actions.boot.barebox"],
+        "bootloader": ["lava_dispatcher.actions.boot.bootloader"],
+        "cmsis-dap": ["lava_dispatcher.actions.boot.cmsis_dap"],
+        "depthcharge": ["lava_dispatcher.actions.boot.depthcharge"],
+        "dfu": ["lava_dispatcher.actions.boot.dfu"],
+        "docker": ["lava_dispatcher.actions.boot.docker"],
+        "fastboot": ["lava_dispatcher.actions.boot.fastboot"],
+        "fvp": ["lava_dispatcher.actions.boot.fvp"],
+        "gdb": ["lava_dispatcher.actions.boot.gdb"],
+        "grub": ["lava_dispatcher.actions.boot.grub"],
+        "grub-efi": ["lava_dispatcher.actions.boot.grub"],
+        "ipxe": ["lava_dispatcher.actions.boot.ipxe"],
+        "jlink": ["lava_dispatcher.actions.boot.jlink"],
+        "kexec": ["lava_dispatcher.actions.boot.kexec"],
+        "lxc": ["lava_dispatcher.actions.boot.lxc"],
+        "minimal": ["lava_dispatcher.actions.boot.minimal"],
+        "monitor": ["lava_dispatcher.actions.boot.qemu"],
+        "musca": ["lava_dispatcher.actions.boot.musca"],
+        "new_connection": ["lava_dispatcher.actions.boot.secondary"],
+        "openocd": ["lava_dispatcher.actions.boot.openocd"],
+        "pyocd": ["lava_dispatcher.actions.boot.pyocd"],
+        "qemu": ["lava_dispatcher.actions.boot.qemu"],
+        "qemu-iso": ["lava_dispatcher.actions.boot.iso"],
+        "qemu-nfs": ["lava_dispatcher.actions.boot.qemu"],
+        "recovery": ["lava_dispatcher.actions.boot.recovery"],
+        "schroot": ["lava_dispatcher.actions.boot.ssh"],
+        "ssh": ["lava_dispatcher.actions.boot.ssh"],
+        "u-boot": ["lava_dispatcher.actions.boot.u_boot"],
+        "uefi": ["lava_dispatcher.actions.boot.uefi"],
+        "uefi-menu": ["lava_dispatcher.actions.boot.uefi_menu"],
+        "uuu": ["lava_dispatcher.actions.boot.uuu"],
+    }
+
     @classmethod
     def boot_check(cls, device, parameters):
         if not device:
@@ -267,6 +359,7 @@ class Boot:
     @classmethod
     def select(cls, device, parameters):
         cls.boot_check(device, parameters)
+        load_strategies(cls, parameters.get("method"))
         candidates = cls.__subclasses__()
         replies = {}
         willing = []
@@ -283,6 +376,9 @@ class Boot:
                 replies[class_name] = res[1]
 
         if not willing:
+            # Give the reasons of every strategies
+            if load_strategies(cls):
+                return cls.select(device, parameters)
             replies_string = ""
             for name, reply in replies.items():
                 replies_string += "%s: %s\n" % (name, reply)
@@ -304,6 +400,10 @@ class LavaTest:
     section = "test"
     compatibility = 1  # used directly
 
+    # The test strategies are not selected by a method: import all of them.
+    strategies = "lava_dispatcher.actions.test.strategies"
+    registry = {}
+
     @classmethod
     def accepts(cls, device, parameters):
         """
@@ -316,6 +416,7 @@ class LavaTest:
 
     @classmethod
     def select(cls, device, parameters):
+        load_strategies(cls)
         candidates = cls.__subclasses__()
         replies = {}
         willing = []
@@ -112,6 +112,8 @@ class MenuConnect(ConnectDevice):
     summary = "Customise connection for menu operations"
 
     session_class = MenuSession
+    # MenuSession has its own wait()
+    native_session_class = None
 
     def validate(self):
         if self.job.device.connect_command == "":
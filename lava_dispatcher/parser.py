@@ -26,12 +26,10 @@ from lava_dispatcher.deployment_data import get_deployment_data
 from lava_dispatcher.power import FinalizeAction
 from lava_dispatcher.connection import Protocol
 
-# Bring in the strategy subclass lists, ignore pylint warnings.
+# Bring in the protocol subclass list, ignore pylint warnings.
+# The deploy, boot and test strategies are imported when selected.
 # pylint: disable=unused-import
 from lava_dispatcher.actions.commands import CommandAction
-import lava_dispatcher.actions.deploy.strategies
-import lava_dispatcher.actions.boot.strategies
-import lava_dispatcher.actions.test.strategies
 import lava_dispatcher.protocols.strategies
 
 
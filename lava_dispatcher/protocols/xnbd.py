@@ -27,7 +27,7 @@ from lava_common.exceptions import JobError, TestError
 from lava_dispatcher.shell import ShellCommand
 from lava_common.constants import XNBD_SYSTEM_TIMEOUT
 from lava_dispatcher.utils.network import dispatcher_ip
-from lava_dispatcher.utils.network import get_free_port
+from lava_dispatcher.utils.network import reserve_port
 
 
 class XnbdProtocol(Protocol):
@@ -45,6 +45,7 @@ class XnbdProtocol(Protocol):
         self.parameters = parameters
         self.port = None
         self.ports = []
+        self.reservations = {}
 
     @classmethod
     def accepts(cls, parameters):
@@ -90,7 +91,9 @@ class XnbdProtocol(Protocol):
         nbd_port = self.parameters["protocols"]["lava-xnbd"]["port"]
         if nbd_port == "auto":
             self.logger.debug("Get a port from pool")
-            nbd_port = get_free_port(self.parameters["dispatcher"])
+            reservation = reserve_port(self.parameters["dispatcher"])
+            nbd_port = reservation.port
+            self.reservations[nbd_port] = reservation
         self.ports.append(nbd_port)
         msg["data"]["nbd_server_port"] = nbd_port
         action.set_namespace_data(
@@ -111,10 +114,20 @@ class XnbdProtocol(Protocol):
         self.logger.debug("Set_port %d", nbd_port)
         return msg["data"]
 
+    def release_port(self, port):
+        """
+        Release the reservation of the port, once xnbd-server is listening.
+        """
+        reservation = self.reservations.pop(port, None)
+        if reservation is not None:
+            reservation.release()
+
     def finalise_protocol(self, device=None):
         """Called by Finalize action to power down and clean up the assigned
         device.
         """
+        for port in list(self.reservations):
+            self.release_port(port)
         # shutdown xnbd for the given device/job based in the port-number used
         try:
             self.logger.debug("%s cleanup", self.name)
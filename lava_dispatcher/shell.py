@@ -19,8 +19,11 @@
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
 import contextlib
+import functools
 import logging
 import pexpect
+import re
+import selectors
 import sre_constants
 import time
 from lava_dispatcher.action import Action
@@ -34,6 +37,7 @@ from lava_common.exceptions import (
 from lava_common.timeout import Timeout
 from lava_dispatcher.connection import Connection
 from lava_common.constants import LINE_SEPARATOR
+from lava_common.log import YAMLLogger
 from lava_dispatcher.utils.strings import seconds_to_str
 
 
@@ -43,28 +47,37 @@ class ShellLogger:
     using the logfile support built into pexpect.
     """
 
+    # remove the carriage returns and escape control characters, escape double
+    # quotes for YAML syntax
+    TRANSLATION = str.maketrans({"\r": None, '"': '\\"', "\x1b": None})
+
     def __init__(self, logger):
         self.line = ""
         self.logger = logger
         self.is_feedback = False
 
     def write(self, new_line):
-        replacements = {
-            "\n\n": "\n",  # double lines to single
-            "\r": "",
-            '"': '\\"',  # escape double quotes for YAML syntax
-            "\x1b": "",  # remove escape control characters
-        }
-        for key, value in replacements.items():
-            new_line = new_line.replace(key, value)
+        # double lines to single
+        new_line = new_line.replace("\n\n", "\n").translate(self.TRANSLATION)
         lines = self.line + new_line
 
         # Print one full line at a time. A partial line is kept in memory.
         if "\n" in lines:
             last_ret = lines.rindex("\n")
             self.line = lines[last_ret + 1 :]
-            lines = lines[:last_ret]
-            for line in lines.split("\n"):
+            lines = lines[:last_ret].split("\n")
+            if isinstance(self.logger, YAMLLogger):
+                # Log all the lines of this read at once
+                if not self.is_feedback:
+                    self.logger.log_messages(logging.INFO, "target", lines)
+                elif self.namespace:
+                    self.logger.log_messages(
+                        logging.INFO, "feedback", lines, namespace=self.namespace
+                    )
+                else:
+                    self.logger.log_messages(logging.INFO, "feedback", lines)
+                return
+            for line in lines:
                 if self.is_feedback:
                     if self.namespace:
                         self.logger.feedback(line, namespace=self.namespace)
@@ -81,6 +94,89 @@ class ShellLogger:
             self.write("\n")
 
 
+# Numbered backreferences and conditionals would point to another group once
+# the patterns are combined.
+NUMBERED_REFERENCE = re.compile(r"\\[1-9]|\(\?\(\d")
+# Global inline flags like "(?i)" would apply to every combined pattern.
+GLOBAL_FLAGS = re.compile(r"(?<!\\)\(\?[aiLmsux]+\)")
+SCOPED_FLAGS = ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"))
+
+
+@functools.lru_cache(maxsize=64)
+def combine_patterns(patterns):
+    """
+    Combine the list of (pattern, flags) into a single regular expression,
+    each pattern being the named group "_<index>".
+    The combined expression finds the same match as pexpect: the earliest
+    match, the lowest index winning on ties.
+    Return None if the patterns cannot be combined without changing their
+    meaning.
+    """
+    allowed = re.UNICODE
+    for (flag, _) in SCOPED_FLAGS:
+        allowed |= flag
+    groups = []
+    for (index, (pattern, flags)) in enumerate(patterns):
+        if not isinstance(pattern, str) or flags & ~allowed:
+            return None
+        if NUMBERED_REFERENCE.search(pattern) or GLOBAL_FLAGS.search(pattern):
+            return None
+        scoped = "".join(char for (flag, char) in SCOPED_FLAGS if flags & flag)
+        groups.append("(?P<_%d>(?%s:%s))" % (index, scoped, pattern))
+    try:
+        return re.compile("|".join(groups))
+    except re.error:
+        return None
+
+
+class ShellSearcher(pexpect.expect.searcher_re):
+    """
+    Search for all the patterns in a single pass over the buffer.
+
+    When overlap is set, only the new data and the previous overlap bytes are
+    searched while waiting for more output: a match cannot start earlier than
+    that. The whole buffer is still searched when expect() is called.
+    """
+
+    def __init__(self, patterns, overlap=None):
+        super().__init__(patterns)
+        self.overlap = overlap
+        # pexpect only gives the last longest_string bytes of the buffer and
+        # the new data to search(), instead of a copy of the whole buffer. One
+        # more byte is kept so that "^" does not match at the overlap start.
+        self.longest_string = None if overlap is None else overlap + 1
+        self.combined = combine_patterns(
+            tuple((s.pattern, s.flags) for (_, s) in self._searches)
+        )
+
+    def search(self, buffer, freshlen, searchwindowsize=None):
+        searchstart = 0
+        if searchwindowsize is not None:
+            searchstart = max(0, len(buffer) - searchwindowsize)
+        if self.overlap is not None:
+            searchstart = max(searchstart, len(buffer) - freshlen - self.overlap)
+
+        if self.combined is None:
+            first = None
+            for (index, s) in self._searches:
+                match = s.search(buffer, searchstart)
+                if match is not None and (first is None or match.start() < first[1]):
+                    first = (index, match.start(), match)
+            if first is None:
+                return -1
+            (best_index, self.start, self.match) = first
+        else:
+            match = self.combined.search(buffer, searchstart)
+            if match is None:
+                return -1
+            (best_index, s) = self._searches[int(match.lastgroup[1:])]
+            self.start = match.start()
+            # Give the caller the groups of the matching pattern
+            self.match = s.match(buffer, self.start)
+        self.end = self.match.end()
+        return best_index
+
+
 class ShellCommand(pexpect.spawn):
     """
     Run a command over a connection using pexpect instead of
@@ -91,11 +187,23 @@ class ShellCommand(pexpect.spawn):
 
     Window size is managed to limit impact on performance.
     maxread is left at default to ensure the entire log is captured.
+    When search_overlap is set, the patterns are only matched against the new
+    output and the previous search_overlap bytes.
+    The output is waited for with a selector registered once for the whole
+    connection.
 
     A ShellCommand is a raw_connection for a ShellConnection instance.
     """
 
-    def __init__(self, command, lava_timeout, logger=None, cwd=None, window=2000):
+    def __init__(
+        self,
+        command,
+        lava_timeout,
+        logger=None,
+        cwd=None,
+        window=2000,
+        search_overlap=None,
+    ):
         if isinstance(window, str):
             # constants need to be stored as strings.
             try:
@@ -105,6 +213,14 @@ class ShellCommand(pexpect.spawn):
                     "ShellCommand was passed an invalid window size of %s bytes."
                     % window
                 )
+        if isinstance(search_overlap, str):
+            try:
+                search_overlap = int(search_overlap)
+            except ValueError:
+                raise LAVABug(
+                    "ShellCommand was passed an invalid search overlap of %s bytes."
+                    % search_overlap
+                )
         if not lava_timeout or not isinstance(lava_timeout, Timeout):
             raise LAVABug("ShellCommand needs a timeout set by the calling Action")
         if not logger:
@@ -126,6 +242,8 @@ class ShellCommand(pexpect.spawn):
         # set a default newline character, but allow actions to override as necessary
         self.linesep = LINE_SEPARATOR
         self.lava_timeout = lava_timeout
+        self.search_overlap = search_overlap
+        self.selector = None
 
     def sendline(self, s="", delay=0):
         """
@@ -183,6 +301,56 @@ class ShellCommand(pexpect.spawn):
             raise ConnectionClosedError("Connection closed")
         return proc
 
+    def expect_list(
+        self, pattern_list, timeout=-1, searchwindowsize=-1, async_=False, **kw
+    ):
+        """
+        Extends pexpect.expect_list to match the patterns with a ShellSearcher
+        """
+        if async_ or kw:
+            return super().expect_list(
+                pattern_list, timeout, searchwindowsize, async_, **kw
+            )
+        if timeout == -1:
+            timeout = self.timeout
+        searcher = ShellSearcher(pattern_list, self.search_overlap)
+        return self.expect_loop(searcher, timeout, searchwindowsize)
+
+    def read_nonblocking(self, size=1, timeout=-1):
+        """
+        Replaces pexpect.read_nonblocking: wait for the output with the
+        selector instead of calling select() and checking that the child is
+        alive before each read.
+        If the child is dead, the read will raise pexpect.EOF.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        self.wait_output(timeout)
+        try:
+            return pexpect.spawnbase.SpawnBase.read_nonblocking(self, size)
+        except pexpect.EOF:
+            # Update the exit status of the child
+            self.isalive()
+            raise
+
+    def wait_output(self, timeout=-1):
+        """
+        Wait for the output to be readable or raise pexpect.TIMEOUT.
+        """
+        if timeout == -1:
+            timeout = self.timeout
+        if self.selector is None:
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.child_fd, selectors.EVENT_READ)
+        if not self.selector.select(timeout):
+            raise pexpect.TIMEOUT("Timeout exceeded.")
+
+    def close(self, force=True):
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+        super().close(force)
+
     def empty_buffer(self):
         """Make sure there is nothing in the pexpect buffer."""
         index = 0
@@ -0,0 +1,223 @@
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+# Content addressed cache of the downloaded resources, shared by every jobs
+# running on the worker.
+#
+# Each entry is stored under the sha256 of its key:
+# * "<name>": the resource, as saved in the job directory (decompressed if
+#   needed)
+# * "<name>.json": the size and checksums of the downloaded stream
+# * "<name>.lock": locked (shared) while reading the entry and (exclusive)
+#   while populating it
+#
+# The resource is copied into the job directory because some actions are
+# modifying the images in place: a hard link would corrupt the cache. The copy
+# is a reflink when the filesystem supports it.
+# qcow2 images can instead be hard linked and used as the read-only backing
+# file of a per-job qcow2 image: the hard link keeps the data alive if the
+# entry is evicted while the job is running.
+
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import time
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+QCOW2_MAGIC = b"QFI\xfb"
+
+
+def lock_file(lock, operation: int, check: Optional[Callable[[], None]] = None):
+    """
+    flock the file. When check is set, the lock is polled and check() is
+    called while waiting: it should raise to stop waiting. Actions running in
+    a thread are not interrupted by the timeout alarm and use their
+    Timeout.check().
+    """
+    if check is None:
+        fcntl.flock(lock, operation)
+        return
+    while True:
+        try:
+            fcntl.flock(lock, operation | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            check()
+            time.sleep(0.1)
+
+
+def clone_file(src: str, dst: str) -> None:
+    """
+    Copy src to dst, using a reflink if possible.
+    """
+    with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        except OSError:
+            shutil.copyfileobj(f_src, f_dst, 1024 * 1024)
+
+
+def link_file(src: str, dst: str) -> None:
+    """
+    Hard link src to dst, falling back to a copy.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        clone_file(src, dst)
+
+
+class CacheEntry:
+    def __init__(
+        self, path: Path, lock=None, check: Optional[Callable[[], None]] = None
+    ):
+        self.path = path
+        self.metadata_path = path.with_name(path.name + ".json")
+        self.lock = lock
+        self.check = check
+
+    def _lock_exclusive(self) -> None:
+        # Upgrade the shared lock taken to read a populated entry
+        if self.lock is not None:
+            lock_file(self.lock, fcntl.LOCK_EX, self.check)
+
+    def get(self, dest: str, link: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Copy (or hard link) the cached resource to dest and return its
+        metadata. Return None if the resource is not in the cache.
+        """
+        metadata = self.metadata()
+        if metadata is None:
+            return None
+        try:
+            if link:
+                link_file(str(self.path), dest)
+            else:
+                clone_file(str(self.path), dest)
+        except OSError:
+            return None
+        return metadata
+
+    def metadata(self) -> Optional[Dict[str, Any]]:
+        """
+        Return the metadata of the cached resource, which can then be read in
+        place from self.path while the entry is locked. Return None if the
+        resource is not in the cache.
+        """
+        try:
+            metadata = json.loads(self.metadata_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        # Used for the LRU eviction
+        with contextlib.suppress(OSError):
+            os.utime(str(self.path))
+        return metadata
+
+    def is_qcow2(self) -> bool:
+        try:
+            with self.path.open("rb") as f_in:
+                return f_in.read(len(QCOW2_MAGIC)) == QCOW2_MAGIC
+        except OSError:
+            return False
+
+    def store(self, src: str, metadata: Dict[str, Any]) -> None:
+        """
+        Populate the entry, replacing the previous content if any.
+        """
+        self._lock_exclusive()
+        part = self.path.with_name(self.path.name + ".part")
+        clone_file(src, str(part))
+        part.rename(self.path)
+        self.metadata_path.write_text(json.dumps(metadata), encoding="utf-8")
+
+    def update(self, metadata: Dict[str, Any]) -> None:
+        """
+        Replace the metadata of a populated entry.
+        """
+        self._lock_exclusive()
+        part = self.metadata_path.with_name(self.metadata_path.name + ".part")
+        part.write_text(json.dumps(metadata), encoding="utf-8")
+        part.rename(self.metadata_path)
+
+
+class DownloadCache:
+    def __init__(self, path: str, size: int):
+        """
+        :param path: the cache directory
+        :param size: the maximum size of the cache in bytes
+        """
+        self.path = Path(path)
+        self.size = size
+
+    def lock_path(self, name: str) -> Path:
+        return self.path / (name + ".lock")
+
+    @contextlib.contextmanager
+    def entry(
+        self, key: str, check: Optional[Callable[[], None]] = None
+    ) -> Iterator[CacheEntry]:
+        """
+        Lock the cache entry for the given key.
+        If the entry is not populated yet, the lock is exclusive and the
+        caller should populate it: concurrent jobs will wait for it.
+        See lock_file() for check.
+        """
+        self.path.mkdir(mode=0o755, parents=True, exist_ok=True)
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        with self.lock_path(name).open("ab") as lock:
+            entry = CacheEntry(self.path / name, lock, check)
+            lock_file(lock, fcntl.LOCK_SH, check)
+            if not entry.metadata_path.is_file():
+                lock_file(lock, fcntl.LOCK_EX, check)
+            yield entry
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits in the
+        maximum size. Entries that are currently used are skipped.
+        """
+        entries = []
+        total = 0
+        for data in self.path.iterdir():
+            if data.suffix:
+                continue
+            with contextlib.suppress(OSError):
+                st = data.stat()
+                entries.append((st.st_mtime, st.st_size, data))
+                total += st.st_size
+
+        for (_, size, data) in sorted(entries):
+            if total <= self.size:
+                return
+            with self.lock_path(data.name).open("ab") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                with contextlib.suppress(OSError):
+                    data.with_name(data.name + ".json").unlink()
+                with contextlib.suppress(OSError):
+                    data.unlink()
+                    total -= size
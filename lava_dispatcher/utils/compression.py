@@ -24,7 +24,9 @@
 # android images: tar + xz,bz2,gz, or just gz,xz,bzip2
 # vexpress recovery images: any compression though usually zip
 
+import contextlib
 import os
+import shutil
 import subprocess  # nosec - internal use.
 import tarfile
 
@@ -35,61 +37,156 @@ from lava_dispatcher.utils.shell import which
 
 
 # https://www.kernel.org/doc/Documentation/xz.txt
-compress_command_map = {"xz": ["xz", "--check=crc32"], "gz": ["gzip"], "bz2": ["bzip2"]}
+compress_command_map = {
+    "xz": ["xz", "--check=crc32"],
+    "gz": ["gzip"],
+    "bz2": ["bzip2"],
+    "zstd": ["zstd", "-q"],
+}
 decompress_command_map = {
     "xz": ["unxz"],
     "gz": ["gunzip"],
     "bz2": ["bunzip2"],
     "zip": ["unzip"],
+    "zstd": ["zstd", "-d", "-q"],
 }
 
+# Multi-threaded tools, used instead of the ones above when installed.
+# "{threads}" is replaced by the number of threads.
+parallel_compress_command_map = {
+    "xz": ["xz", "--check=crc32", "-T{threads}"],
+    "gz": ["pigz", "-p", "{threads}"],
+    "bz2": ["pbzip2", "-p{threads}"],
+    "zstd": ["zstd", "-q", "-T{threads}"],
+}
+parallel_decompress_command_map = {
+    "xz": ["xz", "-d", "-T{threads}"],
+    "gz": ["pigz", "-d", "-p", "{threads}"],
+    "bz2": ["pbzip2", "-d", "-p{threads}"],
+    "zstd": ["zstd", "-d", "-q", "-T{threads}"],
+}
 
-def compress_file(infile, compression):
-    if not compression:
-        return infile
-    if compression not in compress_command_map.keys():
-        raise JobError("Cannot find shell command to compress: %s" % compression)
+# Magic numbers of the newc cpio archives (without and with checksums)
+CPIO_NEWC_MAGIC = (b"070701", b"070702")
 
+
+def compression_threads(job):
+    """
+    Number of threads of the multi-threaded (de)compression tools, bounded by
+    "compression_threads" in the dispatcher configuration (default to the
+    number of cpus). 1 disables the multi-threaded tools.
+    """
+    threads = 0
+    if job is not None:
+        threads = job.parameters.get("dispatcher", {}).get("compression_threads", 0)
+    return int(threads) or os.cpu_count() or 1
+
+
+def _command(compression, threads, command_map, parallel_command_map):
+    if threads > 1 and compression in parallel_command_map:
+        cmd = parallel_command_map[compression]
+        if shutil.which(cmd[0]):
+            return [arg.format(threads=threads) for arg in cmd]
     # Check that the command does exists
-    which(compress_command_map[compression][0])
+    which(command_map[compression][0])
+    # local copy for idempotency
+    return command_map[compression][:]
 
-    with chdir(os.path.dirname(infile)):
-        # local copy for idempotency
-        cmd = compress_command_map[compression][:]
-        cmd.append(infile)
-        try:
-            subprocess.check_output(cmd)  # nosec - internal use.
-            return "%s.%s" % (infile, compression)
-        except (OSError, subprocess.CalledProcessError) as exc:
-            raise InfrastructureError("unable to compress file %s: %s" % (infile, exc))
 
+def compress_command(compression, threads=1):
+    """
+    Command compressing stdin (or the given file) to stdout.
+    """
+    if compression not in compress_command_map:
+        raise JobError("Cannot find shell command to compress: %s" % compression)
+    return _command(
+        compression, threads, compress_command_map, parallel_compress_command_map
+    ) + ["-c"]
 
-def decompress_file(infile, compression):
+
+def decompress_command(compression, threads=1):
+    """
+    Command decompressing stdin (or the given file) to stdout.
+    """
+    if compression not in decompress_command_map or compression == "zip":
+        raise JobError("Cannot find shell command to decompress: %s" % compression)
+    return _command(
+        compression, threads, decompress_command_map, parallel_decompress_command_map,
+    ) + ["-c"]
+
+
+def compress_file(infile, compression, threads=1):
+    if not compression:
+        return infile
+    cmd = compress_command(compression, threads)
+    outfile = "%s.%s" % (infile, compression)
+    try:
+        with open(outfile, "wb") as f_out:
+            subprocess.check_call(cmd + [infile], stdout=f_out)  # nosec - internal use.
+        # Like the compression tools, remove the original file
+        os.unlink(infile)
+        return outfile
+    except (OSError, subprocess.CalledProcessError) as exc:
+        raise InfrastructureError("unable to compress file %s: %s" % (infile, exc))
+
+
+def decompress_file(infile, compression, threads=1):
     if not compression:
         return infile
     if compression not in decompress_command_map.keys():
         raise JobError("Cannot find shell command to decompress: %s" % compression)
 
-    # Check that the command does exists
-    which(decompress_command_map[compression][0])
-
-    with chdir(os.path.dirname(infile)):
-        # local copy for idempotency
-        cmd = decompress_command_map[compression][:]
-        cmd.append(infile)
-        outfile = infile
-        if infile.endswith(compression):
-            outfile = infile[: -(len(compression) + 1)]
-        try:
-            subprocess.check_output(cmd)  # nosec - internal use.
-            return outfile
-        except (OSError, subprocess.CalledProcessError) as exc:
-            raise InfrastructureError(
-                "unable to decompress file %s: %s" % (infile, exc)
-            )
+    if compression == "zip":
+        # Check that the command does exists
+        which(decompress_command_map[compression][0])
+        with chdir(os.path.dirname(infile)):
+            # local copy for idempotency
+            cmd = decompress_command_map[compression][:]
+            cmd.append(infile)
+            try:
+                subprocess.check_output(cmd)  # nosec - internal use.
+                return infile
+            except (OSError, subprocess.CalledProcessError) as exc:
+                raise InfrastructureError(
+                    "unable to decompress file %s: %s" % (infile, exc)
+                )
+
+    cmd = decompress_command(compression, threads)
+    outfile = infile
+    if infile.endswith(compression):
+        outfile = infile[: -(len(compression) + 1)]
+    try:
+        with open(outfile + ".part", "wb") as f_out:
+            subprocess.check_call(cmd + [infile], stdout=f_out)  # nosec - internal use.
+        # Like the decompression tools, replace the original file
+        os.unlink(infile)
+        os.rename(outfile + ".part", outfile)
+        return outfile
+    except (OSError, subprocess.CalledProcessError) as exc:
+        with contextlib.suppress(OSError):
+            os.unlink(outfile + ".part")
+        raise InfrastructureError("unable to decompress file %s: %s" % (infile, exc))
 
 
 def untar_file(infile, outdir):
+    """
+    Extract the tarball into outdir, using tar when available as it is a lot
+    faster than the tarfile module.
+    """
+    if shutil.which("tar") is not None:
+        try:
+            os.makedirs(outdir, mode=0o755, exist_ok=True)
+            subprocess.check_output(  # nosec - internal use.
+                ["tar", "-x", "-f", infile, "-C", outdir], stderr=subprocess.STDOUT
+            )
+        except subprocess.CalledProcessError as exc:
+            raise JobError(
+                "Unable to unpack %s: %s"
+                % (infile, exc.output.decode("utf-8", errors="replace"))
+            )
+        except OSError as exc:
+            raise InfrastructureError("Unable to unpack %s: %s" % (infile, str(exc)))
+        return
     try:
         with tarfile.open(infile, encoding="utf-8") as tar:
             tar.extractall(outdir)
@@ -99,7 +196,7 @@ def untar_file(infile, outdir):
         raise InfrastructureError("Unable to unpack %s: %s" % (infile, str(exc)))
 
 
-def cpio(directory, filename):
+def cpio(directory, filename, exclude=()):
     which("cpio")
     which("find")
     with chdir(directory):
@@ -107,6 +204,12 @@ def cpio(directory, filename):
             find = subprocess.check_output(
                 ["find", "."], stderr=subprocess.STDOUT
             )  # nosec
+            if exclude:
+                find = b"".join(
+                    line + b"\n"
+                    for line in find.splitlines()
+                    if os.path.normpath(os.fsdecode(line)) not in exclude
+                )
             return subprocess.check_output(  # nosec
                 ["cpio", "--create", "--format", "newc", "--file", filename],
                 input=find,
@@ -118,6 +221,105 @@ def cpio(directory, filename):
             )
 
 
+def _skip(stream, size):
+    while size > 0:
+        data = stream.read(min(size, 1024 * 1024))
+        if not data:
+            return False
+        size -= len(data)
+    return True
+
+
+def _cpio_names(stream):
+    names = set()
+    while True:
+        header = stream.read(110)
+        if len(header) < 110 or header[:6] not in CPIO_NEWC_MAGIC:
+            return None
+        try:
+            filesize = int(header[54:62], 16)
+            namesize = int(header[94:102], 16)
+        except ValueError:
+            return None
+        # The name and the data are 4 bytes aligned
+        name = stream.read(namesize)
+        if len(name) < namesize or not _skip(stream, -(110 + namesize) % 4):
+            return None
+        name = os.fsdecode(name.rstrip(b"\0"))
+        if name == "TRAILER!!!":
+            break
+        names.add(os.path.normpath(name.lstrip("/") or "."))
+        if not _skip(stream, filesize + (-filesize % 4)):
+            return None
+    # Only the zero padding can follow the trailer: the names of any other
+    # concatenated archive are not listed.
+    while True:
+        data = stream.read(1024 * 1024)
+        if not data:
+            return names
+        if data.strip(b"\0"):
+            return None
+
+
+def cpio_entries(filename, compression=None, threads=1):
+    """
+    Names of the entries of the (compressed) newc cpio archive, relative to
+    its root. Return None when the file cannot be listed, for instance when
+    several archives are concatenated.
+    """
+    try:
+        if not compression:
+            with open(filename, "rb") as f_in:
+                return _cpio_names(f_in)
+        cmd = decompress_command(compression, threads) + [filename]
+        proc = subprocess.Popen(  # nosec - internal use.
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        with proc:
+            names = _cpio_names(proc.stdout)
+            proc.stdout.close()
+            if proc.wait() != 0:
+                return None
+        return names
+    except (OSError, InfrastructureError, JobError):
+        return None
+
+
+def append_cpio(directory, filename, compression=None, threads=1, entries=()):
+    """
+    Append the content of directory to the cpio archive as a new (compressed)
+    cpio archive. The kernel unpacks every archive concatenated in the
+    initramfs, the last one overriding the previous ones.
+    The directories listed in entries (see cpio_entries) are left out of the
+    new archive: the kernel would otherwise replace the existing symlinks (like
+    lib -> usr/lib) and reset the permissions. Files cannot be removed.
+    """
+    exclude = {"."}
+    for root, dirs, _ in os.walk(directory):
+        for name in dirs:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                continue
+            path = os.path.relpath(path, directory)
+            if path in entries:
+                exclude.add(path)
+    segment = filename + ".append"
+    output = cpio(directory, segment, exclude)
+    segment = compress_file(segment, compression, threads)
+    try:
+        with open(filename, "ab") as f_out, open(segment, "rb") as f_in:
+            # Uncompressed archives should be 4 bytes aligned: the kernel
+            # skips the zero padding.
+            f_out.write(b"\0" * (-f_out.tell() % 4))
+            shutil.copyfileobj(f_in, f_out)
+        os.unlink(segment)
+    except OSError as exc:
+        raise InfrastructureError(
+            "Unable to append to cpio archive %r: %s" % (filename, exc)
+        )
+    return output
+
+
 def uncpio(filename, directory):
     which("cpio")
     with chdir(directory):
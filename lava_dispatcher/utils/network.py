@@ -24,8 +24,10 @@
 # imported by the parser to populate the list of subclasses.
 
 import contextlib
+import fcntl
 import os
 import netifaces
+from pathlib import Path
 import random
 import requests
 from requests.adapters import HTTPAdapter
@@ -35,6 +37,7 @@ import subprocess  # nosec - internal use.
 
 from lava_common.exceptions import InfrastructureError, LAVABug
 from lava_common.constants import (
+    DISPATCHER_PORTS_DIR,
     XNBD_PORT_RANGE_MIN,
     XNBD_PORT_RANGE_MAX,
     VALID_DISPATCHER_IP_PROTOCOLS,
@@ -102,36 +105,73 @@ def rpcinfo_nfs(server, version=3):
     return None
 
 
-def get_free_port(dispatcher_config):
+class PortReservation:
     """
-    Finds the next free port to use
+    A port reserved for the job: the other jobs running on the worker will
+    not get the same port until the reservation is released, once the
+    service is listening on it.
+    """
+
+    def __init__(self, port, lock=None):
+        self.port = port
+        self.lock = lock
+
+    def release(self):
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+
+
+def _port_is_free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind(("", port))
+        except OSError:
+            return False
+    return True
+
+
+def reserve_port(dispatcher_config, path=DISPATCHER_PORTS_DIR):
+    """
+    Reserve the next free port to use.
+    Each port of the range is locked (exclusive) in the reservation directory
+    while it is reserved, so jobs running concurrently on the worker cannot
+    get the same port between the reservation and the start of the service.
     :param dispatcher_config: the dispatcher config to search for nbd_server_port
-    :return: port number
+    :param path: the reservation directory
+    :return: a PortReservation
     """
-    port = None
     with contextlib.suppress(KeyError, TypeError):
         dcport = dispatcher_config["nbd_server_port"]
         if "auto" in dcport:
             pass
         elif dcport.isdigit():
-            return dcport
-    # use random
-    rng = random.Random()
-    for _ in range(10):
-        randport = int(rng.randrange(XNBD_PORT_RANGE_MIN, XNBD_PORT_RANGE_MAX))
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            s.bind(("", randport))
-            s.listen(1)
-            port = s.getsockname()[1]
-        except OSError:
-            s.close()
-            continue
-        s.close()
-        if port is not None:
-            return port
+            return PortReservation(dcport)
+
+    locks = Path(path)
+    try:
+        locks.mkdir(mode=0o755, parents=True, exist_ok=True)
+    except OSError:
+        locks = None
+    # Start from a random port to limit the contention on the locks
+    span = XNBD_PORT_RANGE_MAX - XNBD_PORT_RANGE_MIN
+    first = random.randrange(span)  # nosec - not used for security
+    for offset in range(span):
+        port = XNBD_PORT_RANGE_MIN + (first + offset) % span
+        lock = None
+        if locks is not None:
+            lock = (locks / ("%d.lock" % port)).open("ab")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                continue
+        if _port_is_free(port):
+            return PortReservation(port, lock)
+        if lock is not None:
+            lock.close()
     # fallthrough single default nbd port as per services file
-    return 10809
+    return PortReservation(10809)
 
 
 def requests_retry():
@@ -0,0 +1,98 @@
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+# Resources prefetched by lava-worker are stored in the job temporary
+# directory, under "prefetch/", using the sha256 of the url as filename.
+# While the worker is downloading a resource, it holds an exclusive lock on
+# "<filename>.lock". The file is renamed from "<filename>.part" to
+# "<filename>" only when the download is complete.
+#
+# This module is imported by lava-worker: only use the standard library and
+# the standard library based modules of lava_dispatcher.utils.
+
+from typing import Any, Callable, Dict, List, Optional
+
+import contextlib
+import fcntl
+import hashlib
+from pathlib import Path
+from urllib.parse import urlparse
+
+from lava_dispatcher.utils.cache import lock_file
+
+PREFETCH_DIR = "prefetch"
+
+
+def prefetch_path(base_dir: str, url: str) -> Path:
+    """
+    Return the path of the prefetched resource in the job base directory.
+    """
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return Path(base_dir) / PREFETCH_DIR / name
+
+
+def lock_path(path: Path) -> Path:
+    return path.with_name(path.name + ".lock")
+
+
+def part_path(path: Path) -> Path:
+    return path.with_name(path.name + ".part")
+
+
+def prefetch_resources(definition: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    List the http(s) resources of every deploy actions.
+    Each resource is a dictionary with the "url" and the optional "headers".
+    """
+
+    def resource(params):
+        if not isinstance(params, dict) or not isinstance(params.get("url"), str):
+            return None
+        if urlparse(params["url"]).scheme not in ["http", "https"]:
+            return None
+        return {"url": params["url"], "headers": params.get("headers", {})}
+
+    resources = []
+    for action in definition.get("actions", []):
+        deploy = action.get("deploy") if isinstance(action, dict) else None
+        if not isinstance(deploy, dict):
+            continue
+        for value in deploy.values():
+            candidates = [value]
+            # "images" (and similar) hold one dictionary per resource
+            if isinstance(value, dict) and "url" not in value:
+                candidates = list(value.values())
+            for params in candidates:
+                res = resource(params)
+                if res is not None and res["url"] not in [r["url"] for r in resources]:
+                    resources.append(res)
+    return resources
+
+
+def wait_for_prefetch(
+    path: Path, check: Optional[Callable[[], None]] = None
+) -> Optional[Path]:
+    """
+    Wait for lava-worker to release the resource and return the path if the
+    resource was completely downloaded. Return None otherwise.
+    See lock_file() for check.
+    """
+    with contextlib.suppress(FileNotFoundError):
+        with lock_path(path).open("rb") as lock:
+            lock_file(lock, fcntl.LOCK_SH, check)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return path if path.is_file() else None
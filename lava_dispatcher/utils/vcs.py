@@ -18,8 +18,12 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import contextlib
+import fcntl
+import hashlib
 import logging
 import os
+import re
 import shutil
 import subprocess  # nosec - internal use.
 
@@ -43,28 +47,93 @@ class GitHelper(VCSHelper):
       commit_id = git.clone('destination')
       commit_id = git.clone('destination2, 'hash')
 
+    When a mirror directory is given, the repository is cloned from a local
+    mirror, updated before each clone unless the requested revision is a
+    commit already present in the mirror.
+
     This helper will raise a InfrastructureError for any error encountered.
     """
 
-    def __init__(self, url):
+    def __init__(self, url, mirror=None):
         super().__init__(url)
         self.binary = "/usr/bin/git"
+        self.mirror = mirror
+
+    @contextlib.contextmanager
+    def update_mirror(self, revision=None):
+        """
+        Create or update the mirror of the repository and return its path.
+        The mirror is locked while updating it and (shared) while in use.
+        """
+        logger = logging.getLogger("dispatcher")
+        os.makedirs(self.mirror, mode=0o755, exist_ok=True)
+        name = hashlib.sha256(self.url.encode("utf-8")).hexdigest()
+        path = os.path.join(self.mirror, name + ".git")
+        with open(path + ".lock", "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.isdir(path):
+                logger.debug("Creating the mirror of %s", self.url)
+                shutil.rmtree(path + ".part", ignore_errors=True)
+                subprocess.check_output(  # nosec - internal use.
+                    [self.binary, "clone", "--mirror", self.url, path + ".part"],
+                    stderr=subprocess.STDOUT,
+                )
+                os.rename(path + ".part", path)
+            elif revision is not None and self._has_commit(path, str(revision)):
+                logger.debug("Commit %s is already in the mirror", revision)
+            else:
+                logger.debug("Updating the mirror of %s", self.url)
+                try:
+                    subprocess.check_output(  # nosec - internal use.
+                        [self.binary, "-C", path, "fetch", "--prune", "origin"],
+                        stderr=subprocess.STDOUT,
+                    )
+                except subprocess.CalledProcessError as exc:
+                    # Use the current content of the mirror
+                    logger.warning("Unable to update the mirror of %s", self.url)
+                    logger.warning(exc.output.decode("utf-8", errors="replace"))
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            yield path
+
+    def _has_commit(self, path, revision):
+        if not re.fullmatch("[0-9a-f]{40}", revision):
+            return False
+        ret = subprocess.run(  # nosec - internal use.
+            [self.binary, "-C", path, "cat-file", "-e", revision + "^{commit}"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        return ret.returncode == 0
 
     def clone(self, dest_path, shallow=False, revision=None, branch=None, history=True):
         logger = logging.getLogger("dispatcher")
         try:
-            if branch is not None:
-                cmd_args = [self.binary, "clone", "-b", branch, self.url, dest_path]
-            else:
-                cmd_args = [self.binary, "clone", self.url, dest_path]
-
-            if shallow:
-                cmd_args.append("--depth=1")
+            with contextlib.ExitStack() as stack:
+                url = self.url
+                if self.mirror is not None:
+                    mirror = stack.enter_context(self.update_mirror(revision))
+                    # Use the file:// protocol for --depth to be honored
+                    url = "file://" + os.path.abspath(mirror)
+
+                if branch is not None:
+                    cmd_args = [self.binary, "clone", "-b", branch, url, dest_path]
+                else:
+                    cmd_args = [self.binary, "clone", url, dest_path]
+
+                if shallow:
+                    cmd_args.append("--depth=1")
+
+                logger.debug("Running '%s'", " ".join(cmd_args))
+                subprocess.check_output(  # nosec - internal use.
+                    cmd_args, stderr=subprocess.STDOUT
+                )
 
-            logger.debug("Running '%s'", " ".join(cmd_args))
-            subprocess.check_output(  # nosec - internal use.
-                cmd_args, stderr=subprocess.STDOUT
-            )
+            if self.mirror is not None:
+                subprocess.check_output(  # nosec - internal use.
+                    [self.binary, "-C", dest_path, "remote", "set-url", "origin"]
+                    + [self.url],
+                    stderr=subprocess.STDOUT,
+                )
 
             if revision is not None:
                 logger.debug("Running '%s checkout %s", self.binary, str(revision))
@@ -27,27 +27,45 @@ import argparse
 import asyncio
 import contextlib
 from dataclasses import dataclass
+import fcntl
 import getpass
+import importlib
 import json
 import logging
 import logging.handlers
 import os
 from pathlib import Path
 import requests
+import runpy
 import signal
 import shutil
+import socket
 import subprocess
 import sqlite3
 import sys
+import tempfile
+import threading
 import time
 import traceback
+from urllib.parse import quote_plus
 import yaml
 
 from lava_common.compat import yaml_safe_load
-from lava_common.constants import DISPATCHER_DOWNLOAD_DIR, WORKER_DIR
+from lava_common.constants import (
+    DISPATCHER_DOWNLOAD_DIR,
+    HTTP_DOWNLOAD_CHUNK_SIZE,
+    WORKER_DIR,
+)
 from lava_common.exceptions import LAVABug
-from lava_common.version import __version__
+from lava_common.version import __version__, version
 from lava_common.worker import get_parser
+from lava_dispatcher.utils.cache import link_file
+from lava_dispatcher.utils.prefetch import (
+    lock_path,
+    part_path,
+    prefetch_path,
+    prefetch_resources,
+)
 
 
 ###########
@@ -55,6 +73,7 @@ from lava_common.worker import get_parser
 ###########
 FINISH_MAX_DURATION = 120
 JOBS_CHECK_INTERVAL = 5
+CLEANUP_INTERVAL = 10
 
 TIMEOUT = 60 * 10  # http timeout to 10 minutes
 WORKER_DIR = Path(WORKER_DIR)
@@ -74,6 +93,15 @@ SESSION = requests.Session()
 ping_interval = 20
 debug = False
 tmp_dir = WORKER_DIR / "tmp"
+# Prefetching threads that should be stopped, by job id
+prefetches: Dict[int, threading.Event] = {}
+# Downloads retention
+downloads_dir = WORKER_DIR / "downloads"
+retain_downloads = False
+retention_lock = threading.Lock()
+min_free_space = 20
+# Process forking lava-run, if enabled
+zygote = None
 
 # Stale configuration
 STALE_CONFIG = {
@@ -81,6 +109,17 @@ STALE_CONFIG = {
     tmp_dir: "{prefix}{job_id}",
 }
 
+# Name of the trash directory, created in each stale directory
+TRASH_DIR = ".trash"
+
+# Modules imported by lava-run, pre-imported by the zygote
+ZYGOTE_MODULES = [
+    "lava_common.log",
+    "lava_dispatcher.device",
+    "lava_dispatcher.parser",
+    "setproctitle",
+]
+
 # URLs
 URL_JOBS = "/scheduler/internal/v1/jobs/"
 URL_WORKERS = "/scheduler/internal/v1/workers/"
@@ -112,6 +151,38 @@ def get_prefix(cfg):
     return ""
 
 
+def trash(path: Path) -> None:
+    """
+    Move the directory to the trash, in the same filesystem. The trash is
+    emptied in the background by remove_trash().
+    """
+    try:
+        trash_dir = path.parent / TRASH_DIR
+        trash_dir.mkdir(mode=0o755, exist_ok=True)
+        path.rename(
+            Path(tempfile.mkdtemp(prefix=path.name, dir=str(trash_dir))) / path.name
+        )
+    except OSError as exc:
+        LOG.warning("Unable to move %s to the trash: %s", path, exc)
+        shutil.rmtree(str(path), ignore_errors=True)
+
+
+async def remove_tree(path: Path) -> None:
+    """
+    Remove the directory in a sub process, at the lowest io priority.
+    """
+    args = ["nice", "rm", "-rf", str(path)]
+    if shutil.which("ionice"):
+        args = ["ionice", "-c", "3"] + args
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        await proc.wait()
+    except OSError as exc:
+        LOG.warning("Unable to remove %s: %s", path, exc)
+
+
 @dataclass
 class Response:
     status_code: int
@@ -148,6 +219,177 @@ def requests_post(
 ###############
 # job helpers #
 ###############
+def read_retained(path: Path) -> Dict[str, str]:
+    """
+    Return the metadata of the retained download for this resource.
+    """
+    if not retain_downloads:
+        return {}
+    with contextlib.suppress(OSError, ValueError):
+        with retention_lock:
+            if (downloads_dir / path.name).is_file():
+                data = (downloads_dir / f"{path.name}.json").read_text(encoding="utf-8")
+                return json.loads(data)
+    return {}
+
+
+def retain(path: Path, headers) -> None:
+    """
+    Keep a link to the download for the next jobs. Only resources that can
+    be revalidated with the server are kept.
+    """
+    meta = {key: headers[key] for key in ["etag", "last-modified"] if key in headers}
+    if not retain_downloads or not meta:
+        return
+    with retention_lock:
+        downloads_dir.mkdir(mode=0o755, parents=True, exist_ok=True)
+        tmp = downloads_dir / f"{path.name}.part"
+        with contextlib.suppress(FileNotFoundError):
+            tmp.unlink()
+        # Copied when the downloads are not on the same filesystem
+        link_file(str(path), str(tmp))
+        tmp.rename(downloads_dir / path.name)
+        (downloads_dir / f"{path.name}.json").write_text(
+            json.dumps(meta), encoding="utf-8"
+        )
+
+
+def evict_downloads() -> None:
+    """
+    Remove the least recently used downloads until the free space is above the
+    limit. Downloads that are still used by a job (hard linked) are kept.
+    """
+    with contextlib.suppress(OSError):
+        usage = shutil.disk_usage(str(downloads_dir))
+        needed = usage.total * min_free_space // 100 - usage.free
+        if needed <= 0:
+            return
+        with retention_lock:
+            entries = []
+            for entry in downloads_dir.iterdir():
+                if entry.suffix in [".json", ".part"]:
+                    continue
+                st = entry.stat()
+                if st.st_nlink == 1:
+                    entries.append((st.st_mtime, st.st_size, entry))
+            for (_, size, entry) in sorted(entries):
+                if needed <= 0:
+                    break
+                LOG.debug("Removing retained download %s", entry.name)
+                entry.unlink()
+                with contextlib.suppress(FileNotFoundError):
+                    (downloads_dir / f"{entry.name}.json").unlink()
+                needed -= size
+
+
+def prefetch(job_id: int, resources: List[Dict[str, Any]], stop: threading.Event):
+    """
+    Download the resources in the prefetch directory.
+    Each resource holds the lock that is released as soon as the resource is
+    downloaded, or skipped, letting lava-run use it.
+    """
+    for resource in resources:
+        lock = resource["lock"]
+        path = resource["path"]
+        res = None
+        try:
+            if stop.is_set():
+                continue
+            LOG.info("[%d] Prefetching %s", job_id, resource["url"])
+            begin = time.time()
+            headers = dict(resource["headers"])
+            retained = read_retained(path)
+            if "etag" in retained:
+                headers["If-None-Match"] = retained["etag"]
+            if "last-modified" in retained:
+                headers["If-Modified-Since"] = retained["last-modified"]
+            res = requests.get(
+                resource["fetch-url"], headers=headers, stream=True, timeout=TIMEOUT
+            )
+            if retained and res.status_code == requests.codes.not_modified:
+                with retention_lock:
+                    link_file(str(downloads_dir / path.name), str(path))
+                    os.utime(str(downloads_dir / path.name))
+                LOG.info("[%d] -> reusing retained download", job_id)
+                continue
+            if res.status_code != requests.codes.ok:
+                LOG.warning(
+                    "[%d] -> unable to prefetch: code %d", job_id, res.status_code
+                )
+                continue
+            size = 0
+            with part_path(path).open("wb") as f_out:
+                for buff in res.iter_content(HTTP_DOWNLOAD_CHUNK_SIZE):
+                    if stop.is_set():
+                        break
+                    f_out.write(buff)
+                    size += len(buff)
+            expected = int(res.headers.get("content-length", size))
+            if stop.is_set() or size != expected:
+                part_path(path).unlink()
+                continue
+            part_path(path).rename(path)
+            LOG.info(
+                "[%d] -> %dMB prefetched in %0.2fs",
+                job_id,
+                size / (1024 * 1024),
+                time.time() - begin,
+            )
+            retain(path, res.headers)
+        except (OSError, ValueError, requests.RequestException) as exc:
+            LOG.warning("[%d] -> unable to prefetch: %s", job_id, exc)
+            with contextlib.suppress(OSError):
+                part_path(path).unlink()
+        finally:
+            if res is not None:
+                res.close()
+            lock.close()
+
+
+def start_prefetch(job_id: int, definition: str, dispatcher_cfg: Dict) -> None:
+    """
+    Start downloading the deploy resources in the background.
+    The locks are taken before returning so lava-run will always wait for
+    the resources that are still to be downloaded.
+    """
+    if not isinstance(dispatcher_cfg, dict) or not dispatcher_cfg.get("prefetch"):
+        return
+
+    base_dir = Path(DISPATCHER_DOWNLOAD_DIR) / f"{get_prefix(dispatcher_cfg)}{job_id}"
+    http_cache = dispatcher_cfg.get("http_url_format_string", "")
+    resources = []
+    try:
+        for resource in prefetch_resources(yaml_safe_load(definition)):
+            path = prefetch_path(str(base_dir), resource["url"])
+            path.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+            lock = lock_path(path).open("wb")
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            resource["lock"] = lock
+            resource["path"] = path
+            resource["fetch-url"] = resource["url"]
+            if http_cache:
+                resource["fetch-url"] = http_cache % quote_plus(resource["url"])
+            resources.append(resource)
+    except (OSError, TypeError, yaml.YAMLError) as exc:
+        LOG.warning("[%d] Unable to prefetch: %s", job_id, exc)
+        for resource in resources:
+            resource["lock"].close()
+        return
+
+    if not resources:
+        return
+    stop = threading.Event()
+    prefetches[job_id] = stop
+    threading.Thread(
+        target=prefetch, args=(job_id, resources, stop), daemon=True
+    ).start()
+
+
+def stop_prefetch(job_id: int) -> None:
+    with contextlib.suppress(KeyError):
+        prefetches.pop(job_id).set()
+
+
 def start_job(
     url: str,
     token: str,
@@ -201,6 +443,23 @@ def start_job(
         if env_dut:
             args.append("--env-dut=%s" % (base_dir / "env.dut.yaml"))
 
+        global zygote
+        if zygote is not None and zygote.outdated():
+            LOG.info("[%d] lava-dispatcher was upgraded: restarting the zygote", job_id)
+            zygote.close()
+            zygote = Zygote()
+        if zygote is not None:
+            try:
+                return zygote.spawn(
+                    job_id,
+                    args[2:],
+                    env,
+                    None if debug else out_file.name,
+                    None if debug else err_file.name,
+                )
+            except (OSError, ValueError) as exc:
+                LOG.warning("[%d] Unable to start with the zygote: %s", job_id, exc)
+
         proc = subprocess.Popen(
             args, stdout=out_file, stderr=err_file, env=env, preexec_fn=os.setpgrp
         )
@@ -370,6 +629,179 @@ class JobsDB:
             yield Job(job)
 
 
+class Zygote:
+    """
+    Process that imports the lava-run dependencies once and then forks a
+    fresh lava-run for every job.
+    The zygote is a new python interpreter, so it can be restarted at any
+    time, for instance to load the new code after an upgrade.
+    """
+
+    def __init__(self):
+        (self.sock, sock) = socket.socketpair()
+        # The version installed now, not the one imported by lava-worker
+        try:
+            self.version = version()
+        except (OSError, subprocess.CalledProcessError):
+            self.version = __version__
+        # The zygote imports the same lava_dispatcher as lava-worker
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(os.path.abspath(p) for p in sys.path)
+        self.proc = subprocess.Popen(  # nosec - internal use
+            [
+                sys.executable,
+                "-c",
+                "import lava_dispatcher.worker; lava_dispatcher.worker.Zygote.main()",
+                str(sock.fileno()),
+                json.dumps(ZYGOTE_MODULES),
+            ],
+            pass_fds=[sock.fileno()],
+            stdin=subprocess.DEVNULL,
+            env=env,
+        )
+        self.pid = self.proc.pid
+        sock.close()
+        self.reader = self.sock.makefile("rb")
+
+    def close(self) -> None:
+        """
+        Stop the zygote. The running jobs are not affected.
+        """
+        self.reader.close()
+        self.sock.close()
+        self.proc.wait()
+
+    def outdated(self) -> bool:
+        """
+        Return True if lava-dispatcher was upgraded since the zygote started.
+        """
+        try:
+            return version() != self.version
+        except (OSError, subprocess.CalledProcessError):
+            return False
+
+    @classmethod
+    def main(cls) -> None:
+        sock = socket.socket(fileno=int(sys.argv[1]))
+        for module in json.loads(sys.argv[2]):
+            try:
+                importlib.import_module(module)
+            except Exception:  # pylint: disable=broad-except
+                # lava-run will fail and report the error
+                traceback.print_exc()
+        cls.serve(sock)
+
+    def spawn(
+        self,
+        job_id: int,
+        args: List[str],
+        env: Dict[str, str],
+        stdout: Optional[str],
+        stderr: Optional[str],
+    ) -> int:
+        """
+        Start lava-run with the given arguments and return the pid
+        """
+        request = {
+            "job_id": job_id,
+            "args": args,
+            "env": env,
+            "cwd": os.getcwd(),
+            "stdout": stdout,
+            "stderr": stderr,
+        }
+        try:
+            self.sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            line = self.reader.readline()
+        except OSError:
+            line = b""
+        data = json.loads(line or b'{"error": "zygote is dead"}')
+        if "error" in data:
+            raise OSError(data["error"])
+        return data["pid"]
+
+    @classmethod
+    def serve(cls, sock: socket.socket) -> None:
+        # The children are reaped automatically
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        lava_run = shutil.which("lava-run")
+        with sock.makefile("rb") as reader:
+            for line in reader:
+                request = json.loads(line)
+                if lava_run is None:
+                    sock.sendall(b'{"error": "lava-run not found"}\n')
+                    continue
+                (ready_r, ready_w) = os.pipe()
+                sys.stdout.flush()
+                sys.stderr.flush()
+                try:
+                    pid = os.fork()
+                except OSError as exc:
+                    os.close(ready_r)
+                    os.close(ready_w)
+                    sock.sendall(
+                        json.dumps({"error": str(exc)}).encode("utf-8") + b"\n"
+                    )
+                    continue
+                if pid == 0:
+                    reader.close()
+                    sock.close()
+                    os.close(ready_r)
+                    cls.child(lava_run, request, ready_w)
+                # Wait for the child to be ready to run lava-run. If it died
+                # before, the pipe is closed without the ready byte.
+                os.close(ready_w)
+                ready = os.read(ready_r, 1)
+                os.close(ready_r)
+                if ready == b"1":
+                    reply = {"pid": pid}
+                else:
+                    reply = {"error": "lava-run died before starting"}
+                sock.sendall(json.dumps(reply).encode("utf-8") + b"\n")
+
+    @classmethod
+    def child(cls, lava_run: str, request: Dict[str, Any], ready: int) -> None:
+        code = 1
+        try:
+            from setproctitle import setproctitle
+
+            # Same process name as lava-run (see Job.is_running)
+            setproctitle("lava-run [job: %s]" % request["job_id"])
+
+            # Same isolation as "nice lava-run" started with os.setpgrp
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            os.setpgrp()
+            os.nice(10)
+            for handler in LOG.handlers[:]:
+                LOG.removeHandler(handler)
+                handler.close()
+            os.chdir(request["cwd"])
+            os.environ.clear()
+            os.environ.update(request["env"])
+            # The files are created by start_job
+            for (fd, name) in [(1, "stdout"), (2, "stderr")]:
+                if request[name] is not None:
+                    out = os.open(request[name], os.O_WRONLY | os.O_APPEND)
+                    os.dup2(out, fd)
+                    os.close(out)
+            sys.stdout = open(1, "w", closefd=False)
+            sys.stderr = open(2, "w", closefd=False)
+
+            sys.argv = [lava_run] + request["args"]
+            os.write(ready, b"1")
+            os.close(ready)
+            runpy.run_path(lava_run, run_name="__main__")
+            code = 0
+        except SystemExit as exc:
+            code = exc.code if isinstance(exc.code, int) else int(bool(exc.code))
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+
 ##########
 # Setups #
 ##########
@@ -407,6 +839,27 @@ def setup_parser() -> argparse.ArgumentParser:
         help="Exit when there is a server mismatch between worker and server.",
     )
 
+    parser.add_argument(
+        "--zygote",
+        action="store_true",
+        default=False,
+        help="Fork lava-run from a process that already imported its dependencies.",
+    )
+
+    cleanup = parser.add_argument_group("cleanup")
+    cleanup.add_argument(
+        "--retain-downloads",
+        action="store_true",
+        default=False,
+        help="Keep the prefetched resources for the next jobs.",
+    )
+    cleanup.add_argument(
+        "--min-free-space",
+        type=int,
+        default=20,
+        help="Minimum free space (in percent) to keep on the disk. The least recently used downloads are removed when needed.",
+    )
+
     return parser
 
 
@@ -420,6 +873,7 @@ def cancel(url: str, jobs: JobsDB, job_id: int, token: str) -> None:
         LOG.debug("[%d] Unknown job", job_id)
         job = jobs.create(job_id, 0, Job.FINISHED, "", token)
     else:
+        stop_prefetch(job_id)
         if job.status == Job.RUNNING and job.is_running():
             LOG.debug("[%d] Canceling", job_id)
             job.terminate()
@@ -484,6 +938,7 @@ def check(url: str, jobs: JobsDB) -> None:
             return
 
         # Remove stale resources
+        stop_prefetch(job.job_id)
         prefix = "" if job is None else job.prefix
         for directory in STALE_CONFIG:
             pattern = STALE_CONFIG[directory]
@@ -492,7 +947,7 @@ def check(url: str, jobs: JobsDB) -> None:
             if not dir_path.exists():
                 continue
             LOG.debug("[%d] Removing %s", job.job_id, dir_path)
-            shutil.rmtree(str(dir_path), ignore_errors=True)
+            trash(dir_path)
 
         jobs.delete(job.job_id)
 
@@ -505,10 +960,32 @@ class VersionMismatch(Exception):
     pass
 
 
+def capacity() -> Dict[str, str]:
+    """
+    Live capacity of the worker, sent to the server on every ping:
+    * load: 1 minute load average by cpu
+    * free_memory: available memory in MB
+    * free_disk: free space in the jobs directory in MB
+    """
+    ret = {}
+    with contextlib.suppress(OSError):
+        ret["load"] = "%.2f" % (os.getloadavg()[0] / (os.cpu_count() or 1))
+    with contextlib.suppress(OSError, IndexError, ValueError):
+        for line in Path("/proc/meminfo").read_text(encoding="utf-8").split("\n"):
+            if line.startswith("MemAvailable:"):
+                ret["free_memory"] = str(int(line.split()[1]) // 1024)
+    with contextlib.suppress(OSError):
+        free = shutil.disk_usage(DISPATCHER_DOWNLOAD_DIR).free
+        ret["free_disk"] = str(free // (1024 * 1024))
+    return ret
+
+
 def ping(url: str, token: str, name: str) -> Dict[str, List]:
     LOG.info("PING => server")
     ret = requests_get(
-        f"{url}{URL_WORKERS}{name}/", token, params={"version": __version__}
+        f"{url}{URL_WORKERS}{name}/",
+        token,
+        params={"version": __version__, **capacity()},
     )
 
     if ret.status_code != 200:
@@ -573,6 +1050,11 @@ def start(url: str, jobs: JobsDB, job_id: int, token: str) -> None:
             LOG.error("[%d] -> invalid response: %r", job_id, str(exc))
             return
 
+        # The worker only receives the job once scheduled: start the downloads
+        # right away so that they overlap with the startup and the validation
+        # of lava-run.
+        start_prefetch(job_id, definition, yaml_safe_load(dispatcher))
+
         LOG.info("[%d] Starting job", job_id)
         LOG.debug("[%d]         : %s", job_id, yaml_safe_load(definition))
         LOG.debug("[%d] device  : %s", job_id, yaml_safe_load(device))
@@ -650,6 +1132,18 @@ async def main_loop(options, jobs: JobsDB, event: asyncio.Event) -> None:
             event.clear()
 
 
+async def remove_trash() -> None:
+    while True:
+        for directory in STALE_CONFIG:
+            with contextlib.suppress(OSError):
+                for entry in (directory / TRASH_DIR).iterdir():
+                    LOG.debug("Removing %s", entry)
+                    await remove_tree(entry)
+        # Walking and unlinking the downloads should not block the main loop
+        await asyncio.get_event_loop().run_in_executor(None, evict_downloads)
+        await asyncio.sleep(CLEANUP_INTERVAL)
+
+
 async def listen_for_events(options, event: asyncio.Event) -> None:
     while True:
         with contextlib.suppress(aiohttp.ClientError):
@@ -675,9 +1169,7 @@ async def listen_for_events(options, event: asyncio.Event) -> None:
         await asyncio.sleep(1)
 
 
-async def main() -> int:
-    # Parse command line
-    options = setup_parser().parse_args()
+async def main(options) -> int:
     if options.token_file is None:
         options.token_file = Path(options.worker_dir) / "token"
     options.url = options.url.rstrip("/")
@@ -690,6 +1182,8 @@ async def main() -> int:
     LOG.info("[INIT] Name   : %r", options.name)
     LOG.info("[INIT] Server : %r", options.url)
     LOG.info("[INIT] Version: %r", __version__)
+    if zygote is not None:
+        LOG.info("[INIT] Zygote : %d", zygote.pid)
 
     # Set ping interval
     global ping_interval
@@ -702,12 +1196,18 @@ async def main() -> int:
     global TIMEOUT
     TIMEOUT = options.http_timeout
 
+    # Setup downloads retention
+    global retain_downloads, min_free_space
+    retain_downloads = options.retain_downloads
+    min_free_space = options.min_free_space
+
     worker_dir = options.worker_dir
     worker_dir.mkdir(mode=0o755, parents=True, exist_ok=True)
 
     if worker_dir != WORKER_DIR:
-        global tmp_dir
+        global tmp_dir, downloads_dir
         tmp_dir = worker_dir / "tmp"
+        downloads_dir = worker_dir / "downloads"
 
     try:
         if options.username is not None:
@@ -737,7 +1237,9 @@ async def main() -> int:
 
         event = asyncio.Event()
         await asyncio.gather(
-            main_loop(options, jobs, event), listen_for_events(options, event)
+            main_loop(options, jobs, event),
+            listen_for_events(options, event),
+            remove_trash(),
         )
         return 0
     except asyncio.CancelledError:
@@ -753,8 +1255,14 @@ async def main() -> int:
 
 
 def run():
+    # Parse command line
+    options = setup_parser().parse_args()
+    if options.zygote:
+        global zygote
+        zygote = Zygote()
+
     try:
-        sys.exit(asyncio.run(main()))
+        sys.exit(asyncio.run(main(options)))
     except KeyboardInterrupt:
         LOG.info("[EXIT] Received Ctrl+C")
         sys.exit(1)
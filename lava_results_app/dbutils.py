@@ -372,6 +372,9 @@ def build_action(action_data, testdata, submission):
             if case.action_metadata.get("level") == action_data["level"]:
                 match_case = case
 
+    # lava-run adds the profile of the actions that did run to the description
+    profile = action_data.get("profile", {})
+
     # maps the static testdata derived from the definition to the runtime pipeline construction
     ActionData.objects.create(
         action_name=action_data["name"],
@@ -383,6 +386,11 @@ def build_action(action_data, testdata, submission):
         max_retries=max_retry,
         timeout=int(Timeout.parse(action_data["timeout"])),
         testcase=match_case,
+        duration=profile.get("duration"),
+        cpu_time=profile.get("cpu"),
+        cpu_approximate=profile.get("cpu_approximate", False),
+        downloaded=profile.get("downloaded"),
+        logged=profile.get("logged"),
     )
 
 
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_results_app", "0018_drop_buglink")]
+
+    operations = [
+        migrations.AddField(
+            model_name="actiondata",
+            name="cpu_approximate",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="actiondata",
+            name="cpu_time",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=8, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="actiondata",
+            name="downloaded",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="actiondata",
+            name="logged",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -680,6 +680,15 @@ class ActionData(models.Model):
     )
     # timeout.duration - amount of time allowed before timeout
     timeout = models.PositiveIntegerField(blank=True, null=True)
+    # profile of the action, when it did run: cpu time of the subprocesses,
+    # bytes downloaded and logged. The cpu time of concurrent actions includes
+    # the one of the other actions running at the same time.
+    cpu_time = models.DecimalField(
+        decimal_places=2, max_digits=8, blank=True, null=True
+    )
+    cpu_approximate = models.BooleanField(default=False)
+    downloaded = models.BigIntegerField(blank=True, null=True)
+    logged = models.BigIntegerField(blank=True, null=True)
     # maps a TestCase back to the Job metadata and description
     testcase = models.ForeignKey(
         TestCase,
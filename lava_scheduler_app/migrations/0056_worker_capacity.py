@@ -0,0 +1,41 @@
+# Generated by Django 2.2.17 on 2021-03-15 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_scheduler_app", "0055_notificationcallback_header")]
+
+    operations = [
+        migrations.AddField(
+            model_name="worker",
+            name="free_disk",
+            field=models.PositiveIntegerField(
+                default=None,
+                editable=False,
+                help_text="Free space in the jobs directory (MB)",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="worker",
+            name="free_memory",
+            field=models.PositiveIntegerField(
+                default=None,
+                editable=False,
+                help_text="Available memory (MB)",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="worker",
+            name="load",
+            field=models.FloatField(
+                default=None,
+                editable=False,
+                help_text="1 minute load average by cpu",
+                null=True,
+            ),
+        ),
+    ]
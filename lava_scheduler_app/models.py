@@ -437,6 +437,25 @@ class Worker(RestrictedObject):
         max_length=32, default=auth_token, help_text=_("Authorization token")
     )
 
+    # Live capacity, as reported by the worker on every ping
+    load = models.FloatField(
+        null=True,
+        default=None,
+        editable=False,
+        help_text=_("1 minute load average by cpu"),
+    )
+
+    free_memory = models.PositiveIntegerField(
+        null=True, default=None, editable=False, help_text=_("Available memory (MB)")
+    )
+
+    free_disk = models.PositiveIntegerField(
+        null=True,
+        default=None,
+        editable=False,
+        help_text=_("Free space in the jobs directory (MB)"),
+    )
+
     def __str__(self):
         return self.hostname
 
@@ -19,7 +19,9 @@
 
 from dataclasses import dataclass
 import datetime
+from typing import Optional
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import transaction
 from django.db.models import Case, When, IntegerField, Sum
@@ -40,27 +42,70 @@ from lava_scheduler_app.models import (
 class WorkerSummary:
     limit: int
     busy: int
+    load: Optional[float] = None
+    free_memory: Optional[int] = None
+    free_disk: Optional[int] = None
+
+    def overloaded(self):
+        """
+        Return the reason why the live capacity reported by the worker is too
+        low to start a new job, or None.
+        """
+        max_load = settings.WORKER_MAX_LOAD
+        if max_load and self.load is not None and self.load >= max_load:
+            return "being loaded (%.2f, greater than %.2f)" % (self.load, max_load)
+        min_memory = settings.WORKER_MIN_FREE_MEMORY
+        if min_memory and self.free_memory is not None:
+            if self.free_memory < min_memory:
+                return "having %dMB of free memory (less than %dMB)" % (
+                    self.free_memory,
+                    min_memory,
+                )
+        min_disk = settings.WORKER_MIN_FREE_DISK
+        if min_disk and self.free_disk is not None and self.free_disk < min_disk:
+            return "having %dMB of free disk (less than %dMB)" % (
+                self.free_disk,
+                min_disk,
+            )
+        return None
+
+    def reason(self):
+        if self.limit > 0 and self.busy >= self.limit:
+            return "having %d jobs (greater than %d)" % (self.busy, self.limit)
+        return self.overloaded()
 
     def overused(self):
-        return self.limit > 0 and self.busy >= self.limit
+        return self.reason() is not None
+
+
+def device_type_weight(name):
+    return settings.WORKER_DEVICE_TYPE_WEIGHTS.get(name, 1)
 
 
 def worker_summary():
+    states = [Device.STATE_RESERVED, Device.STATE_RUNNING]
+    weights = [
+        When(device__state__in=states, device__device_type__name=name, then=weight)
+        for (name, weight) in settings.WORKER_DEVICE_TYPE_WEIGHTS.items()
+    ]
     query = Worker.objects.all()
-    query = query.values("hostname", "job_limit")
+    query = query.values("hostname", "job_limit", "load", "free_memory", "free_disk")
     query = query.annotate(
         busy=Sum(
             Case(
-                When(
-                    device__state__in=[Device.STATE_RESERVED, Device.STATE_RUNNING],
-                    then=1,
-                ),
+                *weights,
+                When(device__state__in=states, then=1),
                 default=0,
                 output_field=IntegerField(),
             )
         )
     )
-    ret = {w["hostname"]: WorkerSummary(w["job_limit"], w["busy"]) for w in query}
+    ret = {
+        w["hostname"]: WorkerSummary(
+            w["job_limit"], w["busy"], w["load"], w["free_memory"], w["free_disk"]
+        )
+        for w in query
+    }
     return ret
 
 
@@ -122,12 +167,11 @@ def schedule_health_checks_for_device_type(logger, dt):
     for device in devices:
         if workers_limit[device.worker_host.hostname].overused():
             logger.debug(
-                "SKIP healthcheck for %s due to %s having %d jobs (greater than %d)"
+                "SKIP healthcheck for %s due to %s %s"
                 % (
                     device.hostname,
                     device.worker_host,
-                    workers_limit[device.worker_host.hostname].busy,
-                    workers_limit[device.worker_host.hostname].limit,
+                    workers_limit[device.worker_host.hostname].reason(),
                 )
             )
             continue
@@ -189,7 +233,9 @@ def schedule_health_checks_for_device_type(logger, dt):
         logger.debug("  |--> scheduling health check")
         try:
             schedule_health_check(device, health_check)
-            workers_limit[device.worker_host.hostname].busy += 1
+            workers_limit[device.worker_host.hostname].busy += device_type_weight(
+                dt.name
+            )
         except Exception as exc:
             # If the health check cannot be schedule, set health to BAD to exclude the device
             logger.error("  |--> Unable to schedule health check")
@@ -259,12 +305,11 @@ def schedule_jobs_for_device_type(logger, dt, available_devices):
 
         if workers_limit[device.worker_host.hostname].overused():
             logger.debug(
-                "SKIP %s due to %s having %d jobs (greater than %d)"
+                "SKIP %s due to %s %s"
                 % (
                     device.hostname,
                     device.worker_host,
-                    workers_limit[device.worker_host.hostname].busy,
-                    workers_limit[device.worker_host.hostname].limit,
+                    workers_limit[device.worker_host.hostname].reason(),
                 )
             )
             continue
@@ -286,7 +331,9 @@ def schedule_jobs_for_device_type(logger, dt, available_devices):
 
         if schedule_jobs_for_device(logger, device, print_header) is not None:
             print_header = False
-            workers_limit[device.worker_host.hostname].busy += 1
+            workers_limit[device.worker_host.hostname].busy += device_type_weight(
+                dt.name
+            )
 
 
 def schedule_jobs_for_device(logger, device, print_header):
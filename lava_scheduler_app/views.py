@@ -23,6 +23,7 @@ import contextlib
 import datetime
 import io
 import logging
+import math
 import os
 from pathlib import Path
 import simplejson
@@ -1312,11 +1313,34 @@ def internal_v1_workers(request, pk=None):
         if version is None:
             return JsonResponse({"error": "Missing 'version'"}, status=400)
 
+        # Live capacity (optional), clamped so that a buggy worker cannot
+        # store extreme values (the sizes are stored in 32 bits integers)
+        capacity = {}
+        for (key, kind, maximum) in [
+            ("load", float, 1000.0),
+            ("free_memory", int, 2 ** 31 - 1),
+            ("free_disk", int, 2 ** 31 - 1),
+        ]:
+            capacity[key] = request.GET.get(key)
+            if capacity[key] is None:
+                continue
+            try:
+                capacity[key] = kind(capacity[key])
+                # NaN would never be compared as overloaded
+                if not math.isfinite(capacity[key]) or capacity[key] < 0:
+                    raise ValueError
+            except ValueError:
+                return JsonResponse({"error": f"Invalid '{key}'"}, status=400)
+            capacity[key] = min(capacity[key], maximum)
+
         # Check the version
         version_mismatch = bool(version != __version__)
 
-        # Save worker version
+        # Save worker version and capacity
         worker.version = version
+        worker.load = capacity["load"]
+        worker.free_memory = capacity["free_memory"]
+        worker.free_disk = capacity["free_disk"]
         if version_mismatch:
             # If the version does not match, go offline
             worker.go_state_offline()
@@ -251,6 +251,19 @@ MASTER_UPGRADE_NOTIFY = False
 WORKER_AUTO_REGISTER = True
 WORKER_AUTO_REGISTER_NETMASK = ["127.0.0.0/8", "::1"]
 
+# A worker is considered full when the live capacity it reports on every ping
+# reaches one of these limits (0 to disable):
+# * WORKER_MAX_LOAD: 1 minute load average by cpu
+# * WORKER_MIN_FREE_MEMORY: available memory in MB
+# * WORKER_MIN_FREE_DISK: free space in the jobs directory in MB
+WORKER_MAX_LOAD = 0
+WORKER_MIN_FREE_MEMORY = 0
+WORKER_MIN_FREE_DISK = 0
+# Number of job slots (out of the worker job_limit) used by a job running on a
+# device of the given device type. Default to 1.
+# Example: {"qemu": 4, "docker": 2}
+WORKER_DEVICE_TYPE_WEIGHTS = {}
+
 ###################
 # Celerey setting #
 ###################
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+# Simulate a lab against a (local) lava-server:
+# * create N fake workers with M devices each (using the REST API)
+# * submit jobs
+# * every fake worker pings the server, accepts the scheduled jobs and streams
+#   synthetic logs and results through the internal API, like lava-run does
+# * print the scheduling latency, log ingestion throughput and API latencies
+#
+# The fake workers never touch the devices: the device dictionaries are only
+# required for the jobs to be scheduled.
+
+import argparse
+import datetime
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+from lava_common.compat import yaml_safe_dump
+from lava_common.log import dump
+
+URL_API = "/api/v0.2/"
+URL_JOBS = "/scheduler/internal/v1/jobs/"
+URL_WORKERS = "/scheduler/internal/v1/workers/"
+
+# Same limits as lava_common.log.sender
+MAX_RECORDS = 1000
+MAX_TIME = 1
+# Consecutive failed POSTs before dropping the remaining log lines
+MAX_RETRIES = 5
+
+JOB_DEFINITION = """
+device_type: {device_type}
+job_name: fake job
+visibility: public
+priority: medium
+timeouts:
+  job:
+    minutes: 10
+actions:
+- deploy:
+    to: tmpfs
+    images:
+      rootfs:
+        url: http://example.com/rootfs.img
+        image_arg: -drive format=raw,file={{rootfs}}
+- boot:
+    method: qemu
+    media: tmpfs
+    prompts: ["root@debian:"]
+context:
+  arch: amd64
+"""
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.submitted = {}
+        self.scheduling = []
+        self.pings = []
+        self.posts = []
+        self.lines = 0
+        self.finished = 0
+
+    def add(self, name, value):
+        with self.lock:
+            getattr(self, name).append(value)
+
+    def print(self, duration):
+        def summary(values):
+            if not values:
+                return "-"
+            return "mean %.3fs, max %.3fs (%d)" % (
+                statistics.mean(values),
+                max(values),
+                len(values),
+            )
+
+        print(f"Duration   : {duration:.1f}s")
+        print(f"Jobs       : {len(self.submitted)} submitted, {self.finished} finished")
+        print(f"Scheduling : {summary(self.scheduling)}")
+        print(f"Pings      : {summary(self.pings)}")
+        print(f"Logs POST  : {summary(self.posts)}")
+        print(f"Log lines  : {self.lines} ({self.lines / duration:.1f} lines/s)")
+
+
+class Server:
+    def __init__(self, url, token):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Token {token}"
+
+    def api(self, method, path, **kwargs):
+        return self.session.request(method, f"{self.url}{URL_API}{path}", **kwargs)
+
+
+class FakeJob(threading.Thread):
+    def __init__(self, options, server, stats, job_id, token):
+        super().__init__(daemon=True)
+        self.options = options
+        self.url = f"{server.url}{URL_JOBS}{job_id}/"
+        self.stats = stats
+        self.job_id = job_id
+        self.session = requests.Session()
+        self.session.headers["LAVA-Token"] = token
+        self.canceled = threading.Event()
+
+    def lines(self):
+        results = set(
+            int(i * self.options.log_lines / max(self.options.results, 1))
+            for i in range(self.options.results)
+        )
+        for index in range(self.options.log_lines):
+            data = {"dt": datetime.datetime.utcnow().isoformat(), "lvl": "target"}
+            data["msg"] = f"line {index} of fake job {self.job_id}"
+            if index in results:
+                data["lvl"] = "results"
+                data["msg"] = {"definition": "fake", "case": f"case-{index}"}
+                data["msg"]["result"] = "pass"
+            yield dump(data)
+
+    def post(self, records, index):
+        begin = time.time()
+        ret = self.session.post(
+            f"{self.url}logs/",
+            data={"lines": "- " + "\n- ".join(records), "index": index},
+        )
+        self.stats.add("posts", time.time() - begin)
+        if ret.status_code != 200:
+            print(f"[{self.job_id}] logs: server error: {ret.status_code}")
+            time.sleep(MAX_TIME)
+            return 0
+        count = int(ret.json()["line_count"])
+        with self.stats.lock:
+            self.stats.lines += count
+        return count
+
+    def run(self):
+        try:
+            self.simulate()
+        finally:
+            with self.stats.lock:
+                self.stats.finished += 1
+
+    def simulate(self):
+        if self.session.get(self.url).status_code != 200:
+            print(f"[{self.job_id}] unable to get the job definition")
+            return
+        self.session.post(self.url, data={"state": "RUNNING"})
+
+        records = []
+        index = 0
+        last_call = time.time()
+        for line in self.lines():
+            if self.canceled.is_set():
+                break
+            records.append(line)
+            if len(records) >= MAX_RECORDS or time.time() - last_call >= MAX_TIME:
+                last_call = time.time()
+                count = self.post(records[:MAX_RECORDS], index)
+                (records, index) = (records[count:], index + count)
+            time.sleep(1 / self.options.log_rate)
+        retries = 0
+        while records:
+            count = self.post(records[:MAX_RECORDS], index)
+            (records, index) = (records[count:], index + count)
+            retries = 0 if count else retries + 1
+            if retries >= MAX_RETRIES:
+                print(f"[{self.job_id}] logs: dropping {len(records)} lines")
+                break
+
+        data = {
+            "state": "FINISHED",
+            "result": "fail" if self.canceled.is_set() else "pass",
+            "error_type": "Canceled" if self.canceled.is_set() else "",
+            "errors": "",
+            "description": yaml_safe_dump({"job": {}, "pipeline": []}),
+        }
+        ret = self.session.post(self.url, data=data)
+        if ret.status_code != 200:
+            print(f"[{self.job_id}] finish: server error: {ret.status_code}")
+
+
+class FakeWorker(threading.Thread):
+    def __init__(self, options, server, stats, name, token, version):
+        super().__init__(daemon=True)
+        self.options = options
+        self.server = server
+        self.stats = stats
+        self.name = name
+        self.session = requests.Session()
+        self.session.headers["LAVA-Token"] = token
+        self.version = version
+        self.jobs = {}
+
+    def ping(self):
+        begin = time.time()
+        ret = self.session.get(
+            f"{self.server.url}{URL_WORKERS}{self.name}/",
+            params={"version": self.version},
+        )
+        self.stats.add("pings", time.time() - begin)
+        if ret.status_code != 200:
+            print(f"[{self.name}] ping: server error: {ret.status_code}")
+            return {}
+        return ret.json()
+
+    def run(self):
+        while True:
+            data = self.ping()
+            for job in data.get("start", []):
+                if job["id"] in self.jobs:
+                    continue
+                with self.stats.lock:
+                    if job["id"] in self.stats.submitted:
+                        submitted = self.stats.submitted[job["id"]]
+                        self.stats.scheduling.append(time.time() - submitted)
+                self.jobs[job["id"]] = FakeJob(
+                    self.options, self.server, self.stats, job["id"], job["token"]
+                )
+                self.jobs[job["id"]].start()
+            for job in data.get("cancel", []):
+                if job["id"] in self.jobs:
+                    self.jobs[job["id"]].canceled.set()
+            for job_id in [j for j in self.jobs if not self.jobs[j].is_alive()]:
+                del self.jobs[job_id]
+            time.sleep(self.options.ping_interval)
+
+
+def setup(options, server):
+    """
+    Create the device-type, workers and devices if needed. Return the workers
+    tokens.
+    """
+    server.api("POST", "devicetypes/", data={"name": options.device_type})
+    tokens = {}
+    for w in range(options.workers):
+        name = f"{options.prefix}-worker-{w:02d}"
+        server.api("POST", "workers/", data={"hostname": name, "health": "Active"})
+        ret = server.api("GET", f"workers/{name}/")
+        ret.raise_for_status()
+        tokens[name] = ret.json()["token"]
+
+        for d in range(options.devices):
+            hostname = f"{options.prefix}-{options.device_type}-{w:02d}-{d:02d}"
+            server.api(
+                "POST",
+                "devices/",
+                data={
+                    "hostname": hostname,
+                    "device_type": options.device_type,
+                    "worker_host": name,
+                    "health": "Good",
+                },
+            )
+            server.api(
+                "POST",
+                f"devices/{hostname}/dictionary/",
+                data={"dictionary": f"{{% extends '{options.device_type}.jinja2' %}}"},
+            )
+    return tokens
+
+
+def submit(options, server, stats):
+    if options.definition:
+        with open(options.definition, encoding="utf-8") as f_in:
+            definition = f_in.read()
+    else:
+        definition = JOB_DEFINITION.format(device_type=options.device_type)
+
+    for _ in range(options.jobs):
+        ret = server.api("POST", "jobs/", data={"definition": definition})
+        if ret.status_code != 201:
+            print(f"Unable to submit: {ret.text}")
+            continue
+        with stats.lock:
+            for job_id in ret.json()["job_ids"]:
+                stats.submitted[job_id] = time.time()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a LAVA lab")
+    parser.add_argument("--url", required=True, help="lava-server url")
+    parser.add_argument("--token", required=True, help="superuser api token")
+    parser.add_argument("--prefix", default="fake", help="workers/devices prefix")
+
+    lab = parser.add_argument_group("lab")
+    lab.add_argument("--workers", type=int, default=10, help="number of workers")
+    lab.add_argument("--devices", type=int, default=5, help="devices per worker")
+    lab.add_argument("--device-type", default="qemu", help="device-type")
+    lab.add_argument(
+        "--ping-interval", type=float, default=20, help="ping interval (seconds)"
+    )
+
+    jobs = parser.add_argument_group("jobs")
+    jobs.add_argument("--jobs", type=int, default=0, help="number of jobs to submit")
+    jobs.add_argument("--definition", default=None, help="job definition to submit")
+    jobs.add_argument("--log-lines", type=int, default=10000, help="log lines by job")
+    jobs.add_argument(
+        "--log-rate", type=float, default=1000, help="log lines by second by job"
+    )
+    jobs.add_argument("--results", type=int, default=100, help="results by job")
+    jobs.add_argument(
+        "--duration",
+        type=float,
+        default=None,
+        help="stop after the given duration (seconds)",
+    )
+
+    options = parser.parse_args()
+
+    server = Server(options.url, options.token)
+    stats = Stats()
+
+    ret = server.api("GET", "system/version/")
+    ret.raise_for_status()
+    version = ret.json()["version"]
+
+    print("Creating the workers and devices")
+    tokens = setup(options, server)
+
+    print(f"Starting {len(tokens)} workers")
+    for (name, token) in tokens.items():
+        FakeWorker(options, server, stats, name, token, version).start()
+
+    print(f"Submitting {options.jobs} jobs")
+    begin = time.time()
+    submit(options, server, stats)
+
+    try:
+        while options.duration is None or time.time() - begin < options.duration:
+            time.sleep(1)
+            if options.jobs and stats.finished >= len(stats.submitted):
+                break
+    except KeyboardInterrupt:
+        pass
+    stats.print(time.time() - begin)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -57,6 +57,28 @@ def test_sender(mocker):
     assert post.mock_calls[1][2]["headers"]["LAVA-Token"] == "my-token"
 
 
+def test_sender_batch(mocker):
+    response = mocker.Mock(status_code=200)
+    response.json = mocker.Mock(return_value={"line_count": 3})
+    post = mocker.Mock(return_value=response)
+    enter = mocker.MagicMock()
+    enter.__enter__ = mocker.Mock(return_value=mocker.Mock(post=post))
+    session = mocker.MagicMock(return_value=enter)
+
+    mocker.patch("requests.Session", session)
+    conn = mocker.MagicMock()
+    conn.poll = mocker.MagicMock()
+    conn.recv_bytes = mocker.MagicMock()
+    conn.recv_bytes.side_effect = [b"line 1\nline 2", b"line 3", b""]
+
+    sender(conn, "http://localhost", "my-token")
+    assert len(post.mock_calls) == 1
+    assert post.mock_calls[0][2]["data"] == {
+        "lines": "- line 1\n- line 2\n- line 3",
+        "index": 0,
+    }
+
+
 def test_sender_exceptions(mocker):
     response = mocker.Mock(status_code=200)
     response.json = mocker.Mock(
@@ -185,7 +207,9 @@ def test_yaml_logger(mocker):
 
     logger.marker({"case": "0_test", "type": "end_test_case"})
     assert len(logger._log.mock_calls) == 1
-    assert logger.markers == {"0_test": {"start_test_case": 7, "end_test_case": 8}}
+    assert logger.markers == {
+        (None, "0_test"): {"start_test_case": 7, "end_test_case": 8}
+    }
 
     logger._log = mocker.Mock()
     logger.info("a" * 10 ** 7)
@@ -193,3 +217,44 @@ def test_yaml_logger(mocker):
 
     logger.close()
     assert logger.handler is None
+
+
+def test_yaml_logger_markers_namespace(mocker):
+    logger = YAMLLogger("lava")
+    logger._log = mocker.Mock()
+
+    logger.target("line 1")
+    logger.marker({"case": "0_test", "type": "test_case"}, namespace="ns1")
+    logger.target("line 2")
+    logger.marker({"case": "0_test", "type": "test_case"}, namespace="ns2")
+    assert logger.markers == {
+        ("ns1", "0_test"): {"test_case": 0},
+        ("ns2", "0_test"): {"test_case": 1},
+    }
+
+    results = {"definition": "def", "case": "0_test", "result": "pass"}
+    logger.results(results, namespace="ns2")
+    assert results["starttc"] == results["endtc"] == 1
+    results = {"definition": "def", "case": "0_test", "result": "pass"}
+    logger.results(results, namespace="ns1")
+    assert results["starttc"] == results["endtc"] == 0
+    assert logger.markers == {}
+
+
+def test_yaml_logger_log_messages(mocker):
+    logger = YAMLLogger("lava")
+    logger._log = mocker.Mock()
+
+    logger.log_messages(logging.INFO, "target", ["line 1", "line 2"])
+    logger.log_messages(logging.INFO, "feedback", ["line 3"], namespace="ns")
+    logger.log_messages(logging.INFO, "target", [])
+    assert logger.line == 3
+    assert len(logger._log.mock_calls) == 2
+    assert logger.size == sum(len(c[1][1]) + 1 for c in logger._log.mock_calls)
+
+    data = logger._log.mock_calls[0][1][1].split("\n")
+    assert [yaml_load(d)["msg"] for d in data] == ["line 1", "line 2"]
+    assert [yaml_load(d)["lvl"] for d in data] == ["target", "target"]
+    data = yaml_load(logger._log.mock_calls[1][1][1])
+    assert list(data.keys()) == ["dt", "lvl", "msg", "ns"]
+    assert data["ns"] == "ns"
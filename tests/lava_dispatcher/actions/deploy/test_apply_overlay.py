@@ -96,7 +96,7 @@ def test_append_overlays_update_cpio(caplog, mocker, tmpdir):
     }
 
     action = AppendOverlays("rootfs", params)
-    action.job = Job(1234, {}, None)
+    action.job = Job(1234, {"dispatcher": {"compression_threads": 4}}, None)
     action.parameters = {
         "rootfs": {"url": "http://example.com/rootfs.cpio.gz", **params},
         "namespace": "common",
@@ -127,12 +127,12 @@ def test_append_overlays_update_cpio(caplog, mocker, tmpdir):
 
     action.update_cpio()
 
-    decompress_file.assert_called_once_with(str(tmpdir / "rootfs.cpio.gz"), "gz")
+    decompress_file.assert_called_once_with(str(tmpdir / "rootfs.cpio.gz"), "gz", 4)
     uncpio.assert_called_once_with(decompress_file(), str(tmpdir))
     unlink.assert_called_once_with(decompress_file())
     untar_file.assert_called_once_with(str(tmpdir / "modules.tar"), str(tmpdir) + "/")
     cpio.assert_called_once_with(str(tmpdir), decompress_file())
-    compress_file.assert_called_once_with(decompress_file(), "gz")
+    compress_file.assert_called_once_with(decompress_file(), "gz", 4)
 
     assert caplog.record_tuples == [
         ("dispatcher", 20, f"Modifying '{tmpdir}/rootfs.cpio.gz'"),
@@ -145,6 +145,91 @@ def test_append_overlays_update_cpio(caplog, mocker, tmpdir):
     ]
 
 
+@pytest.mark.parametrize("entries", [{".", "lib", "lib/modules"}, None])
+def test_append_overlays_update_cpio_append(caplog, mocker, tmpdir, entries):
+    caplog.set_level(logging.DEBUG)
+    params = {
+        "format": "cpio.newc",
+        "append_overlay": True,
+        "overlays": {
+            "modules": {
+                "url": "http://example.com/modules.tar.xz",
+                "compression": "xz",
+                "format": "tar",
+                "path": "/",
+            }
+        },
+    }
+
+    action = AppendOverlays("rootfs", params)
+    action.job = Job(1234, {"dispatcher": {"compression_threads": 4}}, None)
+    action.parameters = {
+        "rootfs": {"url": "http://example.com/rootfs.cpio.gz", **params},
+        "namespace": "common",
+    }
+    action.data = {
+        "common": {
+            "download-action": {
+                "rootfs": {
+                    "file": str(tmpdir / "rootfs.cpio.gz"),
+                    "compression": "gz",
+                    "decompressed": False,
+                },
+                "rootfs.modules": {"file": str(tmpdir / "modules.tar")},
+            }
+        }
+    }
+    action.mkdtemp = lambda: str(tmpdir)
+    cpio_entries = mocker.patch(
+        "lava_dispatcher.actions.deploy.apply_overlay.cpio_entries",
+        return_value=entries,
+    )
+    append_cpio = mocker.patch(
+        "lava_dispatcher.actions.deploy.apply_overlay.append_cpio"
+    )
+    decompress_file = mocker.patch(
+        "lava_dispatcher.actions.deploy.apply_overlay.decompress_file"
+    )
+    uncpio = mocker.patch("lava_dispatcher.actions.deploy.apply_overlay.uncpio")
+    mocker.patch("os.unlink")
+    untar_file = mocker.patch("lava_dispatcher.actions.deploy.apply_overlay.untar_file")
+    cpio = mocker.patch("lava_dispatcher.actions.deploy.apply_overlay.cpio")
+    compress_file = mocker.patch(
+        "lava_dispatcher.actions.deploy.apply_overlay.compress_file"
+    )
+
+    action.update_cpio()
+
+    cpio_entries.assert_called_once_with(str(tmpdir / "rootfs.cpio.gz"), "gz", 4)
+    untar_file.assert_called_once_with(str(tmpdir / "modules.tar"), str(tmpdir) + "/")
+    if entries is None:
+        # Unable to list the image: fallback to unpacking it
+        append_cpio.assert_not_called()
+        uncpio.assert_called_once_with(decompress_file(), str(tmpdir))
+        cpio.assert_called_once_with(str(tmpdir), decompress_file())
+        compress_file.assert_called_once_with(decompress_file(), "gz", 4)
+        assert caplog.record_tuples[1] == (
+            "dispatcher",
+            30,
+            f"Unable to list '{tmpdir}/rootfs.cpio.gz', extracting it",
+        )
+        return
+
+    append_cpio.assert_called_once_with(
+        str(tmpdir), str(tmpdir / "rootfs.cpio.gz"), "gz", 4, entries
+    )
+    decompress_file.assert_not_called()
+    uncpio.assert_not_called()
+    cpio.assert_not_called()
+    compress_file.assert_not_called()
+    assert caplog.record_tuples == [
+        ("dispatcher", 20, f"Modifying '{tmpdir}/rootfs.cpio.gz'"),
+        ("dispatcher", 10, "Overlays:"),
+        ("dispatcher", 10, f"- rootfs.modules: '{tmpdir}/modules.tar' to '{tmpdir}/'"),
+        ("dispatcher", 10, f"* appending to '{tmpdir}/rootfs.cpio.gz' (gz)"),
+    ]
+
+
 def test_append_overlays_update_guestfs(caplog, mocker, tmpdir):
     caplog.set_level(logging.DEBUG)
     params = {
@@ -206,7 +291,7 @@ def test_append_lava_overlay_update_cpio(caplog, mocker, tmpdir):
     params = {"format": "cpio.newc", "overlays": {"lava": True}}
 
     action = AppendOverlays("rootfs", params)
-    action.job = Job(1234, {}, None)
+    action.job = Job(1234, {"dispatcher": {"compression_threads": 1}}, None)
     action.parameters = {
         "rootfs": {"url": "http://example.com/rootfs.cpio.gz", **params},
         "namespace": "common",
@@ -237,14 +322,14 @@ def test_append_lava_overlay_update_cpio(caplog, mocker, tmpdir):
 
     action.update_cpio()
 
-    decompress_file.assert_called_once_with(str(tmpdir / "rootfs.cpio.gz"), "gz")
+    decompress_file.assert_called_once_with(str(tmpdir / "rootfs.cpio.gz"), "gz", 1)
     uncpio.assert_called_once_with(decompress_file(), str(tmpdir))
     unlink.assert_called_once_with(decompress_file())
     untar_file.assert_called_once_with(
         str(tmpdir / "overlay.tar.gz"), str(tmpdir) + "/"
     )
     cpio.assert_called_once_with(str(tmpdir), decompress_file())
-    compress_file.assert_called_once_with(decompress_file(), "gz")
+    compress_file.assert_called_once_with(decompress_file(), "gz", 1)
 
     assert caplog.record_tuples == [
         ("dispatcher", 20, f"Modifying '{tmpdir}/rootfs.cpio.gz'"),
@@ -19,12 +19,19 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import gzip
+import hashlib
+import json
+import os
+import tarfile
+import time
 from pathlib import Path
 import pytest
 import requests
+import subprocess  # nosec - unit test support.
 from urllib.parse import urlparse
 
-from lava_common.constants import HTTP_DOWNLOAD_CHUNK_SIZE
+from lava_common.constants import DOWNLOAD_REQUEST_TIMEOUT, HTTP_DOWNLOAD_CHUNK_SIZE
 from lava_common.exceptions import InfrastructureError, JobError
 from lava_dispatcher.actions.deploy.download import (
     CopyToLxcAction,
@@ -37,6 +44,8 @@ from lava_dispatcher.actions.deploy.download import (
     PreDownloadedAction,
 )
 from lava_dispatcher.job import Job
+from lava_dispatcher.utils.compression import untar_file
+from lava_dispatcher.utils.prefetch import prefetch_path
 from tests.lava_dispatcher.test_basic import Factory
 
 
@@ -412,19 +421,21 @@ def test_http_download_validate(mocker):
         def close(self):
             pass
 
-    def dummyhead(url, allow_redirects, headers):
+    def dummyhead(url, allow_redirects, headers, timeout=None):
         assert allow_redirects is True
         assert headers == {"Accept-Encoding": ""}
+        assert timeout == DOWNLOAD_REQUEST_TIMEOUT
         if url == "https://example.com/kernel":
             return DummyResponseOK()
         elif url == "https://example.com/dtb":
             return DummyResponseNOK()
         assert 0
 
-    def dummyget(url, allow_redirects, stream, headers):
+    def dummyget(url, allow_redirects, stream, headers, timeout=None):
         assert allow_redirects is True
         assert stream is True
         assert headers == {"Accept-Encoding": ""}
+        assert timeout == DOWNLOAD_REQUEST_TIMEOUT
         assert url == "https://example.com/dtb"
         return DummyResponseOK()
 
@@ -486,7 +497,7 @@ def test_http_download_validate(mocker):
     ]
 
     # Raising exceptions
-    def raisinghead(url, allow_redirects, headers):
+    def raisinghead(url, allow_redirects, headers, timeout=None):
         raise requests.Timeout()
 
     mocker.patch("requests.head", raisinghead)
@@ -503,7 +514,7 @@ def test_http_download_validate(mocker):
     action.validate()
     assert action.errors == ["'https://example.com/kernel' timed out"]
 
-    def raisinghead2(url, allow_redirects, headers):
+    def raisinghead2(url, allow_redirects, headers, timeout=None):
         raise requests.RequestException("an error occurred")
 
     mocker.patch("requests.head", raisinghead2)
@@ -564,10 +575,11 @@ def test_http_download_reader(mocker):
         def close(self):
             pass
 
-    def dummyget(url, allow_redirects, stream, headers):
+    def dummyget(url, allow_redirects, stream, headers, timeout=None):
         assert allow_redirects is True
         assert stream is True
         assert url == "https://example.com/dtb"
+        assert timeout == DOWNLOAD_REQUEST_TIMEOUT
         return DummyResponse()
 
     mocker.patch("requests.get", dummyget)
@@ -581,8 +593,15 @@ def test_http_download_reader(mocker):
     with pytest.raises(StopIteration):
         next(ite)
 
+    # Bounded by the action timeout when running in a thread
+    get = mocker.Mock(return_value=DummyResponse())
+    mocker.patch("requests.get", get)
+    action.timeout.max_end_time = time.time() + 5
+    assert list(action.reader()) == [b"hello"]
+    assert 1 <= get.call_args[1]["timeout"] <= 5
+
     # Not working
-    def dummygetraise(url, allow_redirects, stream, headers):
+    def dummygetraise(url, allow_redirects, stream, headers, timeout=None):
         raise requests.RequestException("error")
 
     mocker.patch("requests.get", dummygetraise)
@@ -710,6 +729,155 @@ def test_http_download_run_compressed(tmpdir):
     }
 
 
+def test_http_download_run_without_checksum(tmpdir):
+    def reader():
+        yield b"hello"
+        yield b"world"
+
+    action = HttpDownloadAction("dtb", str(tmpdir), urlparse("https://example.com/dtb"))
+    action.job = Job(1234, {"dispatcher": {}}, None)
+    action.url = urlparse("https://example.com/dtb")
+    action.parameters = {
+        "to": "download",
+        "images": {"dtb": {"url": "https://example.com/dtb"}},
+        "namespace": "common",
+    }
+    action.params = action.parameters["images"]["dtb"]
+    action.reader = reader
+    action.fname = str(tmpdir / "dtb/dtb")
+    action.run(None, 4212)
+    assert dict(action.results) == {
+        "label": "dtb",
+        "size": 10,
+        "sha256sum": "936a185caaa266bb9cbe981e9e05cb78cd732b0b3280eb944412bb6f8f8f07af",
+    }
+
+
+def test_http_download_run_prefetched(tmpdir):
+    def reader():
+        raise Exception("should not be called")
+
+    action = HttpDownloadAction("dtb", str(tmpdir), urlparse("https://example.com/dtb"))
+    action.job = Job(1234, {"dispatcher": {"prefetch": True}}, None)
+    action.url = urlparse("https://example.com/dtb")
+    action.parameters = {
+        "to": "download",
+        "images": {
+            "dtb": {
+                "url": "https://example.com/dtb",
+                "md5sum": "fc5e038d38a57032085441e7fe7010b0",
+            }
+        },
+        "namespace": "common",
+    }
+    action.params = action.parameters["images"]["dtb"]
+    action.reader = reader
+    action.fname = str(tmpdir / "dtb/dtb")
+
+    prefetched = prefetch_path(action.job.tmp_dir, "https://example.com/dtb")
+    prefetched.parent.mkdir(parents=True, exist_ok=True)
+    prefetched.write_text("helloworld", encoding="utf-8")
+
+    action.run(None, 4212)
+    with open(str(tmpdir / "dtb/dtb")) as f_in:
+        assert f_in.read() == "helloworld"
+    assert action.results["success"] == {"md5": "fc5e038d38a57032085441e7fe7010b0"}
+    assert action.results["size"] == 10
+    # Only the requested checksums are computed
+    assert action.results["md5sum"] == "fc5e038d38a57032085441e7fe7010b0"
+    assert "sha256sum" not in action.results
+    assert "sha512sum" not in action.results
+
+
+def test_http_download_run_cached(tmpdir):
+    def reader():
+        yield b"hello"
+        yield b"world"
+
+    def failing_reader():
+        raise Exception("should not be called")
+
+    dispatcher = {"download_cache": {"path": str(tmpdir / "cache"), "size": 1}}
+    for (index, func) in enumerate([reader, failing_reader]):
+        action = HttpDownloadAction(
+            "dtb", str(tmpdir / str(index)), urlparse("https://example.com/dtb")
+        )
+        action.job = Job(1234, {"dispatcher": dispatcher}, None)
+        action.url = urlparse("https://example.com/dtb")
+        action.parameters = {
+            "to": "download",
+            "images": {
+                "dtb": {
+                    "url": "https://example.com/dtb",
+                    "md5sum": "fc5e038d38a57032085441e7fe7010b0",
+                }
+            },
+            "namespace": "common",
+        }
+        action.params = action.parameters["images"]["dtb"]
+        action.reader = func
+        action.fname = str(tmpdir / str(index) / "dtb/dtb")
+        action.run(None, 4212)
+
+        with open(action.fname) as f_in:
+            assert f_in.read() == "helloworld"
+        assert action.results["success"] == {"md5": "fc5e038d38a57032085441e7fe7010b0"}
+        assert action.results["size"] == 10
+
+
+@pytest.mark.parametrize("compression", [None, "gz"])
+def test_http_download_run_cached_missing_checksum(tmpdir, compression):
+    data = b"helloworld"
+    if compression == "gz":
+        data = gzip.compress(data)
+    calls = []
+
+    def reader():
+        calls.append(1)
+        yield data
+
+    dispatcher = {"download_cache": {"path": str(tmpdir / "cache"), "size": 1}}
+    sha256sum = hashlib.sha256(data).hexdigest()
+    md5sum = hashlib.md5(data).hexdigest()  # nosec - unit test support.
+    # The first job only asks for sha256, the next ones for md5 too
+    for index in range(3):
+        action = HttpDownloadAction(
+            "dtb", str(tmpdir / str(index)), urlparse("https://example.com/dtb")
+        )
+        action.job = Job(1234, {"dispatcher": dispatcher}, None)
+        action.url = urlparse("https://example.com/dtb")
+        params = {"url": "https://example.com/dtb", "sha256sum": sha256sum}
+        if compression:
+            params["compression"] = compression
+        if index:
+            params["md5sum"] = md5sum
+        action.parameters = {
+            "to": "download",
+            "images": {"dtb": params},
+            "namespace": "common",
+        }
+        action.params = params
+        action.reader = reader
+        action.fname = str(tmpdir / str(index) / "dtb/dtb")
+        action.run(None, 4212)
+
+        with open(action.fname, "rb") as f_in:
+            assert f_in.read() == b"helloworld"
+        assert action.results["md5sum" if index else "sha256sum"] == (
+            md5sum if index else sha256sum
+        )
+        if index == 0:
+            # Every checksums are stored: drop md5 like an older entry
+            (metadata,) = (tmpdir / "cache").listdir("*.json")
+            assert "md5" in json.loads(metadata.read_text(encoding="utf-8"))
+            metadata.write_text(
+                json.dumps({"size": len(data), "sha256": sha256sum}), encoding="utf-8"
+            )
+
+    # Compressed resources are downloaded again, once
+    assert len(calls) == (2 if compression else 1)
+
+
 def test_predownloaded_job_validation():
     factory = Factory()
     factory.validate_job_strict = True
@@ -785,3 +953,128 @@ def test_copy_to_lxc_without_lxc_should_do_nothing():
     action = CopyToLxcAction()
     action.job = Job(1234, {}, None)
     action.run(None, 4242)  # no crash = success
+
+
+def test_http_download_run_cached_qcow2(mocker, tmpdir):
+    def reader():
+        yield b"QFI\xfb"
+        yield b"\x00\x00\x00\x03"
+
+    mocker.patch("shutil.which", return_value="/usr/bin/qemu-img")
+    check_output = mocker.patch(
+        "lava_dispatcher.actions.deploy.download.subprocess.check_output"
+    )
+    dispatcher = {
+        "download_cache": {"path": str(tmpdir / "cache"), "qcow2_backing": True}
+    }
+    for index in range(2):
+        action = HttpDownloadAction(
+            "image", str(tmpdir / str(index)), urlparse("https://example.com/image")
+        )
+        action.job = Job(1234, {"dispatcher": dispatcher}, None)
+        action.url = urlparse("https://example.com/image")
+        action.parameters = {
+            "to": "download",
+            "images": {
+                "image": {
+                    "url": "https://example.com/image",
+                    "md5sum": "5997da71a8906d3c23be0550ce1f5e12",
+                }
+            },
+            "namespace": "common",
+        }
+        action.params = action.parameters["images"]["image"]
+        action.reader = reader
+        action.fname = str(tmpdir / str(index) / "image/image.qcow2")
+        action.run(None, 4212)
+
+    # The first job downloads the image, the second one uses a backing file
+    assert (tmpdir / "0" / "image/image.qcow2").read_binary() == b"QFI\xfb\0\0\0\3"
+    backing = str(tmpdir / "1" / "image/image.qcow2.base")
+    assert (tmpdir / "1" / "image/image.qcow2.base").read_binary() == b"QFI\xfb\0\0\0\3"
+    check_output.assert_called_once_with(
+        ["qemu-img", "create", "-f", "qcow2", "-F", "qcow2"]
+        + ["-b", backing, str(tmpdir / "1" / "image/image.qcow2")],
+        stderr=subprocess.STDOUT,
+        timeout=None,
+    )
+
+
+def test_http_download_run_extract(tmpdir):
+    (tmpdir / "rootfs" / "etc").ensure(dir=True)
+    (tmpdir / "rootfs" / "etc" / "hostname").write_text("lava\n", encoding="utf-8")
+    with tarfile.open(str(tmpdir / "rootfs.tar.gz"), "w:gz") as tar:
+        tar.add(str(tmpdir / "rootfs"), arcname=".")
+    data = (tmpdir / "rootfs.tar.gz").read_binary()
+
+    def reader():
+        yield data[:100]
+        yield data[100:]
+
+    action = HttpDownloadAction(
+        "nfsrootfs", str(tmpdir / "dl"), urlparse("https://example.com/rootfs.tar.gz")
+    )
+    action.job = Job(1234, {}, None)
+    action.url = urlparse("https://example.com/rootfs.tar.gz")
+    action.parameters = {
+        "to": "download",
+        "nfsrootfs": {
+            "url": "https://example.com/rootfs.tar.gz",
+            "compression": "gz",
+            "md5sum": hashlib.md5(data).hexdigest(),  # nosec - unit test support.
+        },
+        "namespace": "common",
+    }
+    action.params = action.parameters["nfsrootfs"]
+    action.reader = reader
+    action.fname = str(tmpdir / "dl" / "nfsrootfs" / "rootfs.tar")
+    action.run(None, 4212)
+
+    # The decompressed tarball is saved and extracted
+    with tarfile.open(action.fname) as tar:
+        assert "./etc/hostname" in tar.getnames()
+    extracted = action.get_namespace_data(
+        action="download-action", label="nfsrootfs", key="extracted"
+    )
+    with open(os.path.join(extracted, "etc", "hostname")) as f_in:
+        assert f_in.read() == "lava\n"
+    assert action.results["success"] == {"md5": hashlib.md5(data).hexdigest()}
+
+
+def test_http_download_run_extract_no_compression(tmpdir):
+    (tmpdir / "rootfs" / "etc").ensure(dir=True)
+    (tmpdir / "rootfs" / "etc" / "hostname").write_text("lava\n", encoding="utf-8")
+    with tarfile.open(str(tmpdir / "rootfs.tar.gz"), "w:gz") as tar:
+        tar.add(str(tmpdir / "rootfs"), arcname=".")
+    data = (tmpdir / "rootfs.tar.gz").read_binary()
+
+    def reader():
+        yield data
+
+    action = HttpDownloadAction(
+        "nfsrootfs", str(tmpdir / "dl"), urlparse("https://example.com/rootfs.tar.gz")
+    )
+    action.job = Job(1234, {}, None)
+    action.url = urlparse("https://example.com/rootfs.tar.gz")
+    action.parameters = {
+        "to": "download",
+        "nfsrootfs": {"url": "https://example.com/rootfs.tar.gz"},
+        "namespace": "common",
+    }
+    action.params = action.parameters["nfsrootfs"]
+    action.reader = reader
+    action.fname = str(tmpdir / "dl" / "nfsrootfs" / "rootfs.tar.gz")
+    action.run(None, 4212)
+
+    # tar cannot guess the compression of a stream: the tarball is only saved
+    assert Path(action.fname).read_bytes() == data
+    assert (
+        action.get_namespace_data(
+            action="download-action", label="nfsrootfs", key="extracted"
+        )
+        is None
+    )
+    untar_file(action.fname, str(tmpdir / "extracted"))
+    assert (tmpdir / "extracted" / "etc" / "hostname").read_text(
+        encoding="utf-8"
+    ) == "lava\n"
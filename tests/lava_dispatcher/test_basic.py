@@ -19,6 +19,7 @@
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
 import os
+import subprocess
 import sys
 import time
 import jinja2
@@ -38,6 +39,7 @@ from lava_common.schemas.device import validate as validate_device
 from lava_dispatcher.action import Pipeline, Action
 from lava_dispatcher.parser import JobParser
 from lava_dispatcher.device import NewDevice
+from lava_dispatcher.job import Job
 from lava_dispatcher.actions.deploy.image import DeployImages
 from tests.utils import DummyLogger
 
@@ -478,6 +480,32 @@ class TestPipeline(StdoutTestCase):
             test_action.get_namespace_data("common", "unknown", "simple"), 1
         )
 
+    def test_namespace_data_mutation(self):
+        action = Action()
+        action.job = Job(4212, {}, None)
+        action.parameters = {"namespace": "common"}
+        value = {"key": ["value"]}
+        action.set_namespace_data("common", "ns", "dict", value)
+        # Copies are returned by default, the reference on demand
+        self.assertIsNot(action.get_namespace_data("common", "ns", "dict"), value)
+        self.assertEqual(action.get_namespace_data("common", "ns", "dict"), value)
+        self.assertIs(
+            action.get_namespace_data("common", "ns", "dict", deepcopy=False), value
+        )
+
+        action.update_namespace_data("common", "ns", "dict", {"other": 1})
+        self.assertEqual(value, {"key": ["value"], "other": 1})
+        levels = {"1.1": "0_smoke"}
+        action.update_namespace_data("common", "ns", "levels", levels)
+        levels["1.2"] = "1_smoke"
+        self.assertEqual(
+            action.get_namespace_data("common", "ns", "levels"), {"1.1": "0_smoke"}
+        )
+
+        action.append_namespace_data("common", "ns", "list", "a")
+        action.append_namespace_data("common", "ns", "list", "b")
+        self.assertEqual(action.get_namespace_data("common", "ns", "list"), ["a", "b"])
+
 
 class TestFakeActions(StdoutTestCase):
     class KeepConnection(Action):
@@ -558,3 +586,56 @@ class TestStrategySelector(StdoutTestCase):
         ]
         willing.sort(key=lambda x: x.priority, reverse=True)
         self.assertIsInstance(willing[0], TestStrategySelector.Third)
+
+    def test_registry(self):
+        # Every strategy should be imported when its method is selected
+        import lava_dispatcher.actions.deploy.strategies
+        import lava_dispatcher.actions.boot.strategies
+        from lava_dispatcher.logical import Boot, Deployment
+
+        for base in [Deployment, Boot]:
+            modules = {m for mods in base.registry.values() for m in mods}
+            for strategy in base.__subclasses__():
+                self.assertIn(strategy.__module__, modules)
+
+    def test_registry_candidates(self):
+        # For every method, the strategies imported from the registry should
+        # include every strategy that does not reject the method.
+        import lava_dispatcher.actions.deploy.strategies
+        import lava_dispatcher.actions.boot.strategies
+        from lava_dispatcher.logical import Boot, Deployment
+
+        for base, key in [(Deployment, "to"), (Boot, "method")]:
+            methods = {method: {} for method in base.registry}
+            methods.update({"image": {}, "qemu": {}, "tftp": {}})
+            device = {"actions": {base.section: {"methods": methods}}}
+            for method, modules in base.registry.items():
+                candidates = set()
+                for strategy in base.__subclasses__():
+                    try:
+                        if not strategy.accepts(device, {key: method})[0]:
+                            continue
+                    except Exception:
+                        # The method was accepted, the parameters are not
+                        pass
+                    candidates.add(strategy)
+                registered = {
+                    strategy
+                    for strategy in base.__subclasses__()
+                    if strategy.__module__ in modules
+                }
+                self.assertEqual(candidates - registered, set(), method)
+
+    def test_lazy_loading(self):
+        script = (
+            "import sys\n"
+            "from lava_dispatcher.logical import Deployment\n"
+            "from lava_dispatcher.parser import JobParser\n"
+            "assert 'lava_dispatcher.actions.deploy.strategies' not in sys.modules\n"
+            "assert 'lava_dispatcher.actions.deploy.tftp' not in sys.modules\n"
+            "device = {'actions': {'deploy': {'methods': ['image']}}}\n"
+            "Deployment.select(device, {'to': 'tmpfs', 'images': {}})\n"
+            "assert 'lava_dispatcher.actions.deploy.image' in sys.modules\n"
+            "assert 'lava_dispatcher.actions.deploy.tftp' not in sys.modules\n"
+        )
+        subprocess.check_call([sys.executable, "-c", script])
@@ -32,6 +32,7 @@ from unittest.mock import patch
 from lava_common.compat import yaml_safe_dump, yaml_safe_load
 from lava_common.decorators import nottest
 from lava_common.exceptions import InfrastructureError
+from lava_dispatcher.job import Job
 from lava_dispatcher.power import FinalizeAction
 from lava_dispatcher.parser import JobParser
 from lava_dispatcher.actions.test.shell import PatternFixup
@@ -47,6 +48,7 @@ from lava_dispatcher.actions.deploy.testdef import (
 )
 from lava_dispatcher.actions.deploy.overlay import OverlayAction
 from lava_dispatcher.actions.deploy.download import DownloaderAction
+from lava_dispatcher.utils.vcs import GitHelper
 from tests.utils import infrastructure_error, infrastructure_error_multi_paths
 
 
@@ -751,3 +753,64 @@ test3a: skip
         self.assertEqual(
             "oe", fastboot_installscript.parameters["deployment_data"]["distro"]
         )
+
+
+def test_git_repo_action_cache(mocker, tmpdir):
+    repo = tmpdir / "repo"
+    repo.mkdir()
+    (repo / "smoke.yaml").write_text(
+        yaml_safe_dump({"metadata": {"name": "smoke", "format": "Lava-Test"}}),
+        encoding="utf-8",
+    )
+    for cmd in [
+        ["init", "-q"],
+        ["add", "smoke.yaml"],
+        ["-c", "user.name=lava", "-c", "user.email=lava@example.com"]
+        + ["commit", "-q", "-m", "smoke"],
+    ]:
+        subprocess.check_call(["git", "-C", str(repo)] + cmd)  # nosec
+    commit = (
+        subprocess.check_output(["git", "-C", str(repo), "rev-parse", "HEAD"])
+        .decode()
+        .strip()
+    )
+
+    def run(revision):
+        job = Job(
+            1234,
+            {"dispatcher": {"download_cache": {"path": str(tmpdir / "cache")}}},
+            None,
+        )
+        mkdtemp = mocker.patch.object(job, "mkdtemp", return_value=str(tmpdir))
+        action = GitRepoAction()
+        action.job = job
+        action.uuid = "1234_1.1"
+        action.parameters = {
+            "namespace": "common",
+            "repository": str(repo),
+            "path": "smoke.yaml",
+            "test_name": "0_smoke",
+        }
+        if revision:
+            action.parameters["revision"] = revision
+        action.vcs = GitHelper(str(repo))
+        overlay = tmpdir / "overlay" / "1234"
+        action.set_namespace_data(
+            action="uuid", label="overlay_path", key="0_smoke", value=str(overlay)
+        )
+        mocker.patch("lava_dispatcher.actions.deploy.testdef.RepoAction.run")
+        clone = mocker.spy(action.vcs, "clone")
+        action.run(None, None)
+        assert action.results["commit"] == commit
+        assert (overlay / "smoke.yaml").exists()
+        shutil.rmtree(str(tmpdir / "overlay"))
+        assert not (tmpdir / "testdef.tar").exists()
+        return (clone.call_count, mkdtemp.call_count)
+
+    # Branches are not cached
+    assert run(None) == (1, 0)
+    assert not (tmpdir / "cache").exists()
+    # Pinned revisions are cloned once, the cache is then read in place
+    assert run(commit) == (1, 1)
+    assert run(commit) == (0, 0)
+    assert run(commit) == (0, 0)
@@ -0,0 +1,292 @@
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+import subprocess
+import threading
+import time
+
+import pytest
+
+from lava_common.compat import yaml_load
+from lava_common.exceptions import InfrastructureError, JobCanceled, JobError
+from lava_common.log import YAMLLogger
+from lava_common.timeout import Timeout
+from lava_dispatcher.action import Action, Pipeline
+from lava_dispatcher.job import Job
+
+
+class SleepAction(Action):
+    name = "sleep-action"
+    description = "sleep"
+    summary = "sleep"
+    concurrent = True
+
+    def __init__(self, duration, exc=None):
+        super().__init__()
+        self.duration = duration
+        self.exc = exc
+        self.thread = None
+
+    def run(self, connection, max_end_time):
+        self.thread = threading.current_thread()
+        self.logger.info("sleeping %s", self.duration)
+        while self.duration > 0:
+            self.timeout.check()
+            time.sleep(0.1)
+            self.duration -= 0.1
+        if self.exc is not None:
+            raise self.exc
+        self.logger.info("done")
+        return connection
+
+
+def pipeline(parallel, actions):
+    job = Job(4212, {"dispatcher": {"parallel_downloads": parallel}}, None)
+    job.timeout = Timeout("job", 60)
+    pipe = Pipeline(job=job)
+    for action in actions:
+        pipe.add_action(action)
+    return pipe
+
+
+@pytest.fixture
+def logger(mocker):
+    logger = YAMLLogger("dispatcher-test")
+    mocker.patch.object(logger, "_log")
+    return logger
+
+
+def messages(logger):
+    return [yaml_load(c[1][1])["msg"] for c in logger._log.mock_calls]
+
+
+def test_run_sequentially(logger):
+    actions = [SleepAction(0.2), SleepAction(0.2)]
+    pipe = pipeline(1, actions)
+    for action in actions:
+        action.logger = logger
+    pipe.run_actions(None, time.time() + 30)
+    assert actions[0].thread is threading.main_thread()
+    assert actions[1].thread is threading.main_thread()
+    assert "cpu_approximate" not in actions[0].profile
+
+
+def test_run_concurrently(logger):
+    actions = [SleepAction(0.5), SleepAction(0.2), SleepAction(0.5)]
+    pipe = pipeline(3, actions)
+    for action in actions:
+        action.logger = logger
+
+    begin = time.time()
+    pipe.run_actions(None, time.time() + 30)
+    assert time.time() - begin < 1.2
+    assert all(a.thread is not threading.main_thread() for a in actions)
+
+    # Logs are grouped by action and in the pipeline order
+    msgs = messages(logger)
+    assert [m.split(" ")[0] for m in msgs] == ["start:", "sleeping", "done", "end:"] * 3
+    assert [m.split(" ")[1] for m in msgs if m.startswith("start:")] == ["1", "2", "3"]
+    assert logger.line == 12
+
+    # Each action only accounts for its own logs, the cpu time is shared
+    for (index, action) in enumerate(actions):
+        calls = logger._log.mock_calls[4 * index : 4 * index + 4]
+        assert action.profile["logged"] == sum(len(c[1][1]) + 1 for c in calls)
+        assert action.profile["cpu_approximate"]
+
+
+def test_run_concurrently_failure(logger):
+    actions = [
+        SleepAction(0.1),
+        SleepAction(0.5, JobError("first")),
+        SleepAction(0.1, InfrastructureError("second")),
+        SleepAction(0.1),
+    ]
+    pipe = pipeline(2, actions)
+    for action in actions:
+        action.logger = logger
+
+    # The first failure in the pipeline order is raised
+    with pytest.raises(JobError, match="first"):
+        pipe.run_actions(None, time.time() + 30)
+    # The last action is not started after the failure
+    assert actions[3].thread is None
+
+
+def test_run_concurrently_timeout(logger):
+    actions = [SleepAction(0.1), SleepAction(5)]
+    actions[1].timeout.duration = 1
+    pipe = pipeline(2, actions)
+    for action in actions:
+        action.logger = logger
+
+    with pytest.raises(JobError, match="sleep-action timed out after 1 seconds"):
+        pipe.run_actions(None, time.time() + 30)
+
+
+def test_run_concurrently_parent_timeout(logger):
+    actions = [SleepAction(5), SleepAction(5)]
+    pipe = pipeline(2, actions)
+    for action in actions:
+        action.logger = logger
+
+    # The parent timeout is not attributed to the actions, that are stopped
+    # before raising
+    parent = Timeout("parent", 1)
+    with pytest.raises(JobError, match="parent timed out"):
+        with parent(None, None):
+            pipe.run_actions(None, time.time() + 30)
+    assert not any(a.thread.is_alive() for a in actions)
+    assert "sleep-action canceled" in messages(logger)
+
+
+def test_run_concurrently_stuck(logger, mocker):
+    mocker.patch("lava_dispatcher.action.CONCURRENT_GRACE", 0.5)
+
+    class StuckAction(SleepAction):
+        def run(self, connection, max_end_time):
+            self.thread = threading.current_thread()
+            # Ignore the timeout but not the stop request
+            while not self.thread.stop.wait(0.1):
+                pass
+            raise JobCanceled("stopped")
+
+    actions = [SleepAction(0.1), StuckAction(0)]
+    actions[1].timeout.duration = 1
+    pipe = pipeline(2, actions)
+    for action in actions:
+        action.logger = logger
+
+    with pytest.raises(JobError, match=r"sleep-action timed out after \d+ seconds"):
+        pipe.run_actions(None, time.time() + 30)
+    assert not actions[1].thread.is_alive()
+
+
+class ValidateAction(SleepAction):
+    name = "validate-action"
+
+    def validate(self):
+        self.thread = threading.current_thread()
+        self.logger.info("validating %s", self.level)
+        time.sleep(self.duration)
+        if self.exc is not None:
+            raise self.exc
+
+
+def test_validate_sequentially(logger):
+    actions = [ValidateAction(0.1), ValidateAction(0.1)]
+    pipe = pipeline(1, actions)
+    for action in actions:
+        action.logger = logger
+    pipe.validate_actions()
+    assert all(a.thread is threading.main_thread() for a in actions)
+
+
+def test_validate_concurrently(logger):
+    actions = [
+        ValidateAction(0.5),
+        ValidateAction(0.1, JobError("invalid")),
+        ValidateAction(0.1, InfrastructureError("unreachable")),
+        ValidateAction(0.5, InfrastructureError("unavailable")),
+    ]
+    pipe = pipeline(4, actions)
+    for action in actions:
+        action.logger = logger
+
+    begin = time.time()
+    # The first exception in the pipeline order is raised
+    with pytest.raises(InfrastructureError, match="unreachable"):
+        pipe.validate_actions()
+    assert time.time() - begin < 0.9
+    assert all(a.thread is not threading.main_thread() for a in actions)
+    assert actions[1].errors == ["2 validate-action: invalid"]
+    assert messages(logger) == [
+        "validating 1",
+        "validating 2",
+        "validating 3",
+        "validating 4",
+    ]
+
+    # Errors are raised in the pipeline order
+    actions = [
+        ValidateAction(0.3, JobError("first")),
+        ValidateAction(0, JobError("second")),
+    ]
+    pipe = pipeline(2, actions)
+    for action in actions:
+        action.logger = logger
+    with pytest.raises(JobError) as exc:
+        pipe.validate_actions()
+    assert (
+        str(exc.value)
+        == "Invalid job data: ['1 validate-action: first', '2 validate-action: second']\n"
+    )
+
+
+class DownloadAction(SleepAction):
+    name = "download-action"
+
+    def run(self, connection, max_end_time):
+        subprocess.run(["sh", "-c", "i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done"])
+        self.profile["downloaded"] = 1024
+        return super().run(connection, max_end_time)
+
+
+class ParentAction(Action):
+    name = "parent-action"
+    description = "parent"
+    summary = "parent"
+
+    def populate(self, parameters):
+        self.pipeline = Pipeline(parent=self, job=self.job, parameters=parameters)
+        self.pipeline.add_action(DownloadAction(0.2))
+        self.pipeline.add_action(DownloadAction(0))
+
+
+def test_profile(logger):
+    actions = [SleepAction(0.6), ParentAction()]
+    pipe = pipeline(1, actions)
+    pipe.job.pipeline = pipe
+    for action in actions + actions[1].pipeline.actions:
+        action.logger = logger
+    pipe.job.logger = logger
+    pipe.run_actions(None, time.time() + 30)
+
+    profiles = pipe.profile()
+    assert sorted(profiles.keys()) == ["1", "2", "2.1", "2.2"]
+    assert profiles["1"]["duration"] >= 0.6
+    assert profiles["1"]["downloaded"] == 0
+    assert profiles["2.1"]["downloaded"] == 1024
+    assert profiles["2"]["downloaded"] == 2048
+    assert profiles["2"]["duration"] >= profiles["2.1"]["duration"] >= 0.2
+    assert profiles["2"]["cpu"] >= profiles["2.1"]["cpu"] > 0
+    assert profiles["2.2"]["logged"] > 0
+    assert (
+        profiles["2"]["logged"] > profiles["2.1"]["logged"] + profiles["2.2"]["logged"]
+    )
+
+    # The profile is added to the description
+    description = {"pipeline": pipe.describe()}
+    assert "profile" not in description["pipeline"][0]
+    logger._log.reset_mock()
+    pipe.job.profile(description)
+    assert description["pipeline"][0]["profile"] == profiles["1"]
+    assert description["pipeline"][1]["pipeline"][0]["profile"] == profiles["2.1"]
+    msgs = messages(logger)
+    assert len(msgs) == 2
+    assert msgs[0].startswith("profile: 1 sleep-action: 00:00:01 (")
+    assert msgs[1].startswith("profile: 2 parent-action: ")
@@ -0,0 +1,179 @@
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+import re
+
+import pexpect
+import pytest
+
+from lava_common.compat import yaml_load
+from lava_common.constants import KERNEL_EXCEPTION_MSG, KERNEL_PANIC_MSG
+from lava_common.log import YAMLLogger
+from lava_common.timeout import Timeout
+from lava_dispatcher.shell import (
+    ShellCommand,
+    ShellLogger,
+    ShellSearcher,
+    combine_patterns,
+)
+from tests.utils import DummyLogger
+
+PATTERNS = [
+    "<LAVA_TEST_RUNNER EXIT>",
+    pexpect.EOF,
+    pexpect.TIMEOUT,
+    r"<LAVA_SIGNAL_(\S+) ([^>]+)>",
+    re.compile(r"^(?P<test_case_id>\w+): (?P<result>pass|fail)$", re.M),
+    KERNEL_EXCEPTION_MSG,
+    KERNEL_PANIC_MSG,
+]
+
+
+def compile_patterns(patterns):
+    # Like pexpect.spawn.compile_pattern_list
+    compiled = []
+    for pattern in patterns:
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern, re.DOTALL)
+        compiled.append(pattern)
+    return compiled
+
+
+@pytest.mark.parametrize(
+    "buffer",
+    [
+        "nothing to see here",
+        "<LAVA_SIGNAL_ENDRUN 0_smoke 1234>\n<LAVA_TEST_RUNNER EXIT>",
+        "<LAVA_TEST_RUNNER EXIT><LAVA_SIGNAL_ENDRUN 0_smoke 1234>",
+        "boot\nlinux: pass\nsmoke: fail\n",
+        "not at the start smoke: fail\n",
+        "------------[ cut here ]------------\nWARNING\n---[ end trace 1234 ]---",
+        "Kernel panic - not syncing end Kernel panic",
+    ],
+)
+def test_searcher(buffer):
+    patterns = compile_patterns(PATTERNS)
+    expected = pexpect.expect.searcher_re(patterns)
+    searcher = ShellSearcher(patterns)
+    assert searcher.combined is not None
+    index = searcher.search(buffer, len(buffer))
+    assert index == expected.search(buffer, len(buffer))
+    if index >= 0:
+        assert searcher.start == expected.start
+        assert searcher.end == expected.end
+        assert searcher.match.groups() == expected.match.groups()
+        assert searcher.match.groupdict() == expected.match.groupdict()
+
+
+def test_combine_patterns():
+    assert combine_patterns((("a", re.DOTALL), ("(b)\\1", re.DOTALL))) is None
+    assert combine_patterns((("a", re.DOTALL), ("a", re.VERBOSE))) is None
+    assert combine_patterns((("(?P<name>a)", 0), ("(?P<name>b)", 0))) is None
+    # Global inline flags would apply to the other patterns
+    assert combine_patterns((("(?i)login:", 0), ("b", 0))) is None
+    assert combine_patterns((("a", 0), ("b(?s)", 0))) is None
+    assert combine_patterns(((r"\(\?i\)", 0), ("b", 0))) is not None
+    searcher = ShellSearcher(compile_patterns(["(?i)login:", "b"]))
+    assert searcher.combined is None
+    assert searcher.search("B LOGIN:", 8) == 0
+    combined = combine_patterns((("A", re.IGNORECASE), ("^b", re.MULTILINE)))
+    assert combined.search("xa").lastgroup == "_0"
+    assert combined.search("x\nb").lastgroup == "_1"
+    assert combined.search("xb") is None
+
+
+def test_searcher_overlap():
+    searcher = ShellSearcher(compile_patterns(["abc", "^start"]), overlap=4)
+    # Only the new data and the overlap are searched
+    assert searcher.search("abc" + "x" * 10, 5) == -1
+    assert searcher.search("x" * 10 + "abc", 3) == 0
+    assert searcher.search("x" * 10 + "ab" + "c", 1) == 0
+    # The buffer before the overlap is still used for anchors
+    assert searcher.search("x" * 10 + "start", 5) == -1
+    assert searcher.search("start", 5) == 1
+    # pexpect only passes the overlap and the new data
+    assert searcher.longest_string == 5
+    assert searcher.search("x" + "start", 5) == -1
+
+
+def test_shell_command():
+    command = "echo 'one <LAVA_SIGNAL_TESTCASE TEST_CASE_ID=a RESULT=pass> two'\n"
+    shell = ShellCommand(
+        command, Timeout("fake", 30), logger=DummyLogger(), search_overlap="16",
+    )
+    assert shell.search_overlap == 16
+    assert shell.expect([pexpect.EOF, r"<LAVA_SIGNAL_(\S+) ([^>]+)>"]) == 1
+    assert shell.match.groups() == ("TESTCASE", "TEST_CASE_ID=a RESULT=pass")
+    assert shell.before == "one "
+    assert shell.expect([r"two\s+", pexpect.EOF]) == 0
+    assert shell.expect([r"two", pexpect.EOF]) == 1
+
+
+def test_shell_command_overlap(monkeypatch):
+    windows = []
+    search = ShellSearcher.search
+
+    def spy(self, buffer, freshlen, searchwindowsize=None):
+        windows.append((buffer, freshlen))
+        return search(self, buffer, freshlen, searchwindowsize)
+
+    monkeypatch.setattr(ShellSearcher, "search", spy)
+    shell = ShellCommand(
+        "sh -c 'printf xxxxxxxx; sleep 0.2; printf sta; sleep 0.2; printf rt'\n",
+        Timeout("fake", 30),
+        logger=DummyLogger(),
+        search_overlap="4",
+    )
+    assert shell.expect([r"^start", r"start", pexpect.EOF]) == 1
+    assert shell.before == "x" * 8
+    # Only the new data and the overlap (plus one byte) are searched
+    assert windows[-1] == ("xxsta" + "rt", 2)
+    shell.close()
+
+
+def test_shell_logger(mocker):
+    logger = YAMLLogger("lava")
+    logger._log = mocker.Mock()
+    shell_logger = ShellLogger(logger)
+
+    shell_logger.write('one\r\n"two"\n\n\x1bthr')
+    assert shell_logger.line == "thr"
+    # All the lines of a read are logged in a single record
+    assert len(logger._log.mock_calls) == 1
+    data = logger._log.mock_calls[0][1][1].split("\n")
+    assert [yaml_load(d)["msg"] for d in data] == ["one", '\\"two\\"']
+
+    shell_logger.write("ee\n")
+    shell_logger.flush(force=True)
+    assert len(logger._log.mock_calls) == 2
+    assert yaml_load(logger._log.mock_calls[1][1][1])["msg"] == "three"
+    assert logger.line == 3
+
+
+def test_shell_command_read():
+    shell = ShellCommand(
+        "sh -c 'echo ready; sleep 1; echo hello; exit 3'\n",
+        Timeout("fake", 30),
+        logger=DummyLogger(),
+    )
+    assert shell.expect(["ready", pexpect.EOF]) == 0
+    assert shell.expect(["hello", pexpect.TIMEOUT], timeout=0.1) == 1
+    assert shell.expect(["hello", pexpect.TIMEOUT], timeout=5) == 0
+    assert shell.expect(["hello", pexpect.EOF]) == 1
+    assert shell.exitstatus == 3
+    shell.close()
+    assert shell.selector is None
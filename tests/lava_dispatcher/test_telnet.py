@@ -0,0 +1,155 @@
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+import socket
+import threading
+import time
+
+import pexpect
+import pytest
+
+from lava_common.exceptions import InfrastructureError
+from lava_common.timeout import Timeout
+from lava_dispatcher.connections.telnet import (
+    DO,
+    DONT,
+    ECHO,
+    IAC,
+    SB,
+    SE,
+    SGA,
+    WILL,
+    WONT,
+    TelnetCommand,
+    parse_command,
+)
+from tests.utils import DummyLogger
+
+
+def test_parse_command():
+    assert parse_command("telnet localhost 7000") == ("telnet", "localhost", 7000)
+    assert parse_command("/usr/bin/telnet 10.0.0.1") == ("telnet", "10.0.0.1", 23)
+    assert parse_command("nc localhost 7000") == ("tcp", "localhost", 7000)
+    assert parse_command("picocom -b 115200 /dev/ttyUSB0") == (
+        "tty",
+        "/dev/ttyUSB0",
+        115200,
+    )
+    assert parse_command("telnet localhost port") is None
+    assert parse_command("telnet -e ^] localhost 7000") is None
+    assert parse_command("picocom -b 1234 /dev/ttyUSB0") is None
+    assert parse_command("conmux-console board") is None
+    assert parse_command("") is None
+
+
+@pytest.fixture
+def server():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1)
+    data = {"received": b"", "port": sock.getsockname()[1]}
+
+    def serve():
+        conn, _ = sock.accept()
+        # negotiation split over several packets, escaped IAC and subnegotiation
+        conn.sendall(bytes([IAC, WILL, ECHO, IAC, WILL, SGA, IAC]))
+        time.sleep(0.1)
+        conn.sendall(bytes([DO, 24, IAC, SB, 24, 1, IAC, SE]) + b"login")
+        conn.sendall(bytes([IAC, IAC]) + b":\r\n")
+        while True:
+            received = conn.recv(1024)
+            if not received:
+                break
+            data["received"] += received
+        conn.close()
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    data["thread"] = thread
+    yield data
+    thread.join(10)
+    sock.close()
+
+
+def test_telnet_command(mocker, server):
+    shell = TelnetCommand(
+        "telnet 127.0.0.1 %d\n" % server["port"],
+        Timeout("fake", 30),
+        logger=mocker.Mock(),
+    )
+    assert shell.expect(["login(.*):", pexpect.TIMEOUT], timeout=5) == 0
+    # 0xff is not valid utf-8
+    assert shell.match.group(1) == "\ufffd"
+    assert shell.before == ""
+    # Only the bare carriage returns are followed by NUL
+    assert shell._encode("a\rb\r\n") == b"a\r\x00b\r\n"
+    shell.sendline("root", delay=10)
+    shell.sendcontrol("c")
+    shell.close()
+    assert shell.closed
+    server["thread"].join(10)
+
+    # The server echo and go-ahead suppression are accepted, only once
+    assert (
+        server["received"]
+        == bytes([IAC, DO, ECHO, IAC, DO, SGA, IAC, WONT, 24]) + b"root\n\x03"
+    )
+
+
+def test_telnet_command_errors(server):
+    with pytest.raises(InfrastructureError):
+        TelnetCommand("conmux-console board", Timeout("fake", 30), DummyLogger())
+
+    shell = TelnetCommand(
+        "nc 127.0.0.1 %d\n" % server["port"], Timeout("fake", 30), DummyLogger()
+    )
+    # Raw TCP: the telnet commands are not interpreted
+    assert shell.expect(["login(.*):", pexpect.TIMEOUT], timeout=5) == 0
+    assert shell.match.group(1) == "\ufffd\ufffd"
+    assert shell.before != ""
+    shell.close()
+    assert server["received"] == b""
+
+
+def test_telnet_command_pacing():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1)
+
+    def echo():
+        conn, _ = sock.accept()
+        while True:
+            received = conn.recv(1024)
+            if not received:
+                break
+            conn.sendall(received)
+        conn.close()
+
+    thread = threading.Thread(target=echo)
+    thread.start()
+    shell = TelnetCommand(
+        "nc 127.0.0.1 %d\n" % sock.getsockname()[1], Timeout("fake", 30), DummyLogger(),
+    )
+    start = time.monotonic()
+    shell.send("a\r\nb", delay=200)
+    # The writes are paced, the echo being read meanwhile
+    assert time.monotonic() - start >= 0.4
+    assert shell.buffer.startswith("a\r\n")
+    assert shell.expect(["a\r\nb", pexpect.TIMEOUT], timeout=5) == 0
+    shell.close()
+    thread.join(10)
+    sock.close()
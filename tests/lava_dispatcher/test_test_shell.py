@@ -21,8 +21,20 @@
 import re
 import os
 import decimal
+import time
+
+import pytest
+
 from lava_common.compat import yaml_safe_load
-from lava_common.exceptions import TestError, JobError, LAVATimeoutError
+from lava_common.exceptions import (
+    JobCanceled,
+    JobError,
+    LAVATimeoutError,
+    TestError,
+)
+from lava_dispatcher.actions.deploy.testdef import parallel_namespaces, runner_conf
+from lava_dispatcher.actions.test.shell import TestShellAction
+from lava_dispatcher.job import Job
 from tests.lava_dispatcher.test_basic import StdoutTestCase, Factory
 from tests.lava_dispatcher.test_multi import DummyLogger
 
@@ -172,3 +184,121 @@ class TestPatterns(StdoutTestCase):
         params = ["case", "pass"]
         with self.assertRaises(TestError):
             self.test_shell.signal_test_reference(params)
+
+
+def test_parallel_namespaces():
+    definitions = [{"name": "a"}, {"name": "b", "parallel": True}]
+    definitions += [{"name": "c", "parallel": True}, {"name": "d", "parallel": True}]
+    assert parallel_namespaces({"definitions": definitions}) == [None] * 4
+    parameters = {"definitions": definitions, "parallel-namespaces": ["ssh1", "ssh2"]}
+    assert parallel_namespaces(parameters) == [None, "ssh1", "ssh2", "ssh1"]
+    assert runner_conf() == "lava-test-runner.conf"
+    assert runner_conf("ssh1") == "lava-test-runner-ssh1.conf"
+
+
+def test_parallel_test_shells(mocker):
+    job = Job(1234, {}, None)
+    action = TestShellAction()
+    action.job = job
+    action.level = "3.1"
+    action.section = "test"
+    action.logger = mocker.Mock()
+    action.parameters = {
+        "namespace": "target",
+        "stage": 0,
+        "parallel-namespaces": ["ssh1", "ssh2"],
+        "definitions": [
+            {"name": "a", "repository": "git://a"},
+            {"name": "b", "repository": "git://b", "parallel": True},
+        ],
+    }
+    action.validate()
+    assert action.valid
+    connection = object()
+    action.set_namespace_data(
+        action="shared",
+        label="shared",
+        key="connection",
+        value=connection,
+        parameters={"namespace": "ssh1"},
+    )
+    mocker.patch.object(TestShellAction, "_prepare_shell", return_value="/lava-1234")
+    calls = []
+
+    def run_tests(self, conn, lava_test_results_dir, conf=None, feedbacks=()):
+        calls.append(
+            (conn, lava_test_results_dir, conf, self.parameters["connection-namespace"])
+        )
+        self.report["b-case"] = "pass"
+
+    mocker.patch.object(TestShellAction, "_run_tests", run_tests)
+
+    # Only one definition is marked as parallel: ssh2 is not used
+    threads = action._start_parallel_tests()
+    assert [t.namespace for t in threads] == ["ssh1"]
+    action._wait_parallel_tests(threads, time.time() + 10)
+    assert calls == [(connection, "/lava-1234", "lava-test-runner-ssh1.conf", "ssh1")]
+    assert action.report == {"b-case": "pass"}
+    assert action.errors == []
+
+    # The failures of the parallel test shells are raised
+    action.parameters["definitions"][0]["parallel"] = True
+    threads = action._start_parallel_tests()
+    assert [t.namespace for t in threads] == ["ssh1", "ssh2"]
+    with pytest.raises(JobError, match="No connection in namespace 'ssh2'"):
+        action._wait_parallel_tests(threads, time.time() + 10)
+
+    # The main connection cannot be a parallel one
+    action.parameters["connection-namespace"] = "ssh1"
+    action.validate()
+    assert not action.valid
+
+
+def test_parallel_test_shells_stop(mocker):
+    job = Job(1234, {}, None)
+    action = TestShellAction()
+    action.job = job
+    action.level = "3.1"
+    action.section = "test"
+    action.logger = mocker.Mock()
+    action.parameters = {
+        "namespace": "target",
+        "stage": 0,
+        "parallel-namespaces": ["ssh1"],
+        "definitions": [
+            {"name": "a", "repository": "git://a"},
+            {"name": "b", "repository": "git://b", "parallel": True},
+        ],
+    }
+    connection = mocker.Mock()
+    action.set_namespace_data(
+        action="shared",
+        label="shared",
+        key="connection",
+        value=connection,
+        parameters={"namespace": "ssh1"},
+    )
+    mocker.patch.object(TestShellAction, "_prepare_shell", return_value="/lava-1234")
+
+    def run_tests(self, conn, lava_test_results_dir, conf=None, feedbacks=()):
+        # Wait for the output until the test shell is stopped
+        while True:
+            self._check_stop()
+            time.sleep(0.01)
+
+    mocker.patch.object(TestShellAction, "_run_tests", run_tests)
+
+    # The test shells still running at the end of the action are stopped
+    threads = action._start_parallel_tests()
+    action._wait_parallel_tests(threads, time.time() + 0.1)
+    assert action.errors == ["Parallel test shell on 'ssh1' timed out"]
+    assert not threads[0].is_alive()
+    assert isinstance(threads[0].exc, JobCanceled)
+    connection.sendcontrol.assert_called_once_with("c")
+
+    # And on the failures of the main test shell
+    action.errors.clear()
+    threads = action._start_parallel_tests()
+    action._stop_parallel_tests(threads)
+    assert not threads[0].is_alive()
+    assert isinstance(threads[0].exc, JobCanceled)
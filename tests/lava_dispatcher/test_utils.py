@@ -169,6 +169,39 @@ def test_no_history(setup, tmpdir):
     assert not (tmpdir / "git.clone1" / ".git").exists()
 
 
+def test_mirror(setup, tmpdir, mocker):
+    git = vcs.GitHelper("git", str(tmpdir / "mirrors"))
+    run = mocker.spy(subprocess, "check_output")
+    assert (
+        git.clone("git.clone1", branch="testing")
+        == "f2589a1b7f0cfc30ad6303433ba4d5db1a542c2d"
+    )
+    assert len(list((tmpdir / "mirrors").listdir("*.git"))) == 1
+    assert (
+        subprocess.check_output(  # nosec - unit test support.
+            ["git", "-C", "git.clone1", "remote", "get-url", "origin"]
+        )
+        == b"git\n"
+    )
+
+    # The mirror is updated for branches
+    run.reset_mock()
+    assert git.clone("git.clone2") == "a7af835862da0e0592eeeac901b90e8de2cf5b67"
+    assert any("fetch" in c[1][0] for c in run.mock_calls)
+
+    # But not for commits already in the mirror
+    run.reset_mock()
+    assert (
+        git.clone("git.clone3", revision="2f83e6d8189025e356a9563b8d78bdc8e2e9a3ed")
+        == "2f83e6d8189025e356a9563b8d78bdc8e2e9a3ed"
+    )
+    assert not any("fetch" in c[1][0] for c in run.mock_calls)
+
+    # The mirror is used when the repository is not available
+    os.rename("git", "git.old")
+    assert git.clone("git.clone4") == "a7af835862da0e0592eeeac901b90e8de2cf5b67"
+
+
 ALLOWED = ["commands", "deploy", "test"]
 
 
@@ -0,0 +1,145 @@
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+import asyncio
+import contextlib
+import os
+from pathlib import Path
+import time
+
+import pytest
+
+import lava_dispatcher.worker as worker
+
+
+def test_trash(monkeypatch, tmpdir):
+    tmp = Path(str(tmpdir))
+    (tmp / "tmp" / "12" / "rootfs").mkdir(parents=True)
+    (tmp / "tmp" / "12" / "rootfs" / "bin").write_text("", encoding="utf-8")
+    monkeypatch.setattr(worker, "STALE_CONFIG", {tmp / "tmp": "{prefix}{job_id}"})
+
+    worker.trash(tmp / "tmp" / "12")
+    assert not (tmp / "tmp" / "12").exists()
+    assert len(list((tmp / "tmp" / worker.TRASH_DIR).iterdir())) == 1
+
+    async def remove():
+        task = asyncio.ensure_future(worker.remove_trash())
+        await asyncio.sleep(1)
+        task.cancel()
+
+    asyncio.run(remove())
+    assert list((tmp / "tmp" / worker.TRASH_DIR).iterdir()) == []
+
+
+def test_evict_downloads(monkeypatch, tmpdir):
+    downloads = Path(str(tmpdir)) / "downloads"
+    downloads.mkdir()
+    monkeypatch.setattr(worker, "downloads_dir", downloads)
+
+    for (index, name) in enumerate(["old", "used", "new"]):
+        (downloads / name).write_text(name, encoding="utf-8")
+        (downloads / f"{name}.json").write_text("{}", encoding="utf-8")
+        os.utime(str(downloads / name), (index, index))
+    # "used" is still linked in a job directory
+    os.link(str(downloads / "used"), str(tmpdir / "used"))
+
+    # Enough free space
+    monkeypatch.setattr(worker, "min_free_space", 0)
+    worker.evict_downloads()
+    assert len(list(downloads.iterdir())) == 6
+
+    # Not enough free space: remove every unused downloads
+    monkeypatch.setattr(worker, "min_free_space", 101)
+    worker.evict_downloads()
+    assert sorted(p.name for p in downloads.iterdir()) == ["used", "used.json"]
+
+
+def test_retain_other_filesystem(monkeypatch, tmpdir):
+    downloads = Path(str(tmpdir)) / "downloads"
+    monkeypatch.setattr(worker, "downloads_dir", downloads)
+    monkeypatch.setattr(worker, "retain_downloads", True)
+    (tmpdir / "rootfs").write_text("rootfs", encoding="utf-8")
+
+    def link(src, dst):
+        raise OSError(18, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", link)
+    worker.retain(Path(str(tmpdir / "rootfs")), {"etag": "1234"})
+    assert (downloads / "rootfs").read_text(encoding="utf-8") == "rootfs"
+    assert worker.read_retained(Path(str(tmpdir / "rootfs"))) == {"etag": "1234"}
+
+
+def test_capacity(monkeypatch, tmpdir):
+    monkeypatch.setattr(worker, "DISPATCHER_DOWNLOAD_DIR", str(tmpdir))
+    capacity = worker.capacity()
+    assert float(capacity["load"]) >= 0
+    assert int(capacity["free_memory"]) > 0
+    assert int(capacity["free_disk"]) >= 0
+
+
+def test_zygote(monkeypatch, tmpdir):
+    lava_run = tmpdir / "lava-run"
+    lava_run.write_text(
+        "import os\nimport sys\nprint(os.environ['JOB'], sys.argv[1:])\nsys.exit(3)\n",
+        encoding="utf-8",
+    )
+    lava_run.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmpdir), prepend=os.pathsep)
+    monkeypatch.setattr(worker, "ZYGOTE_MODULES", [])
+    (tmpdir / "stdout").write_text("", encoding="utf-8")
+    (tmpdir / "stderr").write_text("", encoding="utf-8")
+
+    zygote = worker.Zygote()
+    pid = zygote.spawn(
+        12,
+        ["--job-id=12"],
+        {"JOB": "12"},
+        str(tmpdir / "stdout"),
+        str(tmpdir / "stderr"),
+    )
+    assert pid not in [0, zygote.pid]
+    with contextlib.suppress(FileNotFoundError):
+        assert "lava-run" in Path(f"/proc/{pid}/cmdline").read_text()
+    while Path(f"/proc/{pid}").exists():
+        time.sleep(0.1)
+    assert (tmpdir / "stdout").read_text(encoding="utf-8") == "12 ['--job-id=12']\n"
+
+    # The child dies before starting lava-run
+    monkeypatch.setattr(os, "getcwd", lambda: str(tmpdir / "missing"))
+    with pytest.raises(OSError):
+        zygote.spawn(13, [], {}, str(tmpdir / "stdout"), str(tmpdir / "stderr"))
+
+    # The zygote is restarted after an upgrade
+    assert not zygote.outdated()
+    monkeypatch.setattr(worker, "version", lambda: "2099.01")
+    assert zygote.outdated()
+
+    # The zygote leaves when the worker closes the socket
+    zygote.close()
+    assert zygote.proc.returncode == 0
+
+    # The new zygote records the new version
+    zygote = worker.Zygote()
+    assert zygote.version == "2099.01"
+    assert not zygote.outdated()
+
+    # The zygote died
+    zygote.proc.kill()
+    zygote.proc.wait()
+    with pytest.raises(OSError, match="zygote is dead"):
+        zygote.spawn(14, [], {}, str(tmpdir / "stdout"), str(tmpdir / "stderr"))
+    zygote.close()
@@ -0,0 +1,106 @@
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+import os
+import threading
+import time
+
+from lava_dispatcher.utils.cache import DownloadCache
+
+
+def test_cache_entry(tmpdir):
+    cache = DownloadCache(str(tmpdir / "cache"), 1024)
+    (tmpdir / "rootfs").write_text("rootfs", encoding="utf-8")
+
+    with cache.entry("md5:1234|None") as entry:
+        assert entry.get(str(tmpdir / "dest")) is None
+        entry.store(str(tmpdir / "rootfs"), {"size": 6})
+
+    with cache.entry("md5:1234|None") as entry:
+        assert entry.get(str(tmpdir / "dest")) == {"size": 6}
+    assert (tmpdir / "dest").read_text(encoding="utf-8") == "rootfs"
+
+    # The entry can be read in place
+    with cache.entry("md5:1234|None") as entry:
+        assert entry.metadata() == {"size": 6}
+        assert entry.path.read_text(encoding="utf-8") == "rootfs"
+
+    # The copy is not linked to the cache
+    (tmpdir / "dest").write_text("modified", encoding="utf-8")
+    with cache.entry("md5:1234|None") as entry:
+        assert entry.get(str(tmpdir / "dest2")) == {"size": 6}
+    assert (tmpdir / "dest2").read_text(encoding="utf-8") == "rootfs"
+
+    # Other keys are not found
+    with cache.entry("md5:1234|xz") as entry:
+        assert entry.get(str(tmpdir / "dest")) is None
+        assert entry.metadata() is None
+
+
+def test_cache_entry_concurrent(tmpdir):
+    cache = DownloadCache(str(tmpdir / "cache"), 1024)
+    (tmpdir / "rootfs").write_text("rootfs", encoding="utf-8")
+    results = []
+
+    def job():
+        with cache.entry("sha256:abcd|None") as entry:
+            metadata = entry.get(str(tmpdir / "dest"))
+            if metadata is None:
+                time.sleep(0.5)
+                entry.store(str(tmpdir / "rootfs"), {"size": 6})
+            results.append(metadata)
+
+    threads = [threading.Thread(target=job) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Only one job populated the entry
+    assert sorted(results, key=bool) == [None, {"size": 6}, {"size": 6}]
+
+
+def test_cache_evict(tmpdir):
+    cache = DownloadCache(str(tmpdir / "cache"), 10)
+    for (index, key) in enumerate(["old", "used", "new"]):
+        (tmpdir / key).write_text("123456", encoding="utf-8")
+        with cache.entry(key) as entry:
+            entry.store(str(tmpdir / key), {"size": 6})
+            os.utime(str(entry.path), (index, index))
+
+    # "used" is being read by a job
+    with cache.entry("used") as entry:
+        used = entry.path
+        cache.evict()
+    assert used.exists()
+    assert len([p for p in (tmpdir / "cache").listdir() if not p.ext]) == 1
+
+    cache.evict()
+    assert used.exists()
+
+
+def test_cache_entry_link(tmpdir):
+    cache = DownloadCache(str(tmpdir / "cache"), 1024)
+    (tmpdir / "rootfs").write_binary(b"QFI\xfb\x00\x00\x00\x03")
+
+    with cache.entry("md5:1234|None") as entry:
+        assert not entry.is_qcow2()
+        entry.store(str(tmpdir / "rootfs"), {"size": 8})
+
+    with cache.entry("md5:1234|None") as entry:
+        assert entry.is_qcow2()
+        assert entry.get(str(tmpdir / "dest"), link=True) == {"size": 8}
+        assert os.stat(str(tmpdir / "dest")).st_ino == entry.path.stat().st_ino
@@ -0,0 +1,168 @@
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+import gzip
+import shutil
+import tarfile
+
+import pytest
+
+from lava_common.exceptions import JobError
+from lava_dispatcher.job import Job
+from lava_dispatcher.utils.compression import (
+    append_cpio,
+    compress_command,
+    compress_file,
+    compression_threads,
+    cpio_entries,
+    decompress_command,
+    decompress_file,
+    untar_file,
+)
+
+
+def test_compression_threads(mocker):
+    mocker.patch("os.cpu_count", return_value=16)
+    assert compression_threads(None) == 16
+    assert compression_threads(Job(1234, {}, None)) == 16
+    job = Job(1234, {"dispatcher": {"compression_threads": 4}}, None)
+    assert compression_threads(job) == 4
+
+
+def test_commands(mocker):
+    installed = {"xz", "gzip", "bzip2", "unxz", "gunzip", "bunzip2", "zstd", "pigz"}
+    mocker.patch(
+        "shutil.which", side_effect=lambda cmd: cmd if cmd in installed else None
+    )
+    mocker.patch("lava_dispatcher.utils.compression.which")
+
+    assert compress_command("xz") == ["xz", "--check=crc32", "-c"]
+    assert compress_command("xz", 4) == ["xz", "--check=crc32", "-T4", "-c"]
+    assert compress_command("gz", 4) == ["pigz", "-p", "4", "-c"]
+    # pbzip2 is not installed
+    assert compress_command("bz2", 4) == ["bzip2", "-c"]
+    assert compress_command("zstd", 4) == ["zstd", "-q", "-T4", "-c"]
+    assert decompress_command("gz") == ["gunzip", "-c"]
+    assert decompress_command("gz", 4) == ["pigz", "-d", "-p", "4", "-c"]
+    assert decompress_command("zstd", 4) == ["zstd", "-d", "-q", "-T4", "-c"]
+
+    with pytest.raises(JobError):
+        compress_command("zip")
+    with pytest.raises(JobError):
+        decompress_command("lz4")
+
+
+@pytest.mark.parametrize("compression", ["gz", "xz", "bz2", "zstd"])
+@pytest.mark.parametrize("threads", [1, 2])
+def test_compress_file(tmpdir, compression, threads):
+    if compression == "bz2" and not shutil.which("bzip2"):
+        pytest.skip("bzip2 is not installed")
+    if compression == "zstd" and not shutil.which("zstd"):
+        pytest.skip("zstd is not installed")
+
+    (tmpdir / "data").write_text("hello world\n" * 1000, encoding="utf-8")
+    compressed = compress_file(str(tmpdir / "data"), compression, threads)
+    assert compressed == str(tmpdir / ("data.%s" % compression))
+    assert not (tmpdir / "data").exists()
+
+    decompressed = decompress_file(compressed, compression, threads)
+    assert decompressed == str(tmpdir / "data")
+    assert not (tmpdir / ("data.%s" % compression)).exists()
+    assert (tmpdir / "data").read_text(encoding="utf-8") == "hello world\n" * 1000
+
+
+def newc(*names):
+    # Entries of one byte, followed by the trailer
+    data = b""
+    for name in names + ("TRAILER!!!",):
+        size = 0 if name == "TRAILER!!!" else 1
+        name = name.encode() + b"\0"
+        data += b"070701" + b"0" * 48 + b"%08X" % size + b"0" * 32
+        data += b"%08X" % len(name) + b"0" * 8 + name
+        data += b"\0" * (-len(data) % 4) + b"x\0\0\0" * size
+    return data
+
+
+def test_cpio_entries(tmpdir):
+    (tmpdir / "ramdisk.cpio").write_binary(newc(".", "./lib", "./lib/mod.ko"))
+    assert cpio_entries(str(tmpdir / "ramdisk.cpio")) == {".", "lib", "lib/mod.ko"}
+
+    # Zero padding after the trailer
+    (tmpdir / "ramdisk.cpio").write_binary(newc("usr", "lib") + b"\0" * 512)
+    assert cpio_entries(str(tmpdir / "ramdisk.cpio")) == {"usr", "lib"}
+
+    with gzip.open(str(tmpdir / "ramdisk.cpio.gz"), "wb") as f_out:
+        f_out.write(newc("usr", "lib"))
+    assert cpio_entries(str(tmpdir / "ramdisk.cpio.gz"), "gz") == {"usr", "lib"}
+
+    # Concatenated or invalid archives cannot be listed
+    (tmpdir / "ramdisk.cpio").write_binary(newc("usr") + newc("lib"))
+    assert cpio_entries(str(tmpdir / "ramdisk.cpio")) is None
+    (tmpdir / "ramdisk.cpio").write_binary(newc("usr")[:-10])
+    assert cpio_entries(str(tmpdir / "ramdisk.cpio")) is None
+    (tmpdir / "ramdisk.cpio").write_binary(b"\x1f\x8b" + newc("usr"))
+    assert cpio_entries(str(tmpdir / "ramdisk.cpio")) is None
+    assert cpio_entries(str(tmpdir / "ramdisk.cpio"), "gz") is None
+    assert cpio_entries(str(tmpdir / "missing.cpio")) is None
+
+
+def test_append_cpio(mocker, tmpdir):
+    def cpio(directory, filename, exclude):
+        with open(filename, "wb") as f_out:
+            f_out.write(b"070701-new")
+        return "1 block"
+
+    cpio = mocker.patch("lava_dispatcher.utils.compression.cpio", side_effect=cpio)
+    (tmpdir / "overlay" / "lib" / "modules").ensure(dir=True)
+    (tmpdir / "overlay" / "lib" / "modules" / "mod.ko").write_text("", "utf-8")
+    (tmpdir / "overlay" / "usr").ensure(dir=True)
+    (tmpdir / "ramdisk.cpio").write_binary(b"070701-original")
+
+    overlay = str(tmpdir / "overlay")
+    assert append_cpio(overlay, str(tmpdir / "ramdisk.cpio")) == "1 block"
+    cpio.assert_called_once_with(overlay, str(tmpdir / "ramdisk.cpio.append"), {"."})
+    # The new archive is 4 bytes aligned
+    assert (tmpdir / "ramdisk.cpio").read_binary() == b"070701-original\x00070701-new"
+    assert not (tmpdir / "ramdisk.cpio.append").exists()
+
+    # Compressed segment, without the directories of the original archive
+    cpio.reset_mock()
+    entries = {".", "lib", "lib/modules/mod.ko", "usr/lib"}
+    append_cpio(overlay, str(tmpdir / "ramdisk.cpio"), "gz", 1, entries)
+    cpio.assert_called_once_with(
+        overlay, str(tmpdir / "ramdisk.cpio.append"), {".", "lib"}
+    )
+    data = (tmpdir / "ramdisk.cpio").read_binary()
+    assert data[:28] == b"070701-original\x00070701-new\x00\x00"
+    assert gzip.decompress(data[28:]) == b"070701-new"
+    assert not (tmpdir / "ramdisk.cpio.append.gz").exists()
+
+
+@pytest.mark.parametrize("tar", ["/bin/tar", None])
+def test_untar_file(mocker, tmpdir, tar):
+    mocker.patch("shutil.which", return_value=tar)
+    (tmpdir / "modules" / "lib").ensure(dir=True)
+    (tmpdir / "modules" / "lib" / "mod.ko").write_text("module", encoding="utf-8")
+    with tarfile.open(str(tmpdir / "modules.tar.xz"), "w:xz") as tar_file:
+        tar_file.add(str(tmpdir / "modules"), arcname=".")
+
+    untar_file(str(tmpdir / "modules.tar.xz"), str(tmpdir / "root"))
+    assert (tmpdir / "root" / "lib" / "mod.ko").read_text(encoding="utf-8") == "module"
+
+    (tmpdir / "invalid.tar").write_text("invalid", encoding="utf-8")
+    with pytest.raises(JobError):
+        untar_file(str(tmpdir / "invalid.tar"), str(tmpdir / "root"))
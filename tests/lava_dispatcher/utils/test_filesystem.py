@@ -0,0 +1,80 @@
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+import shutil
+import subprocess  # nosec - unit test support.
+import tarfile
+
+import pytest
+
+from lava_dispatcher.utils.filesystem import prepare_guestfs
+
+
+@pytest.fixture
+def overlay(tmpdir):
+    (tmpdir / "lava-4212" / "bin").ensure(dir=True)
+    (tmpdir / "lava-4212" / "bin" / "lava-test-runner").write_text(
+        "#!/bin/sh\n", encoding="utf-8"
+    )
+    with tarfile.open(str(tmpdir / "overlay.tar.gz"), "w:gz") as tar:
+        tar.add(str(tmpdir / "lava-4212"), arcname="lava-4212")
+    return str(tmpdir / "overlay.tar.gz")
+
+
+@pytest.mark.skipif(not shutil.which("debugfs"), reason="debugfs is not installed")
+def test_prepare_guestfs_mke2fs(mocker, overlay, tmpdir):
+    check_output = subprocess.check_output
+
+    def run(cmd, **kwargs):
+        if cmd[0] == "qemu-img":
+            shutil.copyfile(cmd[-2], cmd[-1])
+            return b""
+        return check_output(cmd, **kwargs)
+
+    mocker.patch(
+        "shutil.which", side_effect=lambda cmd: cmd if cmd == "qemu-img" else "mke2fs"
+    )
+    mocker.patch(
+        "lava_dispatcher.utils.filesystem.subprocess.check_output", side_effect=run
+    )
+    guestfs = mocker.patch("lava_dispatcher.utils.filesystem.guestfs.GuestFS")
+
+    output = str(tmpdir / "lava-guest.qcow2")
+    blkid = prepare_guestfs(output, overlay, 16)
+    # The appliance is not started
+    guestfs.assert_not_called()
+    assert not (tmpdir / "lava-guest.qcow2.raw").exists()
+
+    # The content of lava-4212 is at the root of the filesystem
+    files = check_output(["debugfs", "-R", "ls /bin", output])  # nosec
+    assert b"lava-test-runner" in files
+    stats = check_output(["debugfs", "-R", "stats", output])  # nosec
+    assert ("Filesystem UUID:          %s" % blkid).encode() in stats
+    assert b"Filesystem volume name:   LAVA" in stats
+
+
+def test_prepare_guestfs_fallback(mocker, overlay, tmpdir):
+    mocker.patch("shutil.which", return_value=None)
+    guestfs = mocker.patch("lava_dispatcher.utils.filesystem.guestfs.GuestFS")
+    guestfs().list_devices.return_value = ["/dev/sda"]
+    guestfs().blkid.return_value = {"UUID": "1234"}
+
+    output = str(tmpdir / "lava-guest.qcow2")
+    assert prepare_guestfs(output, overlay, 16) == "1234"
+    guestfs().disk_create.assert_called_once_with(output, "qcow2", 16 * 1024 * 1024)
+    guestfs().mke2fs.assert_called_once_with("/dev/sda", label="LAVA")
+    guestfs().tar_in.assert_called_once()
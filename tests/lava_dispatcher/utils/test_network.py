@@ -16,10 +16,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import socket
+
 import pytest
 
 from lava_common.exceptions import LAVABug
-from lava_dispatcher.utils.network import dispatcher_ip
+from lava_dispatcher.utils.network import dispatcher_ip, reserve_port
 
 
 def test_dispatcher_ip_missing():
@@ -78,3 +80,31 @@ def test_dispatcher_ip_nfs():
     )
     # Fall back to dispatcher_ip if dispatcher_nfs_ip is missing.
     assert dispatcher_ip({"dispatcher_ip": "127.0.0.1"}, "nfs") == "127.0.0.1"
+
+
+def test_reserve_port(mocker, tmpdir):
+    mocker.patch("lava_dispatcher.utils.network.XNBD_PORT_RANGE_MIN", 55000)
+    mocker.patch("lava_dispatcher.utils.network.XNBD_PORT_RANGE_MAX", 55002)
+    mocker.patch("random.randrange", return_value=0)
+
+    assert reserve_port({"nbd_server_port": "10000"}, str(tmpdir)).port == "10000"
+
+    first = reserve_port({"nbd_server_port": "auto"}, str(tmpdir))
+    assert first.port == 55000
+    # The port is reserved for the other jobs until released
+    second = reserve_port({}, str(tmpdir))
+    assert second.port == 55001
+    assert reserve_port({}, str(tmpdir)).port == 10809
+
+    first.release()
+    first.release()
+    assert reserve_port({}, str(tmpdir)).port == 55000
+
+
+def test_reserve_port_in_use(mocker, tmpdir):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("", 0))
+        port = sock.getsockname()[1]
+        mocker.patch("lava_dispatcher.utils.network.XNBD_PORT_RANGE_MIN", port)
+        mocker.patch("lava_dispatcher.utils.network.XNBD_PORT_RANGE_MAX", port + 1)
+        assert reserve_port({}, str(tmpdir)).port == 10809
@@ -0,0 +1,99 @@
+# Copyright (C) 2021-present Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses>.
+
+import fcntl
+import threading
+import time
+
+from lava_dispatcher.utils.prefetch import (
+    lock_path,
+    prefetch_path,
+    prefetch_resources,
+    wait_for_prefetch,
+)
+
+
+def test_prefetch_resources():
+    definition = {
+        "actions": [
+            {
+                "deploy": {
+                    "to": "tftp",
+                    "kernel": {"url": "http://example.com/zImage", "type": "zimage"},
+                    "rootfs": {
+                        "url": "https://example.com/rootfs.ext4.xz",
+                        "headers": {"Authorization": "secret"},
+                    },
+                    "dtb": {"url": "file:///tmp/board.dtb"},
+                }
+            },
+            {
+                "deploy": {
+                    "to": "fastboot",
+                    "images": {
+                        "boot": {"url": "http://example.com/boot.img"},
+                        "kernel": {"url": "http://example.com/zImage"},
+                        "system": {"url": "downloads://system.img"},
+                    },
+                }
+            },
+            {"boot": {"method": "u-boot"}},
+            {"test": {"definitions": [{"repository": "http://example.com/t.git"}]}},
+        ]
+    }
+    assert prefetch_resources(definition) == [
+        {"url": "http://example.com/zImage", "headers": {}},
+        {
+            "url": "https://example.com/rootfs.ext4.xz",
+            "headers": {"Authorization": "secret"},
+        },
+        {"url": "http://example.com/boot.img", "headers": {}},
+    ]
+    assert prefetch_resources({}) == []
+
+
+def test_prefetch_path():
+    path = prefetch_path("/var/lib/lava/dispatcher/tmp/12", "http://example.com/a")
+    assert str(path.parent) == "/var/lib/lava/dispatcher/tmp/12/prefetch"
+    assert path != prefetch_path("/var/lib/lava/dispatcher/tmp/12", "http://b")
+
+
+def test_wait_for_prefetch(tmpdir):
+    path = prefetch_path(str(tmpdir), "http://example.com/rootfs.img")
+
+    # Nothing prefetched
+    assert wait_for_prefetch(path) is None
+
+    # The worker is still downloading
+    path.parent.mkdir()
+    lock = lock_path(path).open("wb")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+
+    def worker():
+        time.sleep(0.5)
+        path.write_text("hello", encoding="utf-8")
+        lock.close()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert wait_for_prefetch(path) == path
+    thread.join()
+    assert path.read_text(encoding="utf-8") == "hello"
+
+    # The download failed
+    path.unlink()
+    assert wait_for_prefetch(path) is None
@@ -85,6 +85,43 @@ class TestMetaTypes(TestCaseWithFactory):
             count,
         )
 
+    def test_profile(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        job_def = yaml_safe_load(job.definition)
+        job_ctx = job_def.get("context", {})
+        job_ctx.update({"no_kvm": True})
+        device = Device.objects.get(hostname="fakeqemu1")
+        device_config = device.load_configuration(job_ctx)  # raw dict
+        parser = JobParser()
+        obj = PipelineDevice(device_config)
+        pipeline_job = parser.parse(job.definition, obj, job.id, None, "")
+        allow_missing_path(
+            pipeline_job.pipeline.validate_actions, self, "qemu-system-x86_64"
+        )
+        pipeline = pipeline_job.describe()
+        # Added by lava-run to the actions that did run
+        pipeline["pipeline"][0]["profile"] = {
+            "duration": 12.5,
+            "cpu": 1.25,
+            "cpu_approximate": True,
+            "downloaded": 4096,
+            "logged": 2048,
+        }
+        map_metadata(yaml_dump(pipeline), job)
+        action_data = ActionData.objects.get(
+            testdata__testjob=job, action_level=pipeline["pipeline"][0]["level"]
+        )
+        self.assertEqual(action_data.duration, decimal.Decimal("12.5"))
+        self.assertEqual(action_data.cpu_time, decimal.Decimal("1.25"))
+        self.assertTrue(action_data.cpu_approximate)
+        self.assertEqual(action_data.downloaded, 4096)
+        self.assertEqual(action_data.logged, 2048)
+        action_data = ActionData.objects.get(
+            testdata__testjob=job, action_level=pipeline["pipeline"][1]["level"]
+        )
+        self.assertIsNone(action_data.cpu_time)
+        self.assertIsNone(action_data.downloaded)
+
     def test_export(self):
         job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
         test_suite = TestSuite.objects.get_or_create(name="lava", job=job)[0]
@@ -23,11 +23,15 @@ from datetime import timedelta
 import logging
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
 from lava_scheduler_app.models import Device, DeviceType, TestJob, Worker
-from lava_scheduler_app.scheduler import schedule, schedule_health_checks
+from lava_scheduler_app.scheduler import (
+    schedule,
+    schedule_health_checks,
+    worker_summary,
+)
 
 
 def _minimal_valid_job(self):
@@ -850,3 +854,54 @@ class TestJobLimit(TestCase):
         schedule(self.logger)
         assert TestJob.objects.filter(state=TestJob.STATE_SCHEDULED).count() == 4
         assert TestJob.objects.filter(state=TestJob.STATE_SUBMITTED).count() == 0
+
+
+# test the job_limit with device type weights and the worker live capacity
+class TestWorkerCapacity(TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.worker01 = Worker.objects.create(
+            hostname="worker-01", state=Worker.STATE_ONLINE, job_limit=4
+        )
+        self.user = User.objects.create(username="user-01")
+        self.device_type01 = DeviceType.objects.create(
+            name="qemu", disable_health_check=True
+        )
+        for i in range(0, 4):
+            Device.objects.create(
+                hostname=f"qemu0{i}",
+                device_type=self.device_type01,
+                worker_host=self.worker01,
+                health=Device.HEALTH_GOOD,
+            )
+        for i in range(0, 4):
+            TestJob.objects.create(
+                requested_device_type=self.device_type01,
+                submitter=self.user,
+                definition=_minimal_valid_job(None),
+            )
+
+    @override_settings(WORKER_DEVICE_TYPE_WEIGHTS={"qemu": 2})
+    def test_device_type_weights(self):
+        schedule(self.logger)
+        assert TestJob.objects.filter(state=TestJob.STATE_SCHEDULED).count() == 2
+        assert TestJob.objects.filter(state=TestJob.STATE_SUBMITTED).count() == 2
+        assert worker_summary()["worker-01"].busy == 4
+
+    @override_settings(WORKER_MIN_FREE_MEMORY=2048, WORKER_MAX_LOAD=2)
+    def test_capacity(self):
+        self.worker01.load = 0.5
+        self.worker01.free_memory = 1024
+        self.worker01.save()
+        summary = worker_summary()["worker-01"]
+        assert summary.overused()
+        reason = "having 1024MB of free memory (less than 2048MB)"
+        assert summary.reason() == reason
+        schedule(self.logger)
+        assert TestJob.objects.filter(state=TestJob.STATE_SCHEDULED).count() == 0
+
+        self.worker01.free_memory = 4096
+        self.worker01.save()
+        assert not worker_summary()["worker-01"].overused()
+        schedule(self.logger)
+        assert TestJob.objects.filter(state=TestJob.STATE_SCHEDULED).count() == 4
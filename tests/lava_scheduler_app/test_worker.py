@@ -472,6 +472,50 @@ def test_internal_v1_workers_get(client, mocker):
     w = Worker.objects.get(hostname="worker-01")
     assert w.last_ping == now
     assert w.state == Worker.STATE_ONLINE
+    assert w.load is None
+    assert w.free_memory is None
+    assert w.free_disk is None
+
+    # Test the live capacity
+    ret = client.get(
+        reverse("lava.scheduler.internal.v1.workers", args=["worker-01"]),
+        {"version": __version__, "load": "0.5", "free_memory": "-1"},
+        HTTP_LAVA_TOKEN=token,
+    )
+    assert ret.status_code == 400
+    assert ret.json()["error"] == "Invalid 'free_memory'"
+
+    for load in ["nan", "inf", "-inf", "-0.5"]:
+        ret = client.get(
+            reverse("lava.scheduler.internal.v1.workers", args=["worker-01"]),
+            {"version": __version__, "load": load},
+            HTTP_LAVA_TOKEN=token,
+        )
+        assert ret.status_code == 400
+        assert ret.json()["error"] == "Invalid 'load'"
+
+    ret = client.get(
+        reverse("lava.scheduler.internal.v1.workers", args=["worker-01"]),
+        {"version": __version__, "load": "0.5", "free_memory": "1024"},
+        HTTP_LAVA_TOKEN=token,
+    )
+    assert ret.status_code == 200
+    w.refresh_from_db()
+    assert w.load == 0.5
+    assert w.free_memory == 1024
+    assert w.free_disk is None
+
+    # Extreme values are clamped
+    ret = client.get(
+        reverse("lava.scheduler.internal.v1.workers", args=["worker-01"]),
+        {"version": __version__, "load": "1e300", "free_disk": str(2 ** 40)},
+        HTTP_LAVA_TOKEN=token,
+    )
+    assert ret.status_code == 200
+    w.refresh_from_db()
+    assert w.load == 1000.0
+    assert w.free_memory is None
+    assert w.free_disk == 2 ** 31 - 1
 
     # Add jobs and test again
     objs = create_objects(w)